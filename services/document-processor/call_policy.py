@@ -0,0 +1,244 @@
+"""
+Politique des appels vers les API externes (Vision, VoyageAI, Document AI) pour TechnicIA.
+
+Délais par appel : chaque appel reçoit le plus court de son délai propre et
+du temps restant sur le budget de bout en bout de la requête. Le budget est
+fixé par l'en-tête X-Request-Budget (secondes) ou, à défaut, par
+REQUEST_BUDGET. Un appel lancé trop tard échoue immédiatement au lieu
+d'occuper l'API pour une réponse que plus personne n'attend.
+
+Requêtes doublées : pour un appel idempotent encore sans réponse au-delà du
+percentile HEDGE_PERCENTILE des latences récentes de l'API, une seconde
+requête identique est envoyée. La première réponse réussie l'emporte et
+l'autre est annulée. La part d'appels doublés est plafonnée
+(HEDGE_MAX_RATIO) pour ne pas doubler la charge d'une API déjà lente pour
+tous.
+
+Les limites de concurrence vers une API (DOCUMENT_AI_MAX_CONCURRENCY,
+ANALYZE_CONCURRENCY, CLASSIFY_CONCURRENCY, VISION_BATCH_CONCURRENCY) valent
+pour le service entier : chaque worker uvicorn (WEB_CONCURRENCY) en reçoit
+sa part (per_worker), pour que leur somme ne dépasse pas la limite.
+
+Les appels bloquants exécutés dans un thread ne peuvent pas être interrompus :
+le délai leur est transmis (timeout gRPC ou HTTP) pour qu'ils se terminent
+d'eux-mêmes, et la réponse d'un appel annulé est ignorée.
+
+Ce module est copié à l'identique dans chaque service qui appelle une API
+externe, chaque service étant construit dans son propre contexte Docker.
+"""
+import asyncio
+import contextlib
+import contextvars
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterator, List, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+# Budget de bout en bout par défaut d'une requête (secondes, 0 pour aucun)
+REQUEST_BUDGET = float(os.getenv("REQUEST_BUDGET", "0"))
+
+# En-tête HTTP portant le budget restant d'une requête (secondes)
+BUDGET_HEADER = "X-Request-Budget"
+
+# Requêtes doublées: activation, percentile de déclenchement et latences nécessaires pour l'estimer
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "true").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+
+# Part maximale d'appels doublés et attente minimale avant de doubler (secondes)
+HEDGE_MAX_RATIO = float(os.getenv("HEDGE_MAX_RATIO", "0.05"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.05"))
+
+# Workers uvicorn du service, entre lesquels se répartissent les limites de concurrence
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+
+# Échéance (horloge monotone) de la requête en cours
+_deadline: contextvars.ContextVar = contextvars.ContextVar("request_deadline", default=None)
+
+T = TypeVar("T")
+
+class CallDeadlineExceeded(asyncio.TimeoutError):
+    """Appel externe sans réponse dans son délai, ou lancé après l'échéance de la requête."""
+
+def per_worker(total: int) -> int:
+    """Part d'un worker d'une limite de concurrence fixée pour tout le service (au moins 1)."""
+    return max(1, total // WEB_CONCURRENCY)
+
+def remaining() -> Optional[float]:
+    """Temps restant avant l'échéance de la requête en cours (None si elle n'a pas de budget)."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+@contextlib.contextmanager
+def request_budget(seconds: Optional[float]) -> Iterator[None]:
+    """
+    Fixe le budget des appels faits dans le bloc (et dans les tâches qu'il crée).
+
+    Un budget ne peut que raccourcir l'échéance déjà en vigueur.
+
+    Args:
+        seconds: Budget en secondes (None ou 0 pour ne rien changer)
+    """
+    deadline = _deadline.get()
+    if seconds:
+        candidate = time.monotonic() + seconds
+        deadline = candidate if deadline is None else min(deadline, candidate)
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+class RequestBudgetMiddleware:
+    """Middleware ASGI: fixe l'échéance de chaque requête HTTP (en-tête X-Request-Budget ou REQUEST_BUDGET)."""
+
+    def __init__(self, app: Any):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        budget = REQUEST_BUDGET
+        header = BUDGET_HEADER.lower().encode("latin-1")
+        for name, value in scope.get("headers", []):
+            if name == header:
+                try:
+                    budget = float(value.decode("latin-1"))
+                except ValueError:
+                    logger.warning(f"En-tête {BUDGET_HEADER} invalide ignoré: {value!r}")
+                break
+
+        with request_budget(budget):
+            await self.app(scope, receive, send)
+
+class CallPolicy:
+    """Délais et requêtes doublées des appels vers une API externe."""
+
+    def __init__(self, name: str, timeout: float, hedge: bool = HEDGE_ENABLED,
+                 percentile: float = HEDGE_PERCENTILE, max_ratio: float = HEDGE_MAX_RATIO):
+        """
+        Initialise la politique d'une API.
+
+        Args:
+            name: Nom de l'API (journaux et /health)
+            timeout: Délai maximum d'un appel (secondes)
+            hedge: Doubler les appels idempotents lents
+            percentile: Percentile des latences récentes au-delà duquel un appel est doublé
+            max_ratio: Part maximale d'appels doublés
+        """
+        self.name = name
+        self.timeout = timeout
+        self.hedge = hedge
+        self.percentile = percentile
+        self.max_ratio = max_ratio
+
+        # Latences des derniers appels réussis
+        self._latencies: Deque[float] = deque(maxlen=1000)
+        self._stats = {"calls": 0, "errors": 0, "timeouts": 0, "hedged": 0, "hedgeWins": 0}
+
+    def call_timeout(self, timeout: Optional[float] = None, budget: bool = True) -> float:
+        """
+        Délai d'un appel: le délai de l'API, borné par le temps restant de la requête.
+
+        Args:
+            timeout: Délai propre de cet appel (par défaut celui de l'API)
+            budget: Tenir compte du budget de la requête en cours
+
+        Raises:
+            CallDeadlineExceeded: Si l'échéance de la requête est déjà passée
+        """
+        timeout = timeout or self.timeout
+        left = remaining() if budget else None
+        if left is not None:
+            if left <= 0:
+                self._stats["timeouts"] += 1
+                raise CallDeadlineExceeded(f"{self.name}: budget de la requête épuisé avant l'appel")
+            timeout = min(timeout, left)
+        return timeout
+
+    def hedge_delay(self) -> Optional[float]:
+        """Attente avant de doubler un appel (None si les latences connues ne suffisent pas)."""
+        if not self.hedge or len(self._latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        latencies = sorted(self._latencies)
+        return max(HEDGE_MIN_DELAY, latencies[min(len(latencies) - 1, int(self.percentile * len(latencies)))])
+
+    async def run(self, call: Callable[[float], Awaitable[T]], idempotent: bool = True,
+                  timeout: Optional[float] = None, budget: bool = True) -> T:
+        """
+        Exécute un appel sous la politique de l'API.
+
+        Args:
+            call: Lance l'appel avec le délai qui lui reste (secondes) et retourne sa réponse
+            idempotent: L'appel peut être envoyé deux fois sans effet de bord
+            timeout: Délai propre de cet appel (par défaut celui de l'API)
+            budget: Tenir compte du budget de la requête en cours
+
+        Returns:
+            La première réponse réussie
+
+        Raises:
+            CallDeadlineExceeded: Si aucune réponse n'arrive dans le délai
+            Exception: L'erreur de l'appel si toutes les requêtes envoyées échouent
+        """
+        timeout = self.call_timeout(timeout, budget)
+        self._stats["calls"] += 1
+        start = time.monotonic()
+        end = start + timeout
+        delay = self.hedge_delay() if idempotent else None
+
+        tasks: List[asyncio.Future] = [asyncio.ensure_future(call(timeout))]
+        try:
+            if delay is not None and delay < timeout:
+                await asyncio.wait(tasks, timeout=delay)
+                if not tasks[0].done() and self._stats["hedged"] < self.max_ratio * self._stats["calls"]:
+                    self._stats["hedged"] += 1
+                    tasks.append(asyncio.ensure_future(call(end - time.monotonic())))
+
+            while True:
+                succeeded = [task for task in tasks if task.done() and not task.cancelled() and task.exception() is None]
+                if succeeded:
+                    winner = succeeded[0]
+                    break
+                pending = [task for task in tasks if not task.done()]
+                if not pending:
+                    # Toutes les requêtes ont échoué: l'erreur de la première est transmise
+                    self._stats["errors"] += 1
+                    raise tasks[0].exception()
+                left = end - time.monotonic()
+                if left <= 0:
+                    self._stats["timeouts"] += 1
+                    raise CallDeadlineExceeded(f"{self.name}: pas de réponse en {timeout:.1f}s")
+                await asyncio.wait(pending, timeout=left, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    # Erreur de la requête perdante: consultée pour ne pas la signaler comme ignorée
+                    task.exception()
+
+        if winner is not tasks[0]:
+            self._stats["hedgeWins"] += 1
+        self._latencies.append(time.monotonic() - start)
+        return winner.result()
+
+    def stats(self) -> Dict[str, Any]:
+        """Retourne les compteurs de l'API pour /health."""
+        latencies = sorted(self._latencies)
+
+        def percentile(p: float) -> Optional[float]:
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else None
+
+        return {
+            **self._stats,
+            "timeout": self.timeout,
+            "hedge": self.hedge,
+            "hedgeDelay": self.hedge_delay(),
+            "latency": {"p50": percentile(0.5), "p95": percentile(0.95), "p99": percentile(0.99)}
+        }
@@ -0,0 +1,369 @@
+"""
+Accès à Google Document AI pour le service de traitement des documents.
+
+Un client unique est partagé par tout le processus. Les appels, bloquants,
+sont exécutés dans un pool de threads borné afin que la boucle d'événements
+continue de servir /health et les autres requêtes pendant l'OCR. Les PDF
+volumineux sont découpés en lots de pages traités en parallèle, et les
+résultats sont mis en cache par empreinte du contenu.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from google.api_core import exceptions as google_exceptions
+from google.api_core.client_options import ClientOptions
+from google.cloud import documentai_v1 as documentai
+
+import pdf_tools
+from call_policy import CallPolicy, per_worker
+from shared_cache import SharedCache
+
+logger = logging.getLogger(__name__)
+
+# Configuration Document AI
+DOCUMENT_AI_PROJECT = os.getenv("DOCUMENT_AI_PROJECT")
+DOCUMENT_AI_LOCATION = os.getenv("DOCUMENT_AI_LOCATION", "eu")
+DOCUMENT_AI_PROCESSOR_ID = os.getenv("DOCUMENT_AI_PROCESSOR_ID")
+
+# Nombre maximum d'appels simultanés (pour tout le service, réparti entre ses workers) et délai par appel (secondes)
+DOCUMENT_AI_MAX_CONCURRENCY = per_worker(int(os.getenv("DOCUMENT_AI_MAX_CONCURRENCY", "4")))
+DOCUMENT_AI_TIMEOUT = float(os.getenv("DOCUMENT_AI_TIMEOUT", "120"))
+
+# Doubler les appels lents (désactivé par défaut: chaque appel est facturé à la page)
+DOCUMENT_AI_HEDGE = os.getenv("DOCUMENT_AI_HEDGE", "false").lower() == "true"
+
+# Nombre maximum de pages par appel (limite du traitement en ligne)
+DOCUMENT_AI_PAGES_PER_SHARD = int(os.getenv("DOCUMENT_AI_PAGES_PER_SHARD", "15"))
+
+# Cache des résultats par (SHA-256 du fichier, processeur, options), borné en entrées et en octets
+DOCUMENT_AI_CACHE_ENABLED = os.getenv("DOCUMENT_AI_CACHE_ENABLED", "true").lower() == "true"
+DOCUMENT_AI_CACHE_SIZE = int(os.getenv("DOCUMENT_AI_CACHE_SIZE", "500"))
+DOCUMENT_AI_CACHE_MAX_BYTES = int(os.getenv("DOCUMENT_AI_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+# Version du format des pages structurées, à incrémenter si parse_document change
+RESULT_FORMAT_VERSION = 1
+
+result_cache = SharedCache("documentai", maxsize=DOCUMENT_AI_CACHE_SIZE, max_bytes=DOCUMENT_AI_CACHE_MAX_BYTES)
+
+_client: Optional[documentai.DocumentProcessorServiceClient] = None
+_client_lock = threading.Lock()
+# Un thread de plus par appel en cours pour une éventuelle requête doublée
+_executor = ThreadPoolExecutor(max_workers=DOCUMENT_AI_MAX_CONCURRENCY * (2 if DOCUMENT_AI_HEDGE else 1),
+                               thread_name_prefix="documentai")
+_semaphore = asyncio.Semaphore(DOCUMENT_AI_MAX_CONCURRENCY)
+_in_flight = 0
+
+# Délai de chaque appel borné par le budget de la requête
+call_policy = CallPolicy("documentai", DOCUMENT_AI_TIMEOUT, hedge=DOCUMENT_AI_HEDGE)
+
+def is_configured() -> bool:
+    """Indique si le projet, la région et le processeur sont configurés."""
+    return all([DOCUMENT_AI_PROJECT, DOCUMENT_AI_LOCATION, DOCUMENT_AI_PROCESSOR_ID])
+
+def processor_name() -> str:
+    """Retourne le nom complet du processeur Document AI."""
+    return f"projects/{DOCUMENT_AI_PROJECT}/locations/{DOCUMENT_AI_LOCATION}/processors/{DOCUMENT_AI_PROCESSOR_ID}"
+
+def get_client() -> documentai.DocumentProcessorServiceClient:
+    """
+    Retourne le client Document AI du processus, créé au premier appel.
+
+    Returns:
+        Le client partagé
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = documentai.DocumentProcessorServiceClient(
+                    client_options=ClientOptions(api_endpoint=f"{DOCUMENT_AI_LOCATION}-documentai.googleapis.com")
+                )
+    return _client
+
+def _process_sync(content: bytes, mime_type: str, timeout: float) -> documentai.Document:
+    """Appel bloquant à Document AI, exécuté dans le pool de threads."""
+    raw_document = documentai.RawDocument(content=content, mime_type=mime_type)
+    request = documentai.ProcessRequest(name=processor_name(), raw_document=raw_document)
+    try:
+        result = get_client().process_document(request=request, timeout=timeout)
+    except google_exceptions.DeadlineExceeded as e:
+        raise TimeoutError(f"Document AI n'a pas répondu en {timeout:.0f}s") from e
+    return result.document
+
+def _process_pages_sync(file_path: str, pages: Optional[List[int]], mime_type: str,
+                        timeout: float) -> documentai.Document:
+    """Extrait les pages demandées (ou tout le fichier) puis appelle Document AI."""
+    if pages is None:
+        content = Path(file_path).read_bytes()
+    else:
+        content = pdf_tools.build_shard(file_path, pages)
+    return _process_sync(content, mime_type, timeout)
+
+async def _run_bounded(func: Callable[..., documentai.Document], *args,
+                       timeout: Optional[float] = None) -> documentai.Document:
+    """Exécute un appel Document AI dans le pool, sous le plafond de concurrence et la politique d'appel."""
+    global _in_flight
+    loop = asyncio.get_running_loop()
+
+    async def call(call_timeout: float) -> documentai.Document:
+        # Marge au-delà du délai gRPC pour laisser l'appel se terminer proprement
+        return await asyncio.wait_for(loop.run_in_executor(_executor, func, *args, call_timeout), call_timeout + 5)
+
+    async with _semaphore:
+        _in_flight += 1
+        try:
+            return await call_policy.run(call, timeout=timeout)
+        except asyncio.TimeoutError as e:
+            raise TimeoutError(f"Document AI n'a pas répondu: {str(e) or 'délai dépassé'}") from e
+        finally:
+            _in_flight -= 1
+
+async def process_document_bytes(content: bytes, mime_type: str = "application/pdf",
+                                 timeout: Optional[float] = None) -> documentai.Document:
+    """
+    Traite un document avec Document AI sans bloquer la boucle d'événements.
+
+    Args:
+        content: Contenu binaire du document
+        mime_type: Type MIME du document
+        timeout: Délai maximum de l'appel (par défaut DOCUMENT_AI_TIMEOUT)
+
+    Returns:
+        Le document structuré renvoyé par Document AI
+
+    Raises:
+        TimeoutError: Si l'appel dépasse le délai imparti
+    """
+    return await _run_bounded(_process_sync, content, mime_type, timeout=timeout)
+
+def get_text_from_layout(layout, text):
+    """
+    Extrait le texte à partir d'un layout Document AI.
+
+    Args:
+        layout: Le layout contenant les indices de texte
+        text: Le texte complet du document
+
+    Returns:
+        Le texte extrait
+    """
+    if layout.text_anchor.text_segments:
+        return "".join(
+            text[segment.start_index:segment.end_index]
+            for segment in layout.text_anchor.text_segments
+        )
+    return ""
+
+def parse_document(document: documentai.Document, pages: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+    """
+    Convertit la réponse Document AI en pages structurées.
+
+    Args:
+        document: Document renvoyé par Document AI
+        pages: Numéros de page d'origine des pages du lot (None si document complet)
+
+    Returns:
+        Une entrée par page avec ses dimensions et ses blocs de texte non vides
+    """
+    text = document.text
+    parsed_pages = []
+
+    for index, page in enumerate(document.pages):
+        page_number = pages[index] if pages is not None else page.page_number
+
+        text_blocks = []
+        for paragraph in page.paragraphs:
+            para_text = get_text_from_layout(paragraph.layout, text)
+            # Ne pas ajouter de paragraphes vides
+            if para_text.strip():
+                text_blocks.append({
+                    "text": para_text,
+                    "confidence": paragraph.layout.confidence,
+                    "page": page_number
+                })
+
+        parsed_pages.append({
+            "page": page_number,
+            "width": page.dimension.width if page.dimension else 0,
+            "height": page.dimension.height if page.dimension else 0,
+            "textBlocks": text_blocks
+        })
+
+    return parsed_pages
+
+async def process_pdf_shard(file_path: str, pages: Optional[List[int]],
+                            mime_type: str = "application/pdf") -> List[Dict[str, Any]]:
+    """
+    Traite un lot de pages d'un PDF.
+
+    Args:
+        file_path: Chemin vers le PDF
+        pages: Numéros de page du lot (None pour le fichier complet)
+        mime_type: Type MIME du document
+
+    Returns:
+        Les pages structurées du lot, numérotées comme dans le document d'origine
+    """
+    document = await _run_bounded(_process_pages_sync, file_path, pages, mime_type)
+    return parse_document(document, pages)
+
+def result_cache_key(file_hash: str, options: Dict[str, Any]) -> str:
+    """
+    Construit la clé de cache d'un résultat Document AI.
+
+    Args:
+        file_hash: SHA-256 du fichier traité
+        options: Options qui influencent le résultat (type MIME, pages envoyées...)
+
+    Returns:
+        La clé de cache
+    """
+    return json.dumps([RESULT_FORMAT_VERSION, file_hash, processor_name(), options], sort_keys=True)
+
+def shard_checkpoint_key(file_hash: str, mime_type: str, pages: Optional[List[int]]) -> str:
+    """
+    Construit la clé du point de reprise d'un lot.
+
+    La clé dépend du contenu du fichier, du processeur et des pages du lot :
+    un point de reprise ne peut être réutilisé que pour un travail identique.
+
+    Args:
+        file_hash: SHA-256 du fichier traité
+        mime_type: Type MIME du document
+        pages: Numéros de page du lot (None pour le fichier complet)
+
+    Returns:
+        La clé du point de reprise
+    """
+    return "docai:" + json.dumps([RESULT_FORMAT_VERSION, processor_name(), file_hash, mime_type, pages])
+
+async def process_pdf(file_path: str, mime_type: str = "application/pdf",
+                      pages_per_shard: Optional[int] = None, file_hash: Optional[str] = None,
+                      use_cache: bool = True, pages: Optional[List[int]] = None,
+                      on_pages: Optional[Callable[[int], None]] = None,
+                      checkpoints: Optional[Any] = None) -> Dict[str, Any]:
+    """
+    Traite un PDF en le découpant en lots de pages traités en parallèle.
+
+    Le parallélisme est borné par DOCUMENT_AI_MAX_CONCURRENCY. Si un lot
+    échoue, les lots encore en attente sont annulés. Lorsque l'empreinte du
+    fichier est fournie, un résultat déjà calculé est servi depuis le cache
+    sans appel à Google. Chaque lot terminé est enregistré dans les points de
+    reprise du job : à la reprise après une interruption, les lots déjà
+    traités ne sont pas renvoyés à Document AI.
+
+    Args:
+        file_path: Chemin vers le PDF
+        mime_type: Type MIME du document
+        pages_per_shard: Nombre maximum de pages par appel (par défaut DOCUMENT_AI_PAGES_PER_SHARD)
+        file_hash: SHA-256 du fichier, clé du cache de résultats
+        use_cache: Consulter et alimenter le cache de résultats
+        pages: Numéros des pages à traiter (None pour tout le document)
+        on_pages: Appelée avec le nombre de pages de chaque lot terminé
+        checkpoints: Points de reprise du job (objet exposant get(key) et put(key, value))
+
+    Returns:
+        Les pages structurées dans l'ordre du document, le nombre de lots,
+        le nombre de lots repris d'un point de reprise et l'indicateur de succès du cache
+    """
+    cache_key = None
+    if file_hash and use_cache and DOCUMENT_AI_CACHE_ENABLED:
+        cache_key = result_cache_key(file_hash, {"mimeType": mime_type, "pages": pages})
+        cached = await asyncio.to_thread(result_cache.get, cache_key)
+        if cached is not None:
+            logger.info(f"Résultat Document AI servi depuis le cache (sha256 {file_hash[:12]})")
+            cached["cacheHit"] = True
+            cached["skippedShards"] = 0
+            if on_pages:
+                on_pages(len(cached["pages"]))
+            return cached
+
+    pages_per_shard = pages_per_shard or DOCUMENT_AI_PAGES_PER_SHARD
+
+    if pages is not None:
+        shards = pdf_tools.plan_shards(pages, pages_per_shard)
+    else:
+        try:
+            total_pages = await asyncio.to_thread(pdf_tools.page_count, file_path)
+        except Exception as e:
+            # PDF illisible localement: Document AI reçoit le fichier complet
+            logger.warning(f"Découpage impossible pour {file_path}, envoi en un seul appel: {str(e)}")
+            total_pages = None
+
+        if total_pages is None or total_pages <= pages_per_shard:
+            shards = [None]
+        else:
+            shards = pdf_tools.plan_shards(list(range(1, total_pages + 1)), pages_per_shard)
+
+    if len(shards) > 1:
+        logger.info(f"Découpage de {file_path} en {len(shards)} lots de {pages_per_shard} pages maximum")
+
+    skipped_shards = 0
+
+    async def run_shard(shard: Optional[List[int]]) -> List[Dict[str, Any]]:
+        """Traite un lot, sauf s'il figure déjà dans les points de reprise."""
+        nonlocal skipped_shards
+        checkpoint_key = shard_checkpoint_key(file_hash, mime_type, shard) if file_hash else None
+
+        if checkpoints is not None and checkpoint_key is not None:
+            done = await asyncio.to_thread(checkpoints.get, checkpoint_key)
+            if done is not None:
+                skipped_shards += 1
+                return done
+
+        shard_pages = await process_pdf_shard(file_path, shard, mime_type)
+
+        if checkpoints is not None and checkpoint_key is not None:
+            # L'appel a été payé: le point de reprise est écrit même si les autres lots sont annulés
+            await asyncio.shield(asyncio.to_thread(checkpoints.put, checkpoint_key, shard_pages))
+        return shard_pages
+
+    tasks = [asyncio.create_task(run_shard(shard)) for shard in shards]
+    if on_pages:
+        for task in tasks:
+            task.add_done_callback(lambda done: done.cancelled() or done.exception() or on_pages(len(done.result())))
+    try:
+        shard_results = await asyncio.gather(*tasks)
+    except Exception:
+        for task in tasks:
+            task.cancel()
+        raise
+
+    parsed_pages = [page for shard_pages in shard_results for page in shard_pages]
+    parsed_pages.sort(key=lambda page: page["page"])
+
+    result = {
+        "pages": parsed_pages,
+        "shardCount": len(shards),
+        "mimeType": mime_type,
+        "cacheHit": False
+    }
+
+    if skipped_shards:
+        logger.info(f"{skipped_shards}/{len(shards)} lot(s) repris des points de reprise pour {file_path}")
+
+    if cache_key is not None:
+        await asyncio.to_thread(result_cache.set, cache_key, result)
+
+    return {**result, "skippedShards": skipped_shards}
+
+def stats() -> Dict[str, Any]:
+    """Retourne l'état de l'accès à Document AI pour /health."""
+    return {
+        "inFlight": _in_flight,
+        "maxConcurrency": DOCUMENT_AI_MAX_CONCURRENCY,
+        "timeout": DOCUMENT_AI_TIMEOUT,
+        "callPolicy": call_policy.stats(),
+        "pagesPerShard": DOCUMENT_AI_PAGES_PER_SHARD,
+        "cache": result_cache.stats() if DOCUMENT_AI_CACHE_ENABLED else None
+    }
+
+def shutdown():
+    """Arrête le pool de threads sans attendre les appels en cours."""
+    _executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,268 @@
+"""
+Extraction du contenu des PDF pour le service de traitement des documents.
+
+Les pages disposant d'une couche texte native sont extraites localement dans
+un pool de processus ; seules les pages numérisées ou composées d'images sont
+envoyées à Document AI. Le résultat conserve le format des blocs de texte de
+Document AI pour que les services en aval restent inchangés. Les images
+intégrées sont extraites dans le même pool et dédoublonnées par document.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import docai
+import pdf_tools
+
+logger = logging.getLogger(__name__)
+
+# Extraction locale de la couche texte
+LOCAL_TEXT_ENABLED = os.getenv("LOCAL_TEXT_ENABLED", "true").lower() == "true"
+LOCAL_TEXT_MIN_CHARS = int(os.getenv("LOCAL_TEXT_MIN_CHARS", "50"))
+
+# Pool de processus pour l'extraction locale
+LOCAL_EXTRACTION_WORKERS = int(os.getenv("LOCAL_EXTRACTION_WORKERS", str(min(4, os.cpu_count() or 1))))
+LOCAL_EXTRACTION_PAGES_PER_TASK = int(os.getenv("LOCAL_EXTRACTION_PAGES_PER_TASK", "20"))
+
+# Extraction des images
+IMAGE_MIN_SIZE = int(os.getenv("IMAGE_MIN_SIZE", "32"))
+IMAGE_RENDER_DPI = int(os.getenv("IMAGE_RENDER_DPI", "150"))
+IMAGE_VECTOR_MIN_DRAWINGS = int(os.getenv("IMAGE_VECTOR_MIN_DRAWINGS", "20"))
+
+# Empreintes des pages: "content" (flux de contenu) ou "render" (rendu basse résolution)
+PAGE_FINGERPRINT_MODE = os.getenv("PAGE_FINGERPRINT_MODE", "content")
+PAGE_FINGERPRINT_DPI = int(os.getenv("PAGE_FINGERPRINT_DPI", "50"))
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    Retourne le pool de processus d'extraction, créé au premier appel.
+
+    Les processus sont lancés en mode "spawn" : le processus parent possède des
+    threads gRPC qu'un fork ne dupliquerait pas correctement.
+    """
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(
+            max_workers=LOCAL_EXTRACTION_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _process_pool
+
+async def run_in_pages(func, file_path: str, pages: List[int], *args,
+                       on_pages: Optional[Callable[[int], None]] = None) -> List[Any]:
+    """
+    Répartit un traitement par pages sur le pool de processus.
+
+    Args:
+        func: Fonction de pdf_tools prenant (file_path, pages, *args) et renvoyant une liste
+        file_path: Chemin vers le PDF
+        pages: Numéros des pages à traiter
+        *args: Arguments supplémentaires transmis à la fonction
+        on_pages: Appelée avec le nombre de pages de chaque lot terminé
+
+    Returns:
+        La concaténation des résultats, dans l'ordre des lots
+    """
+    loop = asyncio.get_running_loop()
+    pool = get_process_pool()
+    chunks = pdf_tools.plan_shards(pages, LOCAL_EXTRACTION_PAGES_PER_TASK)
+    futures = []
+    for chunk in chunks:
+        future = loop.run_in_executor(pool, func, file_path, chunk, *args)
+        if on_pages:
+            future.add_done_callback(
+                lambda done, count=len(chunk): done.cancelled() or done.exception() or on_pages(count)
+            )
+        futures.append(future)
+    results = await asyncio.gather(*futures)
+    return [item for chunk_result in results for item in chunk_result]
+
+def _page_counter(stage: str, total: Optional[int],
+                  on_progress: Optional[Callable[[str, int, int], None]]) -> Optional[Callable[[int], None]]:
+    """
+    Construit le compteur de pages terminées d'une étape.
+
+    Args:
+        stage: Nom de l'étape ("text", "ocr", "images")
+        total: Nombre de pages de l'étape (None s'il n'est pas connu à l'avance)
+        on_progress: Fonction de suivi recevant (étape, pages terminées, pages à traiter)
+
+    Returns:
+        La fonction à appeler avec le nombre de pages de chaque lot terminé
+    """
+    if on_progress is None:
+        return None
+
+    done = 0
+    def on_pages(count: int):
+        nonlocal done
+        done += count
+        on_progress(stage, done, max(total or 0, done))
+    return on_pages
+
+async def extract_pages(file_path: str, mime_type: str = "application/pdf", file_hash: Optional[str] = None,
+                        use_cache: bool = True, local_text: bool = True,
+                        on_progress: Optional[Callable[[str, int, int], None]] = None,
+                        checkpoints: Optional[Any] = None, pages: Optional[List[int]] = None) -> Dict[str, Any]:
+    """
+    Extrait le texte des pages d'un PDF.
+
+    Args:
+        file_path: Chemin vers le PDF
+        mime_type: Type MIME du document
+        file_hash: SHA-256 du fichier, clé du cache Document AI
+        use_cache: Consulter et alimenter le cache Document AI
+        local_text: Extraire localement les pages disposant d'une couche texte
+        on_progress: Appelée avec (étape, pages terminées, pages à traiter) à chaque lot terminé
+        checkpoints: Points de reprise du job, transmis à Document AI
+        pages: Numéros des pages à traiter (None pour tout le document)
+
+    Returns:
+        Les pages structurées dans l'ordre du document et les statistiques d'extraction
+    """
+    local_pages = []
+    ocr_pages = pages
+
+    if local_text and LOCAL_TEXT_ENABLED:
+        try:
+            if pages is None:
+                total_pages = await asyncio.to_thread(pdf_tools.page_count, file_path)
+                pages_to_examine = list(range(1, total_pages + 1))
+            else:
+                pages_to_examine = pages
+            examined = await run_in_pages(
+                pdf_tools.extract_text_layer,
+                file_path,
+                pages_to_examine,
+                LOCAL_TEXT_MIN_CHARS,
+                on_pages=_page_counter("text", len(pages_to_examine), on_progress)
+            )
+            local_pages = [page for page in examined if page["hasTextLayer"]]
+            ocr_pages = [page["page"] for page in examined if not page["hasTextLayer"]]
+            logger.info(f"{len(local_pages)} page(s) extraite(s) localement, "
+                        f"{len(ocr_pages)} envoyée(s) à Document AI")
+        except Exception as e:
+            # En cas d'échec, tout le document passe par Document AI
+            logger.warning(f"Extraction locale impossible pour {file_path}: {str(e)}")
+            local_pages = []
+            ocr_pages = pages
+
+    if ocr_pages == []:
+        # Document entièrement numérique: aucun appel à Document AI
+        ocr_result = {"pages": [], "shardCount": 0, "skippedShards": 0, "cacheHit": False}
+    else:
+        ocr_result = await docai.process_pdf(
+            file_path,
+            mime_type,
+            file_hash=file_hash,
+            use_cache=use_cache,
+            pages=ocr_pages,
+            on_pages=_page_counter("ocr", len(ocr_pages) if ocr_pages is not None else None, on_progress),
+            checkpoints=checkpoints
+        )
+
+    pages = [
+        {key: page[key] for key in ("page", "width", "height", "textBlocks")}
+        for page in local_pages
+    ] + ocr_result["pages"]
+    pages.sort(key=lambda page: page["page"])
+
+    return {
+        "pages": pages,
+        "mimeType": mime_type,
+        "localTextPages": len(local_pages),
+        "ocrPages": len(ocr_result["pages"]),
+        "shardCount": ocr_result["shardCount"],
+        "skippedShards": ocr_result["skippedShards"],
+        "cacheHit": ocr_result["cacheHit"]
+    }
+
+async def extract_images(file_path: str, document_id: str, output_dir: str, page_count: int,
+                         render_vector: bool = False,
+                         on_progress: Optional[Callable[[str, int, int], None]] = None,
+                         pages: Optional[List[int]] = None) -> Dict[str, Any]:
+    """
+    Extrait les images d'un PDF et les dédoublonne à l'échelle du document.
+
+    Args:
+        file_path: Chemin vers le PDF
+        document_id: Identifiant du document, préfixe des identifiants d'image
+        output_dir: Répertoire où écrire les images
+        page_count: Nombre de pages du document
+        render_vector: Rendre aussi en PNG les dessins vectoriels
+        on_progress: Appelée avec ("images", pages terminées, nombre de pages) à chaque lot terminé
+        pages: Numéros des pages à traiter (par défaut les page_count premières)
+
+    Returns:
+        Les images uniques (avec la liste des pages où elles apparaissent)
+        et le nombre total d'occurrences
+    """
+    pages = pages if pages is not None else list(range(1, page_count + 1))
+    occurrences = await run_in_pages(
+        pdf_tools.extract_images,
+        file_path,
+        pages,
+        output_dir,
+        render_vector,
+        IMAGE_MIN_SIZE,
+        IMAGE_RENDER_DPI,
+        IMAGE_VECTOR_MIN_DRAWINGS,
+        on_pages=_page_counter("images", len(pages), on_progress)
+    )
+
+    unique_images = {}
+    for occurrence in occurrences:
+        image = unique_images.get(occurrence["sha256"])
+        if image is None:
+            unique_images[occurrence["sha256"]] = {
+                "id": f"img-{document_id}-{occurrence['sha256'][:12]}",
+                "path": occurrence["path"],
+                "page": occurrence["page"],
+                "pages": [occurrence["page"]],
+                "width": occurrence["width"],
+                "height": occurrence["height"],
+                "format": occurrence["format"],
+                "source": occurrence["source"],
+                "sha256": occurrence["sha256"]
+            }
+        elif occurrence["page"] not in image["pages"]:
+            image["pages"].append(occurrence["page"])
+
+    images = sorted(unique_images.values(), key=lambda image: (image["page"], image["id"]))
+    for image in images:
+        image["pages"].sort()
+
+    return {
+        "images": images,
+        "occurrences": len(occurrences)
+    }
+
+async def fingerprint_pages(file_path: str) -> List[str]:
+    """
+    Calcule l'empreinte de chaque page d'un PDF.
+
+    Args:
+        file_path: Chemin vers le PDF
+
+    Returns:
+        Les empreintes, dans l'ordre des pages
+    """
+    total_pages = await asyncio.to_thread(pdf_tools.page_count, file_path)
+    render_dpi = PAGE_FINGERPRINT_DPI if PAGE_FINGERPRINT_MODE == "render" else 0
+    fingerprints = await run_in_pages(
+        pdf_tools.page_fingerprints,
+        file_path,
+        list(range(1, total_pages + 1)),
+        render_dpi
+    )
+    return [page["fingerprint"] for page in fingerprints]
+
+def shutdown():
+    """Arrête le pool de processus d'extraction."""
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,323 @@
+"""
+Journal persistant des traitements longs d'un service TechnicIA.
+
+Chaque traitement (job) est enregistré dans un fichier SQLite avec sa
+requête, son propriétaire et ses points de reprise (checkpoints). Un
+processus qui exécute un job met régulièrement à jour son signal de vie ;
+après un redémarrage, les jobs dont le propriétaire ne donne plus signe de
+vie sont repris par un autre processus, qui saute les étapes déjà
+enregistrées au lieu de refaire les appels payants (OCR, embeddings).
+
+Ce module est copié à l'identique dans chaque service qui en a besoin, chaque
+service étant construit dans son propre contexte Docker.
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Répertoire du journal (à placer sur un volume persistant)
+JOB_STORE_DIR = os.getenv("JOB_STORE_DIR", os.path.join(os.getenv("TEMP_DIR", "/tmp/technicia-docs"), "jobs"))
+
+# Signal de vie des jobs en cours et délai au-delà duquel un job est considéré abandonné
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", "10"))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "60"))
+
+# Conservation des jobs terminés
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))
+
+def _pack(value: Any) -> bytes:
+    """Sérialise une valeur en JSON compressé."""
+    return zlib.compress(json.dumps(value).encode("utf-8"))
+
+def _unpack(blob: Optional[bytes]) -> Any:
+    """Désérialise une valeur produite par _pack."""
+    return json.loads(zlib.decompress(blob)) if blob is not None else None
+
+class Checkpoints:
+    """Points de reprise d'un job, clé par clé."""
+
+    def __init__(self, store: "JobStore", job_id: str):
+        self.store = store
+        self.job_id = job_id
+
+    def get(self, key: str) -> Any:
+        """Retourne la valeur enregistrée pour une étape terminée, ou None."""
+        return self.store.get_checkpoint(self.job_id, key)
+
+    def put(self, key: str, value: Any):
+        """Enregistre le résultat d'une étape terminée."""
+        self.store.put_checkpoint(self.job_id, key, value)
+
+class JobStore:
+    """Journal des jobs et de leurs points de reprise, partagé entre les processus d'un service."""
+
+    def __init__(self, name: str, path: Optional[str] = None):
+        """
+        Initialise le journal.
+
+        Args:
+            name: Nom du journal, utilisé pour le nom du fichier SQLite
+            path: Chemin explicite du fichier SQLite
+        """
+        self.name = name
+        self.path = path or os.path.join(JOB_STORE_DIR, f"{name}.sqlite")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        # Identifiant du processus propriétaire des jobs qu'il exécute
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+        # Une connexion par thread
+        self._local = threading.local()
+
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "job_id TEXT PRIMARY KEY, kind TEXT NOT NULL, payload BLOB NOT NULL, "
+            "status TEXT NOT NULL, resumable INTEGER NOT NULL, owner TEXT, heartbeat_at REAL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, result BLOB, error TEXT, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoints ("
+            "job_id TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, created_at REAL NOT NULL, "
+            "PRIMARY KEY (job_id, key))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, heartbeat_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        """Retourne la connexion du thread courant, en la rouvrant après un fork."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _row_to_job(row: tuple) -> Dict[str, Any]:
+        """Convertit une ligne de la table jobs en dictionnaire."""
+        (job_id, kind, payload, status, resumable, owner, heartbeat_at,
+         attempts, result, error, created_at, updated_at) = row
+        return {
+            "job_id": job_id,
+            "kind": kind,
+            "payload": _unpack(payload),
+            "status": status,
+            "resumable": bool(resumable),
+            "owner": owner,
+            "heartbeat_at": heartbeat_at,
+            "attempts": attempts,
+            "result": _unpack(result),
+            "error": error,
+            "created_at": created_at,
+            "updated_at": updated_at
+        }
+
+    def create(self, job_id: str, kind: str, payload: Dict[str, Any], resumable: bool = True,
+               claimed: bool = False) -> Dict[str, Any]:
+        """
+        Enregistre un job s'il n'existe pas encore.
+
+        Args:
+            job_id: Identifiant du job
+            kind: Type de traitement
+            payload: Requête nécessaire pour reprendre le job
+            resumable: Reprendre automatiquement le job après un redémarrage
+            claimed: Enregistrer ce processus comme propriétaire du nouveau job
+
+        Returns:
+            Le job, tel qu'il existait déjà le cas échéant
+        """
+        now = time.time()
+        owner = self.owner if claimed else None
+        self._connect().execute(
+            "INSERT OR IGNORE INTO jobs (job_id, kind, payload, status, resumable, owner, heartbeat_at, "
+            "attempts, created_at, updated_at) VALUES (?, ?, ?, 'pending', ?, ?, ?, ?, ?, ?)",
+            (job_id, kind, _pack(payload), int(resumable), owner, now, int(claimed), now, now)
+        )
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Retourne un job ou None."""
+        row = self._connect().execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def claim(self, job_id: str) -> bool:
+        """
+        Prend la main sur un job actif, s'il n'a pas de propriétaire vivant.
+
+        Args:
+            job_id: Identifiant du job
+
+        Returns:
+            True si ce processus est désormais propriétaire du job
+        """
+        now = time.time()
+        cursor = self._connect().execute(
+            "UPDATE jobs SET attempts = attempts + (CASE WHEN owner IS ? THEN 0 ELSE 1 END), "
+            "owner = ?, heartbeat_at = ?, status = 'processing', error = NULL, updated_at = ? "
+            "WHERE job_id = ? AND status IN ('pending', 'processing', 'error') "
+            "AND (owner IS NULL OR owner = ? OR heartbeat_at < ? OR status = 'error')",
+            (self.owner, self.owner, now, now, job_id, self.owner, now - JOB_STALE_SECONDS)
+        )
+        return cursor.rowcount == 1
+
+    def release(self, job_id: str):
+        """Rend un job actif sans propriétaire, pour qu'il soit repris plus tard."""
+        self._connect().execute(
+            "UPDATE jobs SET owner = NULL, status = 'pending', updated_at = ? WHERE job_id = ? AND owner = ?",
+            (time.time(), job_id, self.owner)
+        )
+
+    def finish(self, job_id: str, result: Any = None):
+        """
+        Marque un job terminé et supprime ses points de reprise devenus inutiles.
+
+        Sans effet si ce processus n'est plus propriétaire du job: un autre traitement en a pris la main.
+        """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            finished = conn.execute(
+                "UPDATE jobs SET status = 'completed', result = ?, owner = NULL, updated_at = ? "
+                "WHERE job_id = ? AND owner = ?",
+                (_pack(result), time.time(), job_id, self.owner)
+            ).rowcount
+            if finished:
+                conn.execute("DELETE FROM checkpoints WHERE job_id = ?", (job_id,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def fail(self, job_id: str, error: str):
+        """Marque un job en erreur (s'il appartient à ce processus) ; ses points de reprise sont conservés."""
+        self._connect().execute(
+            "UPDATE jobs SET status = 'error', error = ?, owner = NULL, updated_at = ? WHERE job_id = ? AND owner = ?",
+            (error, time.time(), job_id, self.owner)
+        )
+
+    def get_checkpoint(self, job_id: str, key: str) -> Any:
+        """Retourne la valeur d'un point de reprise, ou None."""
+        row = self._connect().execute(
+            "SELECT value FROM checkpoints WHERE job_id = ? AND key = ?", (job_id, key)
+        ).fetchone()
+        return _unpack(row[0]) if row else None
+
+    def put_checkpoint(self, job_id: str, key: str, value: Any):
+        """Enregistre un point de reprise."""
+        self._connect().execute(
+            "INSERT OR REPLACE INTO checkpoints (job_id, key, value, created_at) VALUES (?, ?, ?, ?)",
+            (job_id, key, _pack(value), time.time())
+        )
+
+    def checkpoints(self, job_id: str) -> Checkpoints:
+        """Retourne les points de reprise d'un job."""
+        return Checkpoints(self, job_id)
+
+    def heartbeat(self):
+        """Signale que les jobs actifs de ce processus sont toujours en cours."""
+        now = time.time()
+        self._connect().execute(
+            "UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND status IN ('pending', 'processing')",
+            (now, self.owner)
+        )
+
+    def stale_jobs(self, kind: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Retourne les jobs actifs repris automatiquement dont le propriétaire a disparu."""
+        query = ("SELECT * FROM jobs WHERE status IN ('pending', 'processing') AND resumable = 1 "
+                 "AND (owner IS NULL OR heartbeat_at < ?)")
+        params: List[Any] = [time.time() - JOB_STALE_SECONDS]
+        if kind is not None:
+            query += " AND kind = ?"
+            params.append(kind)
+        return [self._row_to_job(row) for row in self._connect().execute(query + " ORDER BY created_at", params)]
+
+    def purge(self, retention: float = JOB_RETENTION_SECONDS):
+        """Supprime les jobs terminés depuis plus de retention secondes."""
+        conn = self._connect()
+        cutoff = time.time() - retention
+        conn.execute(
+            "DELETE FROM checkpoints WHERE job_id IN "
+            "(SELECT job_id FROM jobs WHERE status IN ('completed', 'error') AND updated_at < ?)",
+            (cutoff,)
+        )
+        conn.execute("DELETE FROM jobs WHERE status IN ('completed', 'error') AND updated_at < ?", (cutoff,))
+
+    def forget(self, kind: str, prefix: str) -> int:
+        """
+        Supprime les jobs terminés d'un type dont l'identifiant commence par prefix.
+
+        Un job terminé sert de résultat aux requêtes identiques ; l'oublier
+        force leur réexécution (par exemple après le retrait de vecteurs).
+
+        Returns:
+            Le nombre de jobs supprimés
+        """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            condition = "kind = ? AND status = 'completed' AND substr(job_id, 1, ?) = ?"
+            params = (kind, len(prefix), prefix)
+            conn.execute(f"DELETE FROM checkpoints WHERE job_id IN (SELECT job_id FROM jobs WHERE {condition})", params)
+            removed = conn.execute(f"DELETE FROM jobs WHERE {condition}", params).rowcount
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return removed
+
+    async def maintain(self, on_resume: Callable[[Dict[str, Any]], Awaitable[None]], kind: Optional[str] = None):
+        """
+        Boucle de maintenance: signal de vie, purge et reprise des jobs abandonnés.
+
+        Args:
+            on_resume: Coroutine appelée pour chaque job dont ce processus a pris la main
+            kind: Type de jobs à reprendre (tous par défaut)
+        """
+        last_purge = 0.0
+        while True:
+            try:
+                await asyncio.to_thread(self.heartbeat)
+
+                if time.time() - last_purge > 3600:
+                    await asyncio.to_thread(self.purge)
+                    last_purge = time.time()
+
+                for job in await asyncio.to_thread(self.stale_jobs, kind):
+                    if await asyncio.to_thread(self.claim, job["job_id"]):
+                        logger.info(f"Reprise du job {job['job_id']} ({job['kind']}, tentative {job['attempts'] + 1})")
+                        await on_resume(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Erreur lors de la maintenance du journal {self.name}: {str(e)}")
+
+            await asyncio.sleep(JOB_HEARTBEAT_INTERVAL)
+
+    def stats(self) -> Dict[str, Any]:
+        """Retourne le nombre de jobs par statut pour /health."""
+        try:
+            counts = dict(self._connect().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            checkpoints = self._connect().execute("SELECT COUNT(*) FROM checkpoints").fetchone()[0]
+        except sqlite3.Error:
+            counts, checkpoints = {}, None
+
+        return {
+            "name": self.name,
+            "jobs": counts,
+            "checkpoints": checkpoints,
+            "owner": self.owner
+        }
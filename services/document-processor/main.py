@@ -3,18 +3,28 @@ Service de traitement des documents PDF pour TechnicIA.
 Utilise Google Document AI pour l'extraction de texte et la structuration du contenu.
 """
 from fastapi import FastAPI, File, UploadFile, BackgroundTasks, HTTPException, Form, Request, Body
-from fastapi.responses import JSONResponse
-from google.cloud import documentai_v1 as documentai
+from fastapi.responses import JSONResponse, StreamingResponse
+from contextlib import asynccontextmanager
 import asyncio
+import hashlib
 import os
 import logging
 import tempfile
 import time
 import uuid
-from typing import Dict, Any, List, Optional
+from typing import Callable, Dict, Any, List, Optional, Tuple
 from pathlib import Path
 from pydantic import BaseModel, Field
 
+import docai
+import extraction
+import pipeline
+import storage
+from call_policy import RequestBudgetMiddleware
+from revisions import RevisionStore, compare, settle
+from job_store import JobStore
+from tasks import TaskManager, TaskQueueFull, describe
+
 # Configuration du logging
 logging.basicConfig(
     level=logging.INFO,
@@ -22,24 +32,64 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Démarre la file de tâches, la reprise des jobs interrompus et le nettoyage
+    de TEMP_DIR ; libère les pools d'extraction, d'appels Document AI et le
+    client HTTP du pipeline d'ingestion à l'arrêt.
+    """
+    await task_manager.start()
+    maintenance = asyncio.create_task(job_store.maintain(resume_job))
+    janitor = asyncio.create_task(storage.run_janitor())
+    yield
+    janitor.cancel()
+    maintenance.cancel()
+    await task_manager.stop()
+    await pipeline.shutdown()
+    extraction.shutdown()
+    docai.shutdown()
+
 # Configuration de l'application
 app = FastAPI(
     title="Document Processor Service",
     description="Service de traitement des documents PDF pour TechnicIA",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
-# Configuration Document AI
-DOCUMENT_AI_PROJECT = os.getenv("DOCUMENT_AI_PROJECT")
-DOCUMENT_AI_LOCATION = os.getenv("DOCUMENT_AI_LOCATION", "eu")
-DOCUMENT_AI_PROCESSOR_ID = os.getenv("DOCUMENT_AI_PROCESSOR_ID")
+# Échéance de chaque requête (en-tête X-Request-Budget), appliquée aux appels Document AI
+app.add_middleware(RequestBudgetMiddleware)
 
-# Stockage temporaire
-TEMP_DIR = Path(os.getenv("TEMP_DIR", "/tmp/technicia"))
+# Stockage temporaire (organisation et nettoyage dans storage.py)
+TEMP_DIR = storage.TEMP_DIR
 TEMP_DIR.mkdir(exist_ok=True, parents=True)
 
-# Suivi des tâches en cours
-processing_tasks = {}
+# Taille des blocs de lecture des fichiers (la mémoire par upload reste bornée à un bloc)
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
+# Attente maximale d'un traitement identique déjà en cours (secondes)
+JOB_WAIT_TIMEOUT = float(os.getenv("JOB_WAIT_TIMEOUT", "600"))
+
+# Suivi des tâches en cours (traitements asynchrones)
+task_manager = TaskManager()
+processing_tasks = task_manager.tasks
+
+# Traitements synchrones en cours dans ce processus, par job (un appel identique attend le premier)
+running_jobs: Dict[str, asyncio.Future] = {}
+
+# Journal persistant des jobs et de leurs points de reprise
+job_store = JobStore("document-processor")
+
+# Empreintes des pages de la dernière révision ingérée de chaque document
+revision_store = RevisionStore()
+
+# Part de la progression attribuée à chaque étape d'un traitement asynchrone
+TASK_STAGE_PROGRESS = {
+    "text": (0, 20),
+    "ocr": (20, 70),
+    "images": (70, 95)
+}
 
 # Modèles de données
 class ProcessByPathRequest(BaseModel):
@@ -50,6 +100,66 @@ class ProcessByPathRequest(BaseModel):
     outputPath: Optional[str] = Field(None, description="Répertoire de sortie pour les résultats")
     extractImages: bool = Field(True, description="Extraire les images du document")
     extractText: bool = Field(True, description="Extraire le texte du document")
+    fileHash: Optional[str] = Field(None, description="SHA-256 du fichier (calculé si absent)")
+    useCache: bool = Field(True, description="Réutiliser un résultat Document AI déjà calculé pour ce contenu")
+    localTextLayer: bool = Field(True, description="Extraire localement les pages disposant d'une couche texte")
+    renderVectorDrawings: bool = Field(False, description="Rendre aussi en images les dessins vectoriels")
+
+class IngestRequest(BaseModel):
+    documentId: str = Field(..., description="Identifiant unique du document")
+    filePath: str = Field(..., description="Chemin vers le fichier PDF à ingérer")
+    fileName: Optional[str] = Field(None, description="Nom du fichier (optionnel)")
+    mimeType: str = Field("application/pdf", description="Type MIME du document")
+    outputPath: Optional[str] = Field(None, description="Répertoire de sortie pour les images extraites")
+    fileHash: Optional[str] = Field(None, description="SHA-256 du fichier (calculé si absent)")
+    metadata: Dict[str, Any] = Field({}, description="Métadonnées indexées avec le document")
+    useCache: bool = Field(True, description="Réutiliser un résultat Document AI déjà calculé pour ce contenu")
+    localTextLayer: bool = Field(True, description="Extraire localement les pages disposant d'une couche texte")
+    renderVectorDrawings: bool = Field(False, description="Rendre aussi en images les dessins vectoriels")
+    visionProfile: Optional[str] = Field(None, description="Profil d'analyse Vision des images: fast, ocr, full ou two-stage")
+    incremental: bool = Field(True, description="Ne traiter que les pages modifiées depuis la dernière ingestion du document")
+    wait: bool = Field(False, description="Attendre la fin de l'ingestion au lieu de rendre la main immédiatement")
+
+async def save_upload(file: UploadFile, destination: Path) -> Tuple[str, int]:
+    """
+    Écrit un fichier uploadé sur disque par blocs, en calculant son SHA-256 au fil de l'eau.
+    
+    Args:
+        file: Le fichier uploadé
+        destination: Chemin du fichier à écrire
+        
+    Returns:
+        L'empreinte SHA-256 hexadécimale et la taille en octets
+    """
+    digest = hashlib.sha256()
+    size = 0
+    
+    with open(destination, "wb") as output:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            output.write(chunk)
+            size += len(chunk)
+    
+    return digest.hexdigest(), size
+
+def compute_file_hash(file_path: Path) -> str:
+    """
+    Calcule le SHA-256 d'un fichier en le lisant par blocs.
+    
+    Args:
+        file_path: Chemin du fichier
+        
+    Returns:
+        L'empreinte SHA-256 hexadécimale
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
 
 @app.get("/health")
 async def health_check():
@@ -57,13 +167,13 @@ async def health_check():
     try:
         return {
             "status": "healthy",
-            "google_cloud_configured": all([
-                DOCUMENT_AI_PROJECT,
-                DOCUMENT_AI_LOCATION,
-                DOCUMENT_AI_PROCESSOR_ID
-            ]),
+            "google_cloud_configured": docai.is_configured(),
             "temp_dir": str(TEMP_DIR),
-            "active_tasks": len(processing_tasks)
+            "active_tasks": sum(1 for task in processing_tasks.values() if task["status"] in ("pending", "processing")),
+            "tasks": task_manager.stats(),
+            "jobs": job_store.stats(),
+            "storage": await storage.usage(),
+            "document_ai": docai.stats()
         }
     except Exception as e:
         logger.error(f"Erreur de santé: {str(e)}")
@@ -72,138 +182,374 @@ async def health_check():
             content={"status": "error", "message": str(e)}
         )
 
-@app.post("/api/process")
-async def process_by_path(request: ProcessByPathRequest):
+async def process_pdf_document(request: ProcessByPathRequest,
+                               on_progress: Optional[Callable[[str, int, int], None]] = None,
+                               checkpoints: Optional[Any] = None) -> Dict[str, Any]:
     """
-    Traite un document PDF à partir de son chemin sur le système de fichiers.
+    Extrait le texte et les images d'un document PDF.
     
     Args:
         request: Informations sur le document à traiter
+        on_progress: Appelée avec (étape, pages terminées, pages à traiter) au fil du traitement
+        checkpoints: Points de reprise du job (lots Document AI déjà traités)
         
     Returns:
         Les données extraites du document
     """
-    try:
-        logger.info(f"Traitement du document par chemin: {request.filePath} (ID: {request.documentId})")
+    logger.info(f"Traitement du document par chemin: {request.filePath} (ID: {request.documentId})")
+    
+    file_path = validate_pdf_path(request.filePath)
+    
+    # Préparation du nom de fichier
+    file_name = request.fileName or file_path.name
+    
+    # Empreinte du contenu, calculée par blocs si l'appelant ne l'a pas fournie
+    file_hash = request.fileHash or await asyncio.to_thread(compute_file_hash, file_path)
+    
+    # Préparation du répertoire de sortie
+    output_path = str(output_dir_for(request))
+    os.makedirs(output_path, exist_ok=True)
+    
+    # Extraire le texte: couche texte native en local, pages numérisées via Document AI
+    ocr_result = await extraction.extract_pages(
+        str(file_path),
+        request.mimeType,
+        file_hash=file_hash,
+        use_cache=request.useCache,
+        local_text=request.localTextLayer,
+        on_progress=on_progress,
+        checkpoints=checkpoints
+    )
+    pages = ocr_result["pages"]
+    
+    # Extraire et structurer le texte si demandé
+    text_blocks = []
+    if request.extractText:
+        for page in pages:
+            text_blocks.extend(page["textBlocks"])
+    
+    # Extraire les images si demandé (une entrée par image unique du document)
+    images = []
+    image_occurrences = 0
+    if request.extractImages:
+        image_output_dir = Path(output_path) / "images"
+        image_output_dir.mkdir(exist_ok=True)
         
-        # Validation du chemin de fichier
-        file_path = Path(request.filePath)
-        if not file_path.exists():
-            raise HTTPException(
-                status_code=404,
-                detail=f"Fichier non trouvé: {request.filePath}"
+        try:
+            image_result = await extraction.extract_images(
+                str(file_path),
+                request.documentId,
+                str(image_output_dir),
+                page_count=len(pages),
+                render_vector=request.renderVectorDrawings,
+                on_progress=on_progress
             )
+            images = image_result["images"]
+            image_occurrences = image_result["occurrences"]
+        except Exception as e:
+            logger.warning(f"Extraction des images impossible pour {file_path}: {str(e)}")
+    
+    # Structurer le résultat
+    structured_result = {
+        "success": True,
+        "documentId": request.documentId,
+        "fileName": file_name,
+        "pageCount": len(pages),
+        "textBlocks": text_blocks,
+        "images": images,
+        "processingDetails": {
+            "processingTime": time.time(),
+            "documentAiModel": "default",
+            "mimeType": ocr_result["mimeType"],
+            "shardCount": ocr_result["shardCount"],
+            "skippedShards": ocr_result["skippedShards"],
+            "documentAiCacheHit": ocr_result["cacheHit"],
+            "localTextPages": ocr_result["localTextPages"],
+            "ocrPages": ocr_result["ocrPages"],
+            "imageOccurrences": image_occurrences,
+            "uniqueImages": len(images)
+        },
+        "metadata": {
+            "originalPath": str(file_path),
+            "outputPath": output_path,
+            "sha256": file_hash,
+            "fileSize": file_path.stat().st_size
+        }
+    }
+    
+    return structured_result
+
+def validate_pdf_path(path: str) -> Path:
+    """
+    Vérifie qu'un chemin désigne un fichier PDF existant.
+    
+    Args:
+        path: Chemin du fichier
         
-        if not file_path.is_file():
-            raise HTTPException(
-                status_code=400,
-                detail=f"Le chemin spécifié n'est pas un fichier: {request.filePath}"
-            )
+    Returns:
+        Le chemin validé
+    """
+    file_path = Path(path)
+    if not file_path.exists():
+        raise HTTPException(
+            status_code=404,
+            detail=f"Fichier non trouvé: {path}"
+        )
+    
+    if not file_path.is_file():
+        raise HTTPException(
+            status_code=400,
+            detail=f"Le chemin spécifié n'est pas un fichier: {path}"
+        )
+    
+    # Validation du type de fichier
+    if not file_path.name.lower().endswith('.pdf'):
+        raise HTTPException(
+            status_code=400,
+            detail="Type de fichier non supporté. Seuls les fichiers PDF sont acceptés."
+        )
+    
+    return file_path
+
+def output_dir_for(request: ProcessByPathRequest) -> Path:
+    """
+    Retourne le répertoire de sortie d'un document.
+    
+    Args:
+        request: Informations sur le document à traiter
         
-        # Validation du type de fichier
-        if not file_path.name.lower().endswith('.pdf'):
-            raise HTTPException(
-                status_code=400,
-                detail="Type de fichier non supporté. Seuls les fichiers PDF sont acceptés."
-            )
+    Returns:
+        Le répertoire demandé, ou par défaut un répertoire réparti sous TEMP_DIR
+    """
+    return Path(request.outputPath) if request.outputPath else storage.document_dir(request.documentId)
+
+async def wait_for_job(job_id: str, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Attend la fin d'un job exécuté par un autre appel.
+    
+    Args:
+        job_id: Identifiant du job
+        payload: Requête du job, pour le recréer s'il a été purgé pendant l'attente
         
-        # Initialiser le client Document AI
-        client = documentai.DocumentProcessorServiceClient()
-        name = f"projects/{DOCUMENT_AI_PROJECT}/locations/{DOCUMENT_AI_LOCATION}/processors/{DOCUMENT_AI_PROCESSOR_ID}"
-        
-        # Lire le fichier PDF
-        with open(file_path, "rb") as f:
-            content = f.read()
-        
-        # Préparation du nom de fichier
-        file_name = request.fileName or file_path.name
-        
-        # Préparation du répertoire de sortie
-        output_path = request.outputPath or str(TEMP_DIR / request.documentId)
-        os.makedirs(output_path, exist_ok=True)
-        
-        # Préparer et envoyer la requête à Document AI
-        document = documentai.RawDocument(content=content, mime_type=request.mimeType)
-        request_doc_ai = documentai.ProcessRequest(name=name, raw_document=document)
-        
-        # Traiter le document
-        result = client.process_document(request=request_doc_ai)
-        document = result.document
-        
-        # Extraire et structurer le texte si demandé
-        text_blocks = []
-        if request.extractText:
-            text = document.text
-            
-            # Extraction du texte par page
-            for page in document.pages:
-                page_blocks = []
-                for paragraph in page.paragraphs:
-                    para_text = get_text_from_layout(paragraph.layout, text)
-                    # Ne pas ajouter de paragraphes vides
-                    if para_text.strip():
-                        page_blocks.append({
-                            "text": para_text,
-                            "confidence": paragraph.layout.confidence,
-                            "page": page.page_number
-                        })
-                
-                text_blocks.extend(page_blocks)
-        
-        # Extraire les images si demandé
-        images = []
-        if request.extractImages:
-            image_output_dir = Path(output_path) / "images"
-            image_output_dir.mkdir(exist_ok=True)
-            
-            for page_idx, page in enumerate(document.pages):
-                page_number = page.page_number
-                
-                # Si la page a une image détectée, l'enregistrer
-                # Note: Dans un vrai traitement, nous utiliserions les données réelles d'image
-                # Pour ce MVP, nous simulons la détection d'images
-                
-                # Simulation: 1-2 images par page
-                for img_idx in range(min(2, page_idx % 3 + 1)):
-                    image_id = f"img-{request.documentId}-p{page_number}-{img_idx}"
-                    image_path = image_output_dir / f"{image_id}.png"
-                    
-                    # Création d'une image factice (en production, extraite réellement du PDF)
-                    # Ici nous créons juste un fichier vide pour simuler
-                    with open(image_path, "w") as f:
-                        f.write("")
-                    
-                    images.append({
-                        "id": image_id,
-                        "path": str(image_path),
-                        "page": page_number,
-                        "width": page.dimension.width if hasattr(page, "dimension") and hasattr(page.dimension, "width") else 0,
-                        "height": page.dimension.height if hasattr(page, "dimension") and hasattr(page.dimension, "height") else 0
-                    })
-        
-        # Structurer le résultat
-        structured_result = {
-            "success": True,
-            "documentId": request.documentId,
-            "fileName": file_name,
-            "pageCount": len(document.pages),
-            "textBlocks": text_blocks,
-            "images": images,
-            "processingDetails": {
-                "processingTime": time.time(),
-                "documentAiModel": "default",
-                "mimeType": document.mime_type
-            },
-            "metadata": {
-                "originalPath": str(file_path),
-                "outputPath": output_path
-            }
-        }
+    Returns:
+        Le job terminé, ou None si ce processus en a pris la main (propriétaire disparu)
+    """
+    deadline = time.time() + JOB_WAIT_TIMEOUT
+    while time.time() < deadline:
+        await asyncio.sleep(1.0)
+        job = await asyncio.to_thread(job_store.get, job_id)
+        if job is None:
+            # Job purgé pendant l'attente: recréé, puis exécuté par le premier appel qui en prend la main
+            await asyncio.to_thread(job_store.create, job_id, "process", payload, False)
+        elif job["status"] in ("completed", "error"):
+            return job
+        if await asyncio.to_thread(job_store.claim, job_id):
+            return None
+    
+    raise HTTPException(
+        status_code=504,
+        detail=f"Le traitement {job_id} est toujours en cours"
+    )
+
+async def run_document_job(request: ProcessByPathRequest, job_id: Optional[str] = None,
+                           on_progress: Optional[Callable[[str, int, int], None]] = None) -> Dict[str, Any]:
+    """
+    Traite un document sous le contrôle du journal des jobs.
+    
+    Les lots Document AI terminés sont enregistrés comme points de reprise.
+    Sans identifiant de job (traitement synchrone), le job est dérivé du
+    document et de l'empreinte du fichier : une nouvelle tentative de
+    l'appelant reprend là où la précédente s'était arrêtée, et un appel
+    identique reçu pendant le traitement (nouvelle tentative n8n après un
+    délai dépassé) en attend le résultat au lieu de relancer l'OCR.
+    
+    Args:
+        request: Informations sur le document à traiter
+        job_id: Identifiant du job (traitement asynchrone)
+        on_progress: Appelée avec (étape, pages terminées, pages à traiter) au fil du traitement
+        
+    Returns:
+        Les données extraites du document
+    """
+    if job_id is not None:
+        return await run_claimed_job(request, job_id, on_progress)
+    
+    file_path = Path(request.filePath)
+    if not file_path.is_file():
+        # Requête invalide: l'erreur est levée par le traitement, sans job
+        return await process_pdf_document(request, on_progress)
+    
+    if not request.fileHash:
+        file_hash = await asyncio.to_thread(compute_file_hash, file_path)
+        request = request.model_copy(update={"fileHash": file_hash})
+    
+    job_id = f"sync-{request.documentId}-{request.fileHash[:16]}"
+    running = running_jobs.get(job_id)
+    if running is None:
+        # Le traitement se poursuit si l'appelant abandonne: sa nouvelle tentative le rejoindra
+        running = asyncio.ensure_future(run_sync_job(request, job_id, on_progress))
+        running_jobs[job_id] = running
+        
+        def forget(task: asyncio.Future):
+            running_jobs.pop(job_id, None)
+            if not task.cancelled():
+                # Erreur consultée même si tous les appelants ont abandonné
+                task.exception()
+        running.add_done_callback(forget)
+    else:
+        logger.info(f"Traitement {job_id} déjà en cours dans ce processus, attente de sa fin")
+    return await asyncio.shield(running)
+
+async def run_sync_job(request: ProcessByPathRequest, job_id: str,
+                       on_progress: Optional[Callable[[str, int, int], None]] = None) -> Dict[str, Any]:
+    """
+    Prend la main sur le job d'un traitement synchrone et l'exécute, ou attend celui d'un autre processus.
+    
+    Args:
+        request: Informations sur le document à traiter (empreinte renseignée)
+        job_id: Identifiant du job, dérivé du document et de l'empreinte
+        on_progress: Appelée avec (étape, pages terminées, pages à traiter) au fil du traitement
+        
+    Returns:
+        Les données extraites du document
+    """
+    payload = {"request": request.model_dump()}
+    job = await asyncio.to_thread(job_store.create, job_id, "process", payload, False)
+    if job["status"] == "completed":
+        # Traitement identique déjà terminé: ses fichiers de sortie ont pu être nettoyés depuis, il est refait
+        await asyncio.to_thread(job_store.forget, "process", job_id)
+        await asyncio.to_thread(job_store.create, job_id, "process", payload, False)
+    
+    if not await asyncio.to_thread(job_store.claim, job_id):
+        logger.info(f"Traitement {job_id} déjà en cours, attente de sa fin")
+        job = await wait_for_job(job_id, payload)
+        if job is not None:
+            if job["status"] == "error":
+                raise HTTPException(status_code=500, detail=job["error"])
+            return job["result"]
+    
+    return await run_claimed_job(request, job_id, on_progress)
+
+async def run_claimed_job(request: ProcessByPathRequest, job_id: str,
+                          on_progress: Optional[Callable[[str, int, int], None]] = None) -> Dict[str, Any]:
+    """
+    Exécute un job de traitement dont ce processus est propriétaire.
+    
+    Args:
+        request: Informations sur le document à traiter
+        job_id: Identifiant du job
+        on_progress: Appelée avec (étape, pages terminées, pages à traiter) au fil du traitement
+        
+    Returns:
+        Les données extraites du document
+    """
+    try:
+        # Le fichier source et le répertoire de sortie ne peuvent pas être nettoyés pendant le traitement
+        with storage.pinned(Path(request.filePath), output_dir_for(request)):
+            result = await process_pdf_document(request, on_progress, job_store.checkpoints(job_id))
+    except Exception as e:
+        await asyncio.to_thread(job_store.fail, job_id, getattr(e, "detail", None) or str(e))
+        raise
+    
+    # Résultat conservé pour les appels identiques qui attendent ce traitement
+    await asyncio.to_thread(job_store.finish, job_id, result)
+    return result
+
+async def run_ingest_job(request: IngestRequest, job_id: str,
+                         on_progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """
+    Ingère un document (extraction, analyse des images, indexation) sous le contrôle du journal des jobs.
+    
+    Si une révision précédente du document a déjà été ingérée, seules les
+    pages dont l'empreinte a changé sont traitées ; les vecteurs des pages
+    modifiées ou supprimées sont retirés de l'index.
+    
+    Args:
+        request: Informations sur le document à ingérer
+        job_id: Identifiant du job, dont ce processus est propriétaire
+        on_progress: Appelée avec les statistiques du pipeline à chaque avancée
+        
+    Returns:
+        Le bilan de l'ingestion
+    """
+    try:
+        file_path = validate_pdf_path(request.filePath)
+        file_hash = request.fileHash or await asyncio.to_thread(compute_file_hash, file_path)
+        output_path = output_dir_for(request)
+        
+        fingerprints = await extraction.fingerprint_pages(str(file_path))
+        previous = await asyncio.to_thread(revision_store.get, request.documentId)
+        if previous is None:
+            revision = compare(None, fingerprints)
+        elif request.incremental:
+            revision = compare(previous["fingerprints"], fingerprints)
+        else:
+            # Réingestion complète: toutes les pages de la révision précédente sont retirées
+            revision = compare([None] * len(previous["fingerprints"]), fingerprints)
+        retire_pages = [] if previous is None else revision["changedPages"] + revision["removedPages"]
+        logger.info(f"Ingestion de {request.documentId}: {len(revision['changedPages'])} page(s) à traiter, "
+                    f"{len(revision['unchangedPages'])} inchangée(s), {len(revision['removedPages'])} supprimée(s)")
         
-        return structured_result
+        with storage.pinned(file_path, output_path):
+            result = await pipeline.IngestionPipeline(
+                request.documentId,
+                str(file_path),
+                str(output_path),
+                mime_type=request.mimeType,
+                file_hash=file_hash,
+                file_name=request.fileName or file_path.name,
+                metadata=request.metadata,
+                use_cache=request.useCache,
+                local_text=request.localTextLayer,
+                render_vector=request.renderVectorDrawings,
+                checkpoints=job_store.checkpoints(job_id),
+                on_progress=on_progress,
+                pages=revision["changedPages"],
+                retire_pages=retire_pages,
+                vision_profile=request.visionProfile
+            ).run()
         
+        # Pages dont une image a échoué: enregistrées sans empreinte pour être retraitées à la prochaine révision
+        failed_pages = sorted({page for image in result["failedImages"] for page in image["pages"]})
+        await asyncio.to_thread(revision_store.put, request.documentId, file_hash, settle(fingerprints, failed_pages))
+    except Exception as e:
+        await asyncio.to_thread(job_store.fail, job_id, getattr(e, "detail", None) or str(e))
+        raise
+    
+    result = {
+        **result,
+        "jobId": job_id,
+        "revision": {
+            "previousFileHash": previous["fileHash"] if previous else None,
+            "fileHash": file_hash,
+            **revision,
+            "failedPages": failed_pages
+        }
+    }
+    await asyncio.to_thread(job_store.finish, job_id, result)
+    return result
+
+@app.post("/api/process")
+async def process_by_path(request: ProcessByPathRequest):
+    """
+    Traite un document PDF à partir de son chemin sur le système de fichiers.
+    
+    Args:
+        request: Informations sur le document à traiter
+        
+    Returns:
+        Les données extraites du document
+    """
+    try:
+        return await run_document_job(request)
     except HTTPException:
         raise
+    except TimeoutError as e:
+        logger.error(f"Délai dépassé lors du traitement du document: {str(e)}")
+        raise HTTPException(
+            status_code=504,
+            detail=f"Délai dépassé lors du traitement du document: {str(e)}"
+        )
     except Exception as e:
         logger.error(f"Erreur lors du traitement du document: {str(e)}")
         raise HTTPException(
@@ -236,12 +582,10 @@ async def process_document(file: UploadFile = File(...)):
         # Générer un ID unique
         document_id = str(uuid.uuid4())
         
-        # Sauvegarder le fichier temporairement
-        temp_file_path = TEMP_DIR / f"{document_id}_{file.filename}"
-        
-        with open(temp_file_path, "wb") as temp_file:
-            content = await file.read()
-            temp_file.write(content)
+        # Sauvegarder le fichier temporairement, par blocs, en calculant son empreinte
+        temp_file_path = storage.upload_path(document_id, file.filename)
+        file_hash, file_size = await save_upload(file, temp_file_path)
+        logger.info(f"Fichier {file.filename} enregistré ({file_size} octets, sha256 {file_hash[:12]})")
         
         # Utiliser la nouvelle route de traitement par chemin
         request = ProcessByPathRequest(
@@ -250,14 +594,15 @@ async def process_document(file: UploadFile = File(...)):
             fileName=file.filename,
             mimeType="application/pdf",
             extractImages=True,
-            extractText=True
+            extractText=True,
+            fileHash=file_hash
         )
         
         result = await process_by_path(request)
         
         # Nettoyer le fichier temporaire
         try:
-            os.unlink(temp_file_path)
+            storage.remove_entry(temp_file_path)
         except Exception as e:
             logger.warning(f"Erreur lors du nettoyage du fichier {temp_file_path}: {str(e)}")
         
@@ -303,6 +648,222 @@ async def process_file(request: Request):
             detail=f"Erreur lors du traitement du fichier: {str(e)}"
         )
 
+def task_progress(task_id: str) -> Callable[[str, int, int], None]:
+    """
+    Construit la fonction de suivi qui reporte l'avancement page par page sur une tâche.
+    
+    Args:
+        task_id: L'identifiant de la tâche
+        
+    Returns:
+        La fonction à transmettre au traitement
+    """
+    def on_progress(stage: str, done: int, total: int):
+        start, end = TASK_STAGE_PROGRESS[stage]
+        progress = start + (end - start) * done // total if total else end
+        task_manager.update(task_id, stage=stage, progress=progress, pages_done=done, pages_total=total)
+    return on_progress
+
+def ingest_progress(task_id: str) -> Callable[[Dict[str, Any]], None]:
+    """
+    Construit la fonction de suivi qui reporte l'avancement du pipeline d'ingestion sur une tâche.
+    
+    Args:
+        task_id: L'identifiant de la tâche
+        
+    Returns:
+        La fonction à transmettre au pipeline
+    """
+    def on_progress(stats: Dict[str, Any]):
+        total = stats["selectedPages"]
+        # 100 est réservé à la fin de la tâche (métadonnées indexées)
+        progress = min(99, 99 * stats["indexedPages"] // total) if total else 0
+        task_manager.update(task_id, stage="ingest", progress=progress, pages_done=stats["indexedPages"],
+                            pages_total=total, pipeline=dict(stats))
+    return on_progress
+
+async def submit_processing_task(request: ProcessByPathRequest, cleanup_path: Optional[Path] = None,
+                                 task_id: Optional[str] = None, kind: str = "process") -> Dict[str, Any]:
+    """
+    Place le traitement d'un document dans la file de tâches.
+    
+    La tâche est aussi enregistrée dans le journal des jobs, sous le même
+    identifiant, pour être reprise si le service redémarre avant la fin.
+    
+    Args:
+        request: Informations sur le document à traiter (IngestRequest pour une ingestion)
+        cleanup_path: Fichier temporaire à supprimer une fois le traitement terminé
+        task_id: Identifiant à réutiliser (reprise d'un job interrompu)
+        kind: Type de job, "process" (extraction seule) ou "ingest" (pipeline complet)
+        
+    Returns:
+        L'identifiant de la tâche et les URL de suivi
+    """
+    async def handler(task_id: str) -> Dict[str, Any]:
+        try:
+            if not await asyncio.to_thread(job_store.claim, task_id):
+                raise HTTPException(status_code=409, detail=f"Le job {task_id} est traité par un autre processus")
+            if kind == "ingest":
+                return await run_ingest_job(request, task_id, on_progress=ingest_progress(task_id))
+            return await run_document_job(request, job_id=task_id, on_progress=task_progress(task_id))
+        finally:
+            if cleanup_path is not None:
+                try:
+                    storage.remove_entry(cleanup_path)
+                except Exception as e:
+                    logger.warning(f"Erreur lors du nettoyage du fichier {cleanup_path}: {str(e)}")
+    
+    resumed = task_id is not None
+    task_id = task_id or str(uuid.uuid4())
+    
+    if not resumed:
+        await asyncio.to_thread(
+            job_store.create,
+            task_id,
+            kind,
+            {"request": request.model_dump(), "cleanupPath": str(cleanup_path) if cleanup_path else None},
+            True,
+            True
+        )
+    
+    try:
+        task_manager.submit(handler, filename=request.fileName or Path(request.filePath).name, task_id=task_id)
+    except TaskQueueFull as e:
+        if resumed:
+            # Le job reste actif et sera repris plus tard
+            await asyncio.to_thread(job_store.release, task_id)
+        else:
+            await asyncio.to_thread(job_store.fail, task_id, str(e))
+        raise HTTPException(status_code=503, detail=str(e))
+    
+    logger.info(f"Tâche {task_id} créée pour le document {request.documentId}")
+    return {
+        "task_id": task_id,
+        "documentId": request.documentId,
+        "status": "pending",
+        "status_url": f"/task/{task_id}",
+        "events_url": f"/task/{task_id}/events"
+    }
+
+async def resume_job(job: Dict[str, Any]):
+    """
+    Reprend un job de traitement interrompu par un redémarrage du service.
+    
+    Args:
+        job: Le job repris, tel qu'enregistré dans le journal
+    """
+    model = IngestRequest if job["kind"] == "ingest" else ProcessByPathRequest
+    request = model(**job["payload"]["request"])
+    cleanup_path = job["payload"].get("cleanupPath")
+    
+    if not Path(request.filePath).is_file():
+        await asyncio.to_thread(job_store.fail, job["job_id"], f"Fichier non trouvé: {request.filePath}")
+        return
+    
+    try:
+        await submit_processing_task(request, cleanup_path=Path(cleanup_path) if cleanup_path else None,
+                                     task_id=job["job_id"], kind=job["kind"])
+    except HTTPException as e:
+        logger.warning(f"Reprise du job {job['job_id']} reportée: {e.detail}")
+
+@app.post("/api/process-async", status_code=202)
+async def process_by_path_async(request: ProcessByPathRequest):
+    """
+    Soumet le traitement d'un document PDF par chemin et rend la main immédiatement.
+    
+    Args:
+        request: Informations sur le document à traiter
+        
+    Returns:
+        L'identifiant de la tâche à suivre via /task/{task_id}
+    """
+    file_path = Path(request.filePath)
+    if not file_path.is_file():
+        raise HTTPException(
+            status_code=404,
+            detail=f"Fichier non trouvé: {request.filePath}"
+        )
+    
+    return await submit_processing_task(request)
+
+@app.post("/process-async", status_code=202)
+async def process_document_async(file: UploadFile = File(...)):
+    """
+    Reçoit un document PDF et le traite en arrière-plan.
+    
+    Args:
+        file: Le fichier PDF à traiter
+        
+    Returns:
+        L'identifiant de la tâche à suivre via /task/{task_id}
+    """
+    if not file.filename.lower().endswith('.pdf'):
+        raise HTTPException(
+            status_code=400,
+            detail="Type de fichier non supporté. Seuls les fichiers PDF sont acceptés."
+        )
+    
+    document_id = str(uuid.uuid4())
+    temp_file_path = storage.upload_path(document_id, file.filename)
+    file_hash, file_size = await save_upload(file, temp_file_path)
+    logger.info(f"Fichier {file.filename} enregistré ({file_size} octets, sha256 {file_hash[:12]})")
+    
+    request = ProcessByPathRequest(
+        documentId=document_id,
+        filePath=str(temp_file_path),
+        fileName=file.filename,
+        mimeType="application/pdf",
+        extractImages=True,
+        extractText=True,
+        fileHash=file_hash
+    )
+    
+    try:
+        return await submit_processing_task(request, cleanup_path=temp_file_path)
+    except HTTPException:
+        storage.remove_entry(temp_file_path)
+        raise
+
+@app.post("/api/ingest")
+async def ingest_document(request: IngestRequest):
+    """
+    Ingère un document de bout en bout: extraction, analyse des images et indexation.
+    
+    Les pages traversent les étapes par lots, les étapes se chevauchent et
+    seuls de petits lots sont envoyés au schema-analyzer et au vector-engine.
+    Un seul appel suffit au workflow n8n.
+    
+    Args:
+        request: Informations sur le document à ingérer
+        
+    Returns:
+        L'identifiant de la tâche à suivre via /task/{task_id}, ou le bilan si wait est vrai
+    """
+    validate_pdf_path(request.filePath)
+    
+    if not request.wait:
+        return JSONResponse(status_code=202, content=await submit_processing_task(request, kind="ingest"))
+    
+    job_id = f"ingest-{request.documentId}-{uuid.uuid4().hex[:8]}"
+    await asyncio.to_thread(job_store.create, job_id, "ingest", {"request": request.model_dump()}, False, True)
+    try:
+        return await run_ingest_job(request, job_id)
+    except HTTPException:
+        raise
+    except TimeoutError as e:
+        logger.error(f"Délai dépassé lors de l'ingestion du document: {str(e)}")
+        raise HTTPException(
+            status_code=504,
+            detail=f"Délai dépassé lors de l'ingestion du document: {str(e)}"
+        )
+    except Exception as e:
+        logger.error(f"Erreur lors de l'ingestion du document: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Erreur lors de l'ingestion du document: {str(e)}"
+        )
+
+@app.get("/task/{task_id}")
 @app.post("/task/{task_id}")
 async def get_task_status(task_id: str):
     """
@@ -314,62 +875,53 @@ async def get_task_status(task_id: str):
     Returns:
         L'état actuel de la tâche
     """
-    if task_id not in processing_tasks:
+    task_info = await task_manager.get(task_id)
+    if task_info is None:
         raise HTTPException(
             status_code=404,
             detail=f"Tâche {task_id} non trouvée"
         )
     
-    task_info = processing_tasks[task_id]
-    
-    # Si la tâche est terminée et a un résultat, inclure le résultat
-    if task_info["status"] == "completed" and task_info["result"]:
-        return {
-            "task_id": task_id,
-            "status": task_info["status"],
-            "filename": task_info["filename"],
-            "progress": 100,
-            "processing_time": time.time() - task_info["start_time"],
-            "result": task_info["result"]
-        }
+    return describe(task_info)
+
+@app.get("/task/{task_id}/events")
+async def stream_task_events(task_id: str):
+    """
+    Diffuse l'avancement d'une tâche en server-sent events jusqu'à sa fin.
     
-    # Si la tâche est en erreur, inclure l'erreur
-    if task_info["status"] == "error":
-        return {
-            "task_id": task_id,
-            "status": task_info["status"],
-            "filename": task_info["filename"],
-            "progress": task_info["progress"],
-            "error": task_info["error"]
-        }
+    Args:
+        task_id: L'identifiant de la tâche
+        
+    Returns:
+        Un flux text/event-stream
+    """
+    if await task_manager.get(task_id) is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Tâche {task_id} non trouvée"
+        )
     
-    # Sinon, retourner l'état actuel
-    return {
-        "task_id": task_id,
-        "status": task_info["status"],
-        "filename": task_info["filename"],
-        "progress": task_info["progress"],
-        "processing_time": time.time() - task_info["start_time"]
-    }
+    return StreamingResponse(
+        task_manager.events(task_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
-def get_text_from_layout(layout, text):
+@app.get("/storage")
+async def get_storage_usage(refresh: bool = False):
     """
-    Extrait le texte à partir d'un layout Document AI.
+    Retourne l'occupation des fichiers de travail sous TEMP_DIR.
     
     Args:
-        layout: Le layout contenant les indices de texte
-        text: Le texte complet du document
+        refresh: Reparcourir les fichiers au lieu de renvoyer le dernier parcours
         
     Returns:
-        Le texte extrait
+        L'occupation par type d'entrée, les limites et le bilan du dernier nettoyage
     """
-    if layout.text_anchor.text_segments:
-        return "".join(
-            text[segment.start_index:segment.end_index]
-            for segment in layout.text_anchor.text_segments
-        )
-    return ""
+    return await storage.usage(refresh=refresh)
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8001, reload=True)
+    # WEB_CONCURRENCY > 1 active le mode production multi-workers (sans rechargement)
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    uvicorn.run("main:app", host="0.0.0.0", port=8001, reload=workers == 1, workers=workers)
@@ -0,0 +1,258 @@
+"""
+Manipulation locale des fichiers PDF pour TechnicIA (PyMuPDF).
+
+Les fonctions d'extraction sont exécutées dans un pool de processus : elles
+ouvrent elles-mêmes le fichier et ne renvoient que des structures simples.
+"""
+import hashlib
+import os
+import tempfile
+from typing import Any, Dict, List, Optional, Tuple
+
+import fitz
+
+def page_count(file_path: str) -> int:
+    """
+    Compte les pages d'un PDF.
+
+    Args:
+        file_path: Chemin vers le fichier PDF
+
+    Returns:
+        Le nombre de pages
+    """
+    with fitz.open(file_path) as pdf:
+        return pdf.page_count
+
+def plan_shards(pages: List[int], pages_per_shard: int) -> List[List[int]]:
+    """
+    Découpe une liste de numéros de page en lots de taille bornée.
+
+    Args:
+        pages: Numéros de page (à partir de 1), dans l'ordre
+        pages_per_shard: Nombre maximum de pages par lot
+
+    Returns:
+        Les lots de numéros de page
+    """
+    return [pages[i:i + pages_per_shard] for i in range(0, len(pages), pages_per_shard)]
+
+def _page_ranges(pages: List[int]) -> List[Tuple[int, int]]:
+    """Regroupe des numéros de page en plages contiguës (début, fin incluses)."""
+    ranges = []
+    for page in pages:
+        if ranges and ranges[-1][1] == page - 1:
+            ranges[-1] = (ranges[-1][0], page)
+        else:
+            ranges.append((page, page))
+    return ranges
+
+def build_shard(file_path: str, pages: List[int]) -> bytes:
+    """
+    Construit un PDF ne contenant que les pages demandées.
+
+    Args:
+        file_path: Chemin vers le PDF source
+        pages: Numéros de page (à partir de 1) à conserver, dans l'ordre
+
+    Returns:
+        Le contenu binaire du PDF extrait
+    """
+    with fitz.open(file_path) as source, fitz.open() as shard:
+        for start, end in _page_ranges(pages):
+            shard.insert_pdf(source, from_page=start - 1, to_page=end - 1)
+        # garbage=3 retire les ressources des pages non retenues
+        return shard.tobytes(garbage=3, deflate=True)
+
+def _is_usable_text(text: str, min_chars: int) -> bool:
+    """Vérifie qu'un texte est assez long et n'est pas fait de glyphes non décodables."""
+    stripped = "".join(text.split())
+    if len(stripped) < min_chars:
+        return False
+    # Les polices sans table ToUnicode produisent des caractères de remplacement
+    unreadable = sum(1 for char in stripped if char == "\ufffd" or not char.isprintable())
+    return unreadable / len(stripped) < 0.1
+
+def extract_text_layer(file_path: str, pages: List[int], min_chars: int = 50) -> List[Dict[str, Any]]:
+    """
+    Extrait localement le texte des pages qui possèdent une couche texte exploitable.
+
+    Args:
+        file_path: Chemin vers le PDF
+        pages: Numéros de page (à partir de 1) à examiner
+        min_chars: Nombre minimum de caractères pour considérer la couche texte exploitable
+
+    Returns:
+        Une entrée par page avec ses dimensions, l'indicateur de couche texte et,
+        si elle est exploitable, ses blocs de texte au format de Document AI
+    """
+    results = []
+    with fitz.open(file_path) as pdf:
+        for page_number in pages:
+            page = pdf[page_number - 1]
+            text_blocks = []
+            # Blocs (x0, y0, x1, y1, texte, numéro, type), dans l'ordre de lecture
+            for block in page.get_text("blocks", sort=True):
+                if block[6] == 0 and block[4].strip():
+                    text_blocks.append({
+                        "text": block[4],
+                        "confidence": 1.0,
+                        "page": page_number
+                    })
+
+            has_text_layer = _is_usable_text("".join(block["text"] for block in text_blocks), min_chars)
+            results.append({
+                "page": page_number,
+                "width": page.rect.width,
+                "height": page.rect.height,
+                "hasTextLayer": has_text_layer,
+                "textBlocks": text_blocks if has_text_layer else []
+            })
+    return results
+
+def _write_once(output_dir: str, name: str, data: bytes) -> str:
+    """Écrit un fichier de façon atomique s'il n'existe pas déjà (nom dérivé du contenu)."""
+    path = os.path.join(output_dir, name)
+    if not os.path.exists(path):
+        fd, temp_path = tempfile.mkstemp(dir=output_dir, suffix=".part")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    return path
+
+def _embedded_image(pdf: fitz.Document, xref: int) -> Optional[Tuple[bytes, str, int, int]]:
+    """Extrait une image intégrée, convertie en PNG si son format n'est pas PNG ou JPEG."""
+    info = pdf.extract_image(xref)
+    if not info or not info.get("image"):
+        return None
+
+    if info["ext"] in ("png", "jpeg", "jpg"):
+        return info["image"], info["ext"], info["width"], info["height"]
+
+    # JPX, JBIG2, CMYK...: conversion en PNG RVB lisible par Vision AI
+    pixmap = fitz.Pixmap(pdf, xref)
+    if pixmap.n - pixmap.alpha >= 4:
+        pixmap = fitz.Pixmap(fitz.csRGB, pixmap)
+    return pixmap.tobytes("png"), "png", pixmap.width, pixmap.height
+
+def _drawings_area(page: fitz.Page, min_drawings: int) -> Optional[fitz.Rect]:
+    """Retourne la zone couverte par les tracés vectoriels d'une page s'ils sont assez nombreux."""
+    drawings = page.get_drawings()
+    if len(drawings) < min_drawings:
+        return None
+
+    area = fitz.Rect()
+    for drawing in drawings:
+        area |= drawing["rect"]
+    area &= page.rect
+
+    # Ignorer les tracés épars (filets, cadres de page)
+    if area.is_empty or area.width * area.height < 0.05 * page.rect.width * page.rect.height:
+        return None
+    return area
+
+def extract_images(file_path: str, pages: List[int], output_dir: str, render_vector: bool = False,
+                   min_size: int = 32, render_dpi: int = 150, min_drawings: int = 20) -> List[Dict[str, Any]]:
+    """
+    Extrait les images des pages d'un PDF et les enregistre sous un nom dérivé de leur contenu.
+
+    Une image présente sur plusieurs pages (logo, cartouche) n'est écrite qu'une
+    fois ; chaque occurrence est rapportée avec son empreinte pour permettre le
+    dédoublonnage à l'échelle du document.
+
+    Args:
+        file_path: Chemin vers le PDF
+        pages: Numéros de page (à partir de 1) à traiter
+        output_dir: Répertoire où écrire les images
+        render_vector: Rendre aussi en PNG les dessins vectoriels
+        min_size: Largeur et hauteur minimales en pixels (icônes et puces ignorées)
+        render_dpi: Résolution du rendu des dessins vectoriels
+        min_drawings: Nombre minimum de tracés pour qu'une page soit considérée comme un dessin
+
+    Returns:
+        Une entrée par occurrence d'image: empreinte, chemin, page, dimensions, format et origine
+    """
+    occurrences = []
+    extracted = {}
+
+    with fitz.open(file_path) as pdf:
+        for page_number in pages:
+            page = pdf[page_number - 1]
+
+            for image_info in page.get_images(full=True):
+                xref = image_info[0]
+                if xref not in extracted:
+                    image = _embedded_image(pdf, xref)
+                    if image is None or image[2] < min_size or image[3] < min_size:
+                        extracted[xref] = None
+                    else:
+                        data, ext, width, height = image
+                        digest = hashlib.sha256(data).hexdigest()
+                        extracted[xref] = {
+                            "sha256": digest,
+                            "path": _write_once(output_dir, f"{digest[:24]}.{ext}", data),
+                            "width": width,
+                            "height": height,
+                            "format": ext,
+                            "source": "embedded"
+                        }
+
+                if extracted[xref] is not None:
+                    occurrences.append({**extracted[xref], "page": page_number})
+
+            if render_vector:
+                area = _drawings_area(page, min_drawings)
+                if area is not None:
+                    pixmap = page.get_pixmap(dpi=render_dpi, clip=area)
+                    data = pixmap.tobytes("png")
+                    digest = hashlib.sha256(data).hexdigest()
+                    occurrences.append({
+                        "sha256": digest,
+                        "path": _write_once(output_dir, f"{digest[:24]}.png", data),
+                        "width": pixmap.width,
+                        "height": pixmap.height,
+                        "format": "png",
+                        "source": "vector",
+                        "page": page_number
+                    })
+
+    return occurrences
+
+def page_fingerprints(file_path: str, pages: List[int], render_dpi: int = 0) -> List[Dict[str, Any]]:
+    """
+    Calcule une empreinte du contenu de chaque page, stable d'une révision à l'autre.
+
+    Par défaut, l'empreinte porte sur les flux de contenu décompressés de la
+    page et sur les flux des images et formulaires qu'elle référence : elle ne
+    dépend pas de la numérotation des objets ni de la compression choisie par
+    l'outil qui a produit le PDF. Avec render_dpi, elle porte sur un rendu en
+    niveaux de gris de la page, plus coûteux mais insensible à toute
+    réécriture des flux.
+
+    Args:
+        file_path: Chemin vers le PDF
+        pages: Numéros de page (à partir de 1) à traiter
+        render_dpi: Résolution du rendu (0 pour les flux de contenu)
+
+    Returns:
+        Une entrée par page avec son numéro et son empreinte hexadécimale
+    """
+    results = []
+    with fitz.open(file_path) as pdf:
+        for page_number in pages:
+            page = pdf[page_number - 1]
+            digest = hashlib.sha256(f"{page.rotation}:{tuple(page.rect)}".encode("utf-8"))
+
+            if render_dpi:
+                digest.update(page.get_pixmap(dpi=render_dpi, colorspace=fitz.csGRAY).samples)
+            else:
+                digest.update(page.read_contents())
+                # Les ressources sont désignées par nom dans les flux: leur contenu compte aussi
+                xrefs = {image[0] for image in page.get_images(full=True)}
+                xrefs.update(xobject[0] for xobject in page.get_xobjects())
+                # Flux décompressés, empreintes triées: ni la compression ni la numérotation des objets ne comptent
+                for resource in sorted(hashlib.sha256(pdf.xref_stream(xref) or b"").digest() for xref in xrefs):
+                    digest.update(resource)
+
+            results.append({"page": page_number, "fingerprint": digest.hexdigest()[:32]})
+    return results
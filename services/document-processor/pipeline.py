@@ -0,0 +1,362 @@
+"""
+Pipeline d'ingestion de bout en bout pour TechnicIA.
+
+Un document est découpé en lots de pages qui traversent trois étapes reliées
+par des files asyncio bornées :
+
+1. extraction (couche texte locale, Document AI, images) ;
+2. analyse des images par le schema-analyzer ;
+3. vectorisation et indexation par le vector-engine.
+
+Les étapes se chevauchent : les premières pages sont indexées pendant que
+les suivantes sont encore extraites. Chaque étape a sa propre limite de
+concurrence, et les files bornées ralentissent l'extraction si l'aval ne
+suit pas. Les services en aval ne reçoivent que de petits lots, au lieu du
+document complet resérialisé à chaque étape du workflow n8n.
+
+Pour une nouvelle révision d'un document déjà ingéré, seules les pages
+modifiées traversent le pipeline, après le retrait de leurs anciens vecteurs
+(voir revisions.py).
+"""
+import asyncio
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+
+import extraction
+import pdf_tools
+
+logger = logging.getLogger(__name__)
+
+# Services en aval
+SCHEMA_ANALYZER_URL = os.getenv("SCHEMA_ANALYZER_URL", "http://schema-analyzer:8002")
+VECTOR_ENGINE_URL = os.getenv("VECTOR_ENGINE_URL", "http://vector-engine:8003")
+PIPELINE_HTTP_TIMEOUT = float(os.getenv("PIPELINE_HTTP_TIMEOUT", "120"))
+
+# Découpage et concurrence de chaque étape
+PIPELINE_PAGES_PER_BATCH = int(os.getenv("PIPELINE_PAGES_PER_BATCH", "10"))
+PIPELINE_EXTRACT_CONCURRENCY = int(os.getenv("PIPELINE_EXTRACT_CONCURRENCY", "2"))
+PIPELINE_ANALYZE_CONCURRENCY = int(os.getenv("PIPELINE_ANALYZE_CONCURRENCY", "4"))
+PIPELINE_INDEX_CONCURRENCY = int(os.getenv("PIPELINE_INDEX_CONCURRENCY", "2"))
+PIPELINE_INDEX_BATCH_SIZE = int(os.getenv("PIPELINE_INDEX_BATCH_SIZE", "64"))
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "32"))
+
+# Profil d'analyse Vision demandé au schema-analyzer (vide: profil par défaut du service)
+PIPELINE_VISION_PROFILE = os.getenv("PIPELINE_VISION_PROFILE") or None
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+def get_http_client() -> httpx.AsyncClient:
+    """Retourne le client HTTP partagé vers les services en aval, créé au premier appel."""
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(timeout=PIPELINE_HTTP_TIMEOUT)
+    return _http_client
+
+async def shutdown():
+    """Ferme le client HTTP partagé."""
+    if _http_client is not None:
+        await _http_client.aclose()
+
+# Marqueur de fin de file
+_DONE = object()
+
+class IngestionPipeline:
+    """Ingestion d'un document par lots de pages, en flux à travers les étapes."""
+
+    def __init__(self, document_id: str, file_path: str, output_dir: str, mime_type: str = "application/pdf",
+                 file_hash: Optional[str] = None, file_name: Optional[str] = None,
+                 metadata: Optional[Dict[str, Any]] = None, use_cache: bool = True, local_text: bool = True,
+                 render_vector: bool = False, checkpoints: Optional[Any] = None,
+                 on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 pages: Optional[List[int]] = None, retire_pages: Optional[List[int]] = None,
+                 vision_profile: Optional[str] = None):
+        """
+        Prépare l'ingestion d'un document.
+
+        Args:
+            document_id: Identifiant du document
+            file_path: Chemin vers le PDF
+            output_dir: Répertoire de sortie (les images sont écrites dans images/)
+            mime_type: Type MIME du document
+            file_hash: SHA-256 du fichier (clé du cache et des points de reprise Document AI)
+            file_name: Nom du fichier d'origine
+            metadata: Métadonnées indexées avec le document
+            use_cache: Réutiliser les résultats Document AI déjà calculés
+            local_text: Extraire localement les pages disposant d'une couche texte
+            render_vector: Rendre aussi en images les dessins vectoriels
+            checkpoints: Points de reprise du job
+            on_progress: Appelée avec les statistiques courantes à chaque avancée
+            pages: Numéros des pages à traiter (None pour tout le document)
+            retire_pages: Pages dont les vecteurs sont retirés de l'index avant le traitement
+            vision_profile: Profil d'analyse Vision des images (par défaut PIPELINE_VISION_PROFILE)
+        """
+        self.document_id = document_id
+        self.file_path = file_path
+        self.images_dir = Path(output_dir) / "images"
+        self.mime_type = mime_type
+        self.file_hash = file_hash
+        self.file_name = file_name
+        self.metadata = metadata or {}
+        self.use_cache = use_cache
+        self.local_text = local_text
+        self.render_vector = render_vector
+        self.checkpoints = checkpoints
+        self.on_progress = on_progress
+        self.pages = pages
+        self.retire_pages = retire_pages or []
+        self.vision_profile = vision_profile or PIPELINE_VISION_PROFILE
+
+        self.analyze_queue: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        self.index_queue: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+
+        # Images déjà rencontrées dans le document (par empreinte)
+        self.images: Dict[str, Dict[str, Any]] = {}
+        # Images conservées dans l'index car présentes sur des pages inchangées
+        self.kept_image_ids: set = set()
+        self.failed_images: List[Dict[str, Any]] = []
+
+        self.stats = {
+            "pageCount": 0,
+            "selectedPages": 0,
+            "extractedPages": 0,
+            "indexedPages": 0,
+            "textBlocks": 0,
+            "uniqueImages": 0,
+            "analyzedImages": 0,
+            "technicalDiagrams": 0,
+            "indexedImages": 0,
+            "reusedImages": 0,
+            "retiredTextPoints": 0,
+            "retiredImages": 0,
+            "indexRequests": 0,
+            "ocrPages": 0,
+            "localTextPages": 0,
+            "skippedShards": 0,
+            "stageTime": {"extract": 0.0, "analyze": 0.0, "index": 0.0}
+        }
+
+    def _report(self):
+        """Transmet l'avancement courant."""
+        if self.on_progress:
+            self.on_progress(self.stats)
+
+    async def run(self) -> Dict[str, Any]:
+        """
+        Exécute l'ingestion complète.
+
+        Returns:
+            Le bilan de l'ingestion: compteurs par étape, images en échec et durées
+        """
+        start = time.time()
+        self.images_dir.mkdir(parents=True, exist_ok=True)
+
+        total_pages = await asyncio.to_thread(pdf_tools.page_count, self.file_path)
+        self.stats["pageCount"] = total_pages
+        pages = self.pages if self.pages is not None else list(range(1, total_pages + 1))
+        self.stats["selectedPages"] = len(pages)
+        batches = pdf_tools.plan_shards(pages, PIPELINE_PAGES_PER_BATCH)
+
+        if self.retire_pages:
+            await self._retire(self.retire_pages)
+
+        extract_semaphore = asyncio.Semaphore(PIPELINE_EXTRACT_CONCURRENCY)
+
+        async def extract_stage():
+            await asyncio.gather(*[self._extract_batch(batch, extract_semaphore) for batch in batches])
+            for _ in range(PIPELINE_ANALYZE_CONCURRENCY):
+                await self.analyze_queue.put(_DONE)
+
+        async def analyze_stage():
+            await asyncio.gather(*[self._analyze_worker() for _ in range(PIPELINE_ANALYZE_CONCURRENCY)])
+            for _ in range(PIPELINE_INDEX_CONCURRENCY):
+                await self.index_queue.put(_DONE)
+
+        stages = [
+            asyncio.create_task(extract_stage()),
+            asyncio.create_task(analyze_stage()),
+            *[asyncio.create_task(self._index_worker()) for _ in range(PIPELINE_INDEX_CONCURRENCY)]
+        ]
+        try:
+            await asyncio.gather(*stages)
+        except Exception:
+            for stage in stages:
+                stage.cancel()
+            raise
+
+        # Les métadonnées du document sont indexées une fois tout le contenu en place
+        await self._post_index([], [], {"fileName": self.file_name, "pageCount": total_pages, **self.metadata})
+
+        return {
+            "success": True,
+            "documentId": self.document_id,
+            "fileName": self.file_name,
+            "stats": self.stats,
+            "failedImages": self.failed_images,
+            "processingTime": time.time() - start
+        }
+
+    async def _extract_batch(self, pages: List[int], semaphore: asyncio.Semaphore):
+        """Extrait un lot de pages et alimente les étapes suivantes."""
+        async with semaphore:
+            start = time.time()
+            text_result = await extraction.extract_pages(
+                self.file_path,
+                self.mime_type,
+                file_hash=self.file_hash,
+                use_cache=self.use_cache,
+                local_text=self.local_text,
+                checkpoints=self.checkpoints,
+                pages=pages
+            )
+            image_result = await extraction.extract_images(
+                self.file_path,
+                self.document_id,
+                str(self.images_dir),
+                page_count=len(pages),
+                render_vector=self.render_vector,
+                pages=pages
+            )
+            self.stats["stageTime"]["extract"] += time.time() - start
+
+        self.stats["extractedPages"] += len(pages)
+        self.stats["ocrPages"] += text_result["ocrPages"]
+        self.stats["localTextPages"] += text_result["localTextPages"]
+        self.stats["skippedShards"] += text_result["skippedShards"]
+
+        # Identifiants stables par page: un lot réindexé remplace ses points au lieu de les dupliquer
+        text_blocks = []
+        for page in text_result["pages"]:
+            for index, block in enumerate(page["textBlocks"]):
+                text_blocks.append({**block, "id": f"txt-{self.document_id}-p{page['page']}-{index}"})
+        self.stats["textBlocks"] += len(text_blocks)
+
+        # Une image répétée sur plusieurs pages n'est analysée qu'une fois
+        new_images = []
+        for image in image_result["images"]:
+            known = self.images.get(image["sha256"])
+            if known is None:
+                self.images[image["sha256"]] = image
+                if image["id"] in self.kept_image_ids:
+                    # Déjà analysée et indexée lors d'une révision précédente
+                    self.stats["reusedImages"] += 1
+                else:
+                    new_images.append(image)
+            else:
+                known["pages"] = sorted(set(known["pages"]) | set(image["pages"]))
+        self.stats["uniqueImages"] = len(self.images)
+
+        await self.index_queue.put({"pages": len(pages), "textBlocks": text_blocks})
+        for image in new_images:
+            await self.analyze_queue.put(image)
+        self._report()
+
+    async def _analyze_worker(self):
+        """Analyse les images une par une via le schema-analyzer."""
+        while True:
+            image = await self.analyze_queue.get()
+            if image is _DONE:
+                return
+
+            start = time.time()
+            try:
+                response = await get_http_client().post(
+                    f"{SCHEMA_ANALYZER_URL}/api/analyze-image",
+                    json={
+                        "imagePath": image["path"],
+                        "imageId": image["id"],
+                        "documentId": self.document_id,
+                        "page": image["page"],
+                        "profile": self.vision_profile
+                    }
+                )
+                response.raise_for_status()
+                analysis = response.json()["image"]
+            except Exception as e:
+                # Une image en échec n'interrompt pas l'ingestion
+                logger.error(f"Erreur lors de l'analyse de l'image {image['id']}: {str(e)}")
+                self.failed_images.append({
+                    "id": image["id"], "path": image["path"], "pages": image["pages"], "error": str(e)
+                })
+                continue
+            finally:
+                self.stats["stageTime"]["analyze"] += time.time() - start
+
+            self.stats["analyzedImages"] += 1
+            if analysis.get("classification") == "technical_diagram":
+                self.stats["technicalDiagrams"] += 1
+                await self.index_queue.put({"pages": 0, "images": [{**image, **analysis, "pages": image["pages"]}]})
+            self._report()
+
+    async def _index_worker(self):
+        """Regroupe les blocs de texte et les schémas en lots envoyés au vector-engine."""
+        finished = False
+        while not finished:
+            item = await self.index_queue.get()
+            if item is _DONE:
+                return
+
+            # Compléter le lot avec ce qui est déjà disponible, sans attendre
+            items = [item]
+            size = len(item.get("textBlocks", [])) + len(item.get("images", []))
+            while size < PIPELINE_INDEX_BATCH_SIZE and not self.index_queue.empty():
+                extra = self.index_queue.get_nowait()
+                if extra is _DONE:
+                    finished = True
+                    break
+                items.append(extra)
+                size += len(extra.get("textBlocks", [])) + len(extra.get("images", []))
+
+            text_blocks = [block for entry in items for block in entry.get("textBlocks", [])]
+            images = [image for entry in items for image in entry.get("images", [])]
+
+            for start in range(0, max(len(text_blocks), 1), PIPELINE_INDEX_BATCH_SIZE):
+                chunk = text_blocks[start:start + PIPELINE_INDEX_BATCH_SIZE]
+                # Les schémas partent avec le premier envoi
+                chunk_images = images if start == 0 else []
+                if chunk or chunk_images:
+                    await self._post_index(chunk, chunk_images)
+
+            self.stats["indexedPages"] += sum(entry["pages"] for entry in items)
+            self.stats["indexedImages"] += len(images)
+            self._report()
+
+    async def _retire(self, pages: List[int]):
+        """Retire de l'index les vecteurs des pages modifiées ou supprimées."""
+        start = time.time()
+        try:
+            response = await get_http_client().post(
+                f"{VECTOR_ENGINE_URL}/api/document/{self.document_id}/retire-pages",
+                json={"pages": pages}
+            )
+            response.raise_for_status()
+            result = response.json()
+        finally:
+            self.stats["stageTime"]["index"] += time.time() - start
+
+        self.stats["retiredTextPoints"] = result["retiredTextPoints"]
+        self.stats["retiredImages"] = result["retiredImages"]
+        self.kept_image_ids = set(result["keptImages"])
+
+    async def _post_index(self, text_blocks: List[Dict[str, Any]], images: List[Dict[str, Any]],
+                          metadata: Optional[Dict[str, Any]] = None):
+        """Envoie un lot au vector-engine."""
+        start = time.time()
+        try:
+            response = await get_http_client().post(
+                f"{VECTOR_ENGINE_URL}/api/process",
+                json={
+                    "documentId": self.document_id,
+                    "textBlocks": text_blocks,
+                    "images": images,
+                    "metadata": metadata or {}
+                }
+            )
+            response.raise_for_status()
+            self.stats["indexRequests"] += 1
+        finally:
+            self.stats["stageTime"]["index"] += time.time() - start
@@ -0,0 +1,116 @@
+"""
+Suivi des révisions des documents ingérés.
+
+Pour chaque document, on conserve l'empreinte du fichier et celle de chacune
+de ses pages lors de la dernière ingestion réussie. Quand une nouvelle
+révision du même document est ingérée, seules les pages dont l'empreinte a
+changé repassent par l'OCR, l'analyse des schémas et l'indexation ; les
+vecteurs des pages modifiées ou supprimées sont retirés de l'index.
+
+Les pages sont comparées à numéro égal : une page insérée décale les
+suivantes, qui sont alors traitées comme modifiées. Une page dont une image
+n'a pas pu être analysée est enregistrée sans empreinte, pour être traitée
+de nouveau à la prochaine ingestion.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from job_store import JOB_STORE_DIR
+
+def compare(previous: Optional[List[str]], current: List[str]) -> Dict[str, List[int]]:
+    """
+    Compare les empreintes de deux révisions d'un document.
+
+    Args:
+        previous: Empreintes de la révision déjà ingérée (None si aucune ; None pour une page incomplète)
+        current: Empreintes de la nouvelle révision
+
+    Returns:
+        Les pages modifiées ou ajoutées, les pages supprimées et les pages inchangées
+    """
+    previous = previous or []
+    changed, unchanged = [], []
+    for page, fingerprint in enumerate(current, start=1):
+        if page <= len(previous) and previous[page - 1] == fingerprint:
+            unchanged.append(page)
+        else:
+            changed.append(page)
+    return {
+        "changedPages": changed,
+        "removedPages": list(range(len(current) + 1, len(previous) + 1)),
+        "unchangedPages": unchanged
+    }
+
+def settle(fingerprints: List[str], failed_pages: Iterable[int]) -> List[Optional[str]]:
+    """
+    Empreintes à enregistrer après une ingestion dont certaines pages sont incomplètes.
+
+    Args:
+        fingerprints: Empreintes de la révision ingérée
+        failed_pages: Pages (à partir de 1) dont une image n'a pas pu être analysée
+
+    Returns:
+        Les empreintes, None pour les pages incomplètes (elles seront vues comme modifiées)
+    """
+    failed = set(failed_pages)
+    return [None if page in failed else fingerprint for page, fingerprint in enumerate(fingerprints, start=1)]
+
+class RevisionStore:
+    """Empreintes de la dernière révision ingérée de chaque document, partagées entre les processus."""
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        Initialise le registre.
+
+        Args:
+            path: Chemin explicite du fichier SQLite (par défaut à côté du journal des jobs)
+        """
+        self.path = path or os.path.join(JOB_STORE_DIR, "revisions.sqlite")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        # Une connexion par thread
+        self._local = threading.local()
+
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS revisions ("
+            "document_id TEXT PRIMARY KEY, file_hash TEXT NOT NULL, fingerprints TEXT NOT NULL, "
+            "updated_at REAL NOT NULL)"
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        """Retourne la connexion du thread courant, en la rouvrant après un fork."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, document_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Retourne la dernière révision ingérée d'un document.
+
+        Args:
+            document_id: Identifiant du document
+
+        Returns:
+            L'empreinte du fichier, les empreintes des pages et la date d'ingestion, ou None
+        """
+        row = self._connect().execute(
+            "SELECT file_hash, fingerprints, updated_at FROM revisions WHERE document_id = ?", (document_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"fileHash": row[0], "fingerprints": json.loads(row[1]), "updatedAt": row[2]}
+
+    def put(self, document_id: str, file_hash: str, fingerprints: List[Optional[str]]):
+        """Enregistre la révision d'un document qui vient d'être ingérée."""
+        self._connect().execute(
+            "INSERT OR REPLACE INTO revisions (document_id, file_hash, fingerprints, updated_at) VALUES (?, ?, ?, ?)",
+            (document_id, file_hash, json.dumps(fingerprints), time.time())
+        )
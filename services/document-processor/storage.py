@@ -0,0 +1,311 @@
+"""
+Gestion des fichiers de travail du service de traitement des documents.
+
+Les uploads et les répertoires de sortie des documents sont rangés sous
+TEMP_DIR dans des sous-répertoires dérivés d'une empreinte de l'identifiant
+du document (documents/ab/cd/<documentId>), pour qu'aucun répertoire ne
+grossisse indéfiniment. Un nettoyeur périodique supprime les entrées trop
+anciennes puis, au-delà du quota d'octets, les moins récemment utilisées.
+Les entrées utilisées par un traitement en cours sont épinglées par un
+fichier marqueur rafraîchi régulièrement, visible par tous les workers.
+"""
+import asyncio
+import errno
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+TEMP_DIR = Path(os.getenv("TEMP_DIR", "/tmp/technicia"))
+DOCUMENTS_DIR = TEMP_DIR / "documents"
+UPLOADS_DIR = TEMP_DIR / "uploads"
+MANAGED_ROOTS = {"documents": DOCUMENTS_DIR, "uploads": UPLOADS_DIR}
+
+# Quota, âge maximum et fréquence du nettoyage
+STORAGE_MAX_BYTES = int(os.getenv("STORAGE_MAX_BYTES", str(10 * 1024 ** 3)))
+STORAGE_MAX_AGE = float(os.getenv("STORAGE_MAX_AGE", str(24 * 3600)))
+STORAGE_JANITOR_INTERVAL = float(os.getenv("STORAGE_JANITOR_INTERVAL", "300"))
+
+# Épinglage: un marqueur plus ancien que STORAGE_PIN_TTL n'est plus respecté
+STORAGE_PIN_REFRESH = float(os.getenv("STORAGE_PIN_REFRESH", "30"))
+STORAGE_PIN_TTL = float(os.getenv("STORAGE_PIN_TTL", "120"))
+
+PIN_MARKER = ".pinned"
+
+# Entrées épinglées par ce processus (nombre de traitements qui les utilisent)
+_pins: Dict[Path, int] = {}
+
+# Résultat du dernier parcours, exposé par /storage et /health
+_last_usage: Optional[Dict[str, Any]] = None
+_last_sweep: Optional[Dict[str, Any]] = None
+
+def _shard(key: str) -> Path:
+    """Retourne le sous-répertoire à deux niveaux dérivé d'une clé."""
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+    return Path(digest[:2]) / digest[2:4]
+
+def _safe_name(name: str) -> str:
+    """Neutralise les séparateurs de chemin d'un identifiant."""
+    return name.replace(os.sep, "_").replace("..", "_")
+
+def document_dir(document_id: str) -> Path:
+    """
+    Retourne le répertoire de sortie d'un document.
+
+    Args:
+        document_id: Identifiant du document
+
+    Returns:
+        Le chemin du répertoire (non créé)
+    """
+    return DOCUMENTS_DIR / _shard(document_id) / _safe_name(document_id)
+
+def upload_path(document_id: str, filename: str) -> Path:
+    """
+    Retourne le chemin où enregistrer un fichier uploadé, en créant son répertoire.
+
+    Args:
+        document_id: Identifiant du document
+        filename: Nom du fichier envoyé par le client
+
+    Returns:
+        Le chemin du fichier
+    """
+    directory = UPLOADS_DIR / _shard(document_id) / _safe_name(document_id)
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory / Path(filename).name
+
+def entry_for(path: Path) -> Optional[Path]:
+    """
+    Retourne l'entrée gérée (répertoire d'un document ou d'un upload) contenant un chemin.
+
+    Args:
+        path: Fichier ou répertoire
+
+    Returns:
+        Le répertoire de l'entrée, ou None si le chemin n'est pas sous un répertoire géré
+    """
+    path = Path(os.path.abspath(path))
+    for root in MANAGED_ROOTS.values():
+        try:
+            parts = path.relative_to(os.path.abspath(root)).parts
+        except ValueError:
+            continue
+        if len(parts) >= 3:
+            return Path(os.path.abspath(root)).joinpath(*parts[:3])
+    return None
+
+def remove_entry(path: Path):
+    """Supprime l'entrée gérée contenant un chemin (par exemple un upload déjà traité)."""
+    entry = entry_for(path)
+    if entry is not None and _pins.get(entry, 0) == 0:
+        shutil.rmtree(entry, ignore_errors=True)
+
+def _touch_pin(entry: Path):
+    """Crée ou rafraîchit le marqueur d'épinglage d'une entrée."""
+    try:
+        entry.mkdir(parents=True, exist_ok=True)
+        (entry / PIN_MARKER).touch()
+        os.utime(entry)
+    except OSError as e:
+        logger.warning(f"Épinglage de {entry} impossible: {str(e)}")
+
+@contextmanager
+def pinned(*paths: Path) -> Iterator[None]:
+    """
+    Protège du nettoyage les entrées contenant les chemins donnés, le temps d'un traitement.
+
+    Args:
+        *paths: Fichiers ou répertoires utilisés par le traitement
+    """
+    entries = {entry for entry in map(entry_for, paths) if entry is not None}
+    for entry in entries:
+        _pins[entry] = _pins.get(entry, 0) + 1
+        _touch_pin(entry)
+    try:
+        yield
+    finally:
+        for entry in entries:
+            _pins[entry] -= 1
+            if _pins[entry] == 0:
+                del _pins[entry]
+                try:
+                    (entry / PIN_MARKER).unlink()
+                    # L'utilisation compte pour l'ordre d'éviction
+                    os.utime(entry)
+                except OSError:
+                    pass
+
+def refresh_pins():
+    """Rafraîchit les marqueurs des entrées épinglées par ce processus."""
+    for entry in list(_pins):
+        _touch_pin(entry)
+
+def _is_pinned(entry: Path, now: float) -> bool:
+    """Vérifie si une entrée porte un marqueur d'épinglage encore valide."""
+    try:
+        return now - (entry / PIN_MARKER).stat().st_mtime < STORAGE_PIN_TTL
+    except FileNotFoundError:
+        return False
+
+def _entry_size(entry: Path) -> int:
+    """Calcule la taille cumulée des fichiers d'une entrée."""
+    total = 0
+    for directory, _, files in os.walk(entry):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(directory, name)).st_size
+            except FileNotFoundError:
+                pass
+    return total
+
+def scan() -> List[Dict[str, Any]]:
+    """
+    Parcourt les entrées gérées.
+
+    Returns:
+        Une description par entrée: racine, chemin, taille, dernière utilisation, épinglage
+    """
+    now = time.time()
+    entries = []
+    for kind, root in MANAGED_ROOTS.items():
+        if not root.exists():
+            continue
+        for first in os.scandir(root):
+            if not first.is_dir():
+                continue
+            for second in os.scandir(first.path):
+                if not second.is_dir():
+                    continue
+                for entry in os.scandir(second.path):
+                    if not entry.is_dir():
+                        continue
+                    path = Path(entry.path)
+                    entries.append({
+                        "kind": kind,
+                        "path": path,
+                        "bytes": _entry_size(path),
+                        "lastUsed": entry.stat().st_mtime,
+                        "pinned": _is_pinned(path, now)
+                    })
+    return entries
+
+def _summarize(entries: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Agrège l'occupation par racine."""
+    usage = {
+        "root": str(TEMP_DIR),
+        "bytes": sum(entry["bytes"] for entry in entries),
+        "entries": len(entries),
+        "pinned": sum(1 for entry in entries if entry["pinned"]),
+        "maxBytes": STORAGE_MAX_BYTES,
+        "maxAge": STORAGE_MAX_AGE,
+        "scannedAt": time.time()
+    }
+    for kind in MANAGED_ROOTS:
+        selected = [entry for entry in entries if entry["kind"] == kind]
+        usage[kind] = {
+            "bytes": sum(entry["bytes"] for entry in selected),
+            "entries": len(selected)
+        }
+    return usage
+
+def sweep() -> Optional[Dict[str, Any]]:
+    """
+    Supprime les entrées expirées puis, au-delà du quota, les moins récemment utilisées.
+
+    Un seul processus nettoie à la fois (verrou sur TEMP_DIR/.janitor.lock) ;
+    l'épinglage de chaque entrée est revérifié juste avant sa suppression.
+
+    Returns:
+        Le bilan du nettoyage, ou None si un autre processus nettoie déjà
+    """
+    global _last_usage, _last_sweep
+
+    TEMP_DIR.mkdir(parents=True, exist_ok=True)
+    with open(TEMP_DIR / ".janitor.lock", "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                return None
+            raise
+
+        start = time.time()
+        entries = scan()
+        total = sum(entry["bytes"] for entry in entries)
+        removed = []
+
+        # Les plus anciennes d'abord: l'âge puis le quota s'appliquent dans le même ordre
+        for entry in sorted(entries, key=lambda entry: entry["lastUsed"]):
+            if entry["pinned"] or entry["path"] in _pins:
+                continue
+            expired = start - entry["lastUsed"] > STORAGE_MAX_AGE
+            if not expired and total <= STORAGE_MAX_BYTES:
+                break
+            # Le parcours peut dater: une entrée épinglée ou utilisée depuis par un autre worker est conservée
+            if _is_pinned(entry["path"], time.time()):
+                entry["pinned"] = True
+                continue
+            try:
+                if entry["path"].stat().st_mtime > entry["lastUsed"]:
+                    continue
+            except FileNotFoundError:
+                continue
+            shutil.rmtree(entry["path"], ignore_errors=True)
+            total -= entry["bytes"]
+            removed.append(entry)
+
+        remaining = [entry for entry in entries if entry not in removed]
+        _last_usage = _summarize(remaining)
+        _last_sweep = {
+            "time": start,
+            "duration": time.time() - start,
+            "removedEntries": len(removed),
+            "freedBytes": sum(entry["bytes"] for entry in removed),
+            "overQuota": total > STORAGE_MAX_BYTES
+        }
+
+    if removed:
+        logger.info(f"Nettoyage de {TEMP_DIR}: {len(removed)} entrée(s) supprimée(s), "
+                    f"{_last_sweep['freedBytes']} octets libérés")
+    if _last_sweep["overQuota"]:
+        logger.warning(f"Quota de {TEMP_DIR} dépassé malgré le nettoyage (entrées épinglées)")
+    return _last_sweep
+
+async def run_janitor():
+    """Boucle de fond: rafraîchit les épinglages et nettoie périodiquement TEMP_DIR."""
+    last_sweep = 0.0
+    while True:
+        try:
+            await asyncio.to_thread(refresh_pins)
+            if time.time() - last_sweep >= STORAGE_JANITOR_INTERVAL:
+                last_sweep = time.time()
+                await asyncio.to_thread(sweep)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Erreur lors du nettoyage de {TEMP_DIR}: {str(e)}")
+
+        await asyncio.sleep(min(STORAGE_PIN_REFRESH, STORAGE_JANITOR_INTERVAL))
+
+async def usage(refresh: bool = False) -> Dict[str, Any]:
+    """
+    Retourne l'occupation de TEMP_DIR.
+
+    Args:
+        refresh: Reparcourir les entrées au lieu de renvoyer le dernier parcours
+
+    Returns:
+        L'occupation par racine, les limites configurées et le bilan du dernier nettoyage
+    """
+    global _last_usage
+    if refresh or _last_usage is None:
+        _last_usage = _summarize(await asyncio.to_thread(scan))
+    return {**_last_usage, "lastSweep": _last_sweep, "pinnedByThisWorker": len(_pins)}
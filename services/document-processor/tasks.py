@@ -0,0 +1,293 @@
+"""
+Traitements en arrière-plan du service de traitement des documents.
+
+Les tâches soumises sont placées dans une file bornée et exécutées par un
+nombre fixe de workers asyncio. Chaque mise à jour d'une tâche est recopiée
+dans un cache partagé afin que son état soit lisible depuis tous les workers
+uvicorn ; les tâches terminées expirent après TASK_RETENTION_SECONDS.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from shared_cache import SharedCache
+
+logger = logging.getLogger(__name__)
+
+# Configuration de la file de tâches
+TASK_WORKERS = int(os.getenv("TASK_WORKERS", "2"))
+TASK_QUEUE_SIZE = int(os.getenv("TASK_QUEUE_SIZE", "100"))
+TASK_RETENTION_SECONDS = float(os.getenv("TASK_RETENTION_SECONDS", "3600"))
+TASK_MAX_RECORDS = int(os.getenv("TASK_MAX_RECORDS", "1000"))
+
+# Flux d'événements (server-sent events)
+TASK_EVENTS_KEEPALIVE = float(os.getenv("TASK_EVENTS_KEEPALIVE", "15"))
+TASK_EVENTS_POLL_INTERVAL = float(os.getenv("TASK_EVENTS_POLL_INTERVAL", "1"))
+
+TERMINAL_STATUSES = ("completed", "error")
+
+class TaskQueueFull(Exception):
+    """La file de tâches a atteint TASK_QUEUE_SIZE."""
+
+def describe(record: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Construit la représentation publique d'une tâche.
+
+    Args:
+        record: Enregistrement de la tâche
+
+    Returns:
+        L'état de la tâche, avec son résultat si elle est terminée ou son erreur si elle a échoué
+    """
+    end_time = record.get("finished_at") or time.time()
+    description = {
+        "task_id": record["task_id"],
+        "status": record["status"],
+        "filename": record["filename"],
+        "progress": record["progress"],
+        "stage": record.get("stage"),
+        "processing_time": end_time - record["start_time"]
+    }
+
+    # Compteurs par étape d'une ingestion (pipeline.py)
+    if record.get("pipeline"):
+        description["pipeline"] = record["pipeline"]
+
+    if record["status"] == "completed":
+        description["progress"] = 100
+        description["result"] = record.get("result")
+    elif record["status"] == "error":
+        description["error"] = record.get("error")
+
+    return description
+
+class TaskManager:
+    """File de traitements en arrière-plan avec suivi de progression."""
+
+    def __init__(self, workers: int = TASK_WORKERS, queue_size: int = TASK_QUEUE_SIZE,
+                 retention: float = TASK_RETENTION_SECONDS):
+        """
+        Initialise le gestionnaire de tâches.
+
+        Args:
+            workers: Nombre de tâches exécutées simultanément
+            queue_size: Nombre maximum de tâches en attente
+            retention: Durée de conservation des tâches terminées en secondes
+        """
+        self.workers = workers
+        self.queue_size = queue_size
+        self.retention = retention
+
+        # Tâches suivies par ce processus, recopiées dans le cache partagé
+        self.tasks: Dict[str, Dict[str, Any]] = {}
+        self.store = SharedCache("tasks", maxsize=TASK_MAX_RECORDS, ttl=retention)
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._purger: Optional[asyncio.Task] = None
+        self._changed: Dict[str, asyncio.Event] = {}
+        # Un seul thread d'écriture: les mises à jour arrivent dans l'ordre
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="task-store")
+
+    async def start(self):
+        """Démarre les workers et la purge des tâches expirées."""
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._purger = asyncio.create_task(self._purge_loop())
+        logger.info(f"File de tâches démarrée ({self.workers} worker(s), {self.queue_size} en attente maximum)")
+
+    async def stop(self):
+        """Arrête les workers ; les tâches non terminées sont marquées en erreur."""
+        for task in self._workers + ([self._purger] if self._purger else []):
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+        for task_id, record in list(self.tasks.items()):
+            if record["status"] not in TERMINAL_STATUSES:
+                self.update(task_id, status="error", finished_at=time.time(),
+                            error="Service arrêté avant la fin du traitement (reprise au redémarrage)")
+
+        self._writer.shutdown(wait=True)
+
+    def submit(self, handler: Callable[[str], Awaitable[Any]], filename: Optional[str] = None,
+               task_id: Optional[str] = None) -> str:
+        """
+        Soumet un traitement.
+
+        Args:
+            handler: Coroutine recevant l'identifiant de la tâche et renvoyant son résultat
+            filename: Nom du fichier traité, pour le suivi
+            task_id: Identifiant imposé (par défaut, un nouvel UUID)
+
+        Returns:
+            L'identifiant de la tâche
+
+        Raises:
+            TaskQueueFull: Si la file d'attente est pleine
+        """
+        task_id = task_id or str(uuid.uuid4())
+        now = time.time()
+        record = {
+            "task_id": task_id,
+            "status": "pending",
+            "filename": filename,
+            "progress": 0,
+            "stage": None,
+            "start_time": now,
+            "finished_at": None,
+            "result": None,
+            "error": None,
+            "version": 0
+        }
+
+        try:
+            self._queue.put_nowait((task_id, handler))
+        except asyncio.QueueFull:
+            raise TaskQueueFull(f"File de traitement pleine ({self.queue_size} tâches en attente)")
+
+        self.tasks[task_id] = record
+        self._changed[task_id] = asyncio.Event()
+        self._persist(record)
+        return task_id
+
+    def update(self, task_id: str, **fields):
+        """
+        Met à jour une tâche et prévient les abonnés à ses événements.
+
+        Args:
+            task_id: Identifiant de la tâche
+            **fields: Champs à modifier
+        """
+        record = self.tasks.get(task_id)
+        if record is None:
+            return
+
+        record.update(fields)
+        record["version"] += 1
+        self._persist(record)
+
+        changed = self._changed.get(task_id)
+        if changed is not None:
+            changed.set()
+            self._changed[task_id] = asyncio.Event()
+
+    def _persist(self, record: Dict[str, Any]):
+        """Recopie une tâche dans le cache partagé, hors de la boucle d'événements."""
+        try:
+            self._writer.submit(self.store.set, record["task_id"], dict(record))
+        except RuntimeError:
+            # Arrêt en cours: l'écriture n'est plus possible
+            pass
+
+    async def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Récupère une tâche, y compris si elle est suivie par un autre worker.
+
+        Args:
+            task_id: Identifiant de la tâche
+
+        Returns:
+            L'enregistrement de la tâche ou None
+        """
+        record = self.tasks.get(task_id)
+        if record is not None:
+            return record
+        return await asyncio.to_thread(self.store.get, task_id)
+
+    async def events(self, task_id: str) -> AsyncIterator[str]:
+        """
+        Produit le flux server-sent events d'une tâche jusqu'à ce qu'elle se termine.
+
+        Args:
+            task_id: Identifiant de la tâche
+
+        Yields:
+            Les événements "progress", puis "completed" ou "error", et des commentaires de maintien
+        """
+        last_version = None
+        last_sent = time.time()
+
+        while True:
+            changed = self._changed.get(task_id)
+            record = await self.get(task_id)
+            if record is None:
+                return
+
+            if record["version"] != last_version:
+                last_version = record["version"]
+                last_sent = time.time()
+                event = record["status"] if record["status"] in TERMINAL_STATUSES else "progress"
+                yield f"event: {event}\ndata: {json.dumps(describe(record))}\n\n"
+                if record["status"] in TERMINAL_STATUSES:
+                    return
+
+            if changed is not None:
+                # Tâche suivie par ce processus: réveil à chaque mise à jour
+                try:
+                    await asyncio.wait_for(changed.wait(), TASK_EVENTS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                # Tâche suivie par un autre worker: lecture périodique du cache partagé
+                await asyncio.sleep(TASK_EVENTS_POLL_INTERVAL)
+
+            if time.time() - last_sent >= TASK_EVENTS_KEEPALIVE:
+                last_sent = time.time()
+                yield ": keepalive\n\n"
+
+    async def _worker(self):
+        """Exécute les tâches de la file les unes après les autres."""
+        while True:
+            task_id, handler = await self._queue.get()
+            try:
+                self.update(task_id, status="processing", start_time=time.time())
+                result = await handler(task_id)
+                self.update(task_id, status="completed", progress=100, result=result, finished_at=time.time())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = getattr(e, "detail", None) or str(e)
+                logger.error(f"Erreur lors de la tâche {task_id}: {error}")
+                self.update(task_id, status="error", error=error, finished_at=time.time())
+            finally:
+                self._queue.task_done()
+
+    async def _purge_loop(self):
+        """Supprime périodiquement les tâches terminées dont la rétention est écoulée."""
+        while True:
+            await asyncio.sleep(min(60.0, self.retention))
+            self.purge()
+
+    def purge(self):
+        """Retire de la mémoire les tâches terminées expirées, puis les plus anciennes au-delà de TASK_MAX_RECORDS."""
+        now = time.time()
+        finished = sorted(
+            (record["finished_at"], task_id)
+            for task_id, record in self.tasks.items()
+            if record["status"] in TERMINAL_STATUSES
+        )
+        excess = len(self.tasks) - TASK_MAX_RECORDS
+
+        for finished_at, task_id in finished:
+            if finished_at < now - self.retention or excess > 0:
+                self.tasks.pop(task_id, None)
+                self._changed.pop(task_id, None)
+                excess -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Retourne l'état de la file pour /health."""
+        statuses = [record["status"] for record in self.tasks.values()]
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "queueSize": self.queue_size,
+            "pending": statuses.count("pending"),
+            "processing": statuses.count("processing"),
+            "finished": sum(1 for status in statuses if status in TERMINAL_STATUSES),
+            "retentionSeconds": self.retention
+        }
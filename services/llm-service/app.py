@@ -11,6 +11,8 @@ from pydantic import BaseModel, Field
 import httpx
 import uvicorn
 
+from shared_cache import SharedCache
+
 # Configuration du logging
 logging.basicConfig(
     level=logging.INFO,
@@ -68,8 +70,8 @@ USE_OPENAI = not USE_CLAUDE and OPENAI_API_KEY is not None
 if not (USE_CLAUDE or USE_OPENAI):
     logger.warning("Aucune clé API LLM n'a été trouvée. Le service fonctionnera en mode simulation.")
 
-# Cache simple en mémoire pour les réponses (peut être remplacé par Redis dans une version production)
-response_cache = {}
+# Cache des réponses partagé entre les workers, expiration après 1 heure
+response_cache = SharedCache("chat_responses", maxsize=1000, ttl=3600)
 
 async def chat_with_claude(request: ChatRequest) -> Dict:
     """Fonction pour interagir avec l'API Claude d'Anthropic"""
@@ -183,9 +185,10 @@ async def chat(request: ChatRequest, background_tasks: BackgroundTasks):
     """Endpoint pour les conversations au format chat"""
     # Cache check
     cache_key = generate_cache_key(request.dict())
-    if cache_key in response_cache:
+    cached_response = response_cache.get(cache_key)
+    if cached_response is not None:
         logger.info("Réponse trouvée dans le cache")
-        return response_cache[cache_key]
+        return cached_response
     
     try:
         if USE_CLAUDE:
@@ -201,8 +204,7 @@ async def chat(request: ChatRequest, background_tasks: BackgroundTasks):
             time.sleep(1)  # Simuler un délai
         
         # Mettre en cache avec une durée de vie limitée
-        response_cache[cache_key] = response
-        background_tasks.add_task(lambda: response_cache.pop(cache_key, None) if time.time() > time.time() + 3600 else None)
+        response_cache.set(cache_key, response)
         
         return response
         
@@ -241,4 +243,6 @@ async def health_check():
 
 if __name__ == "__main__":
     port = int(os.getenv("LLM_SERVICE_PORT", 8005))
-    uvicorn.run("app:app", host="0.0.0.0", port=port, reload=True)
+    # WEB_CONCURRENCY > 1 active le mode production multi-workers (sans rechargement)
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    uvicorn.run("app:app", host="0.0.0.0", port=port, reload=workers == 1, workers=workers)
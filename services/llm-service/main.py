@@ -7,7 +7,7 @@ from fastapi import FastAPI, HTTPException, Depends, status
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 from dotenv import load_dotenv
-from cachetools import TTLCache
+from shared_cache import SharedCache
 import anthropic
 import openai
 
@@ -22,9 +22,9 @@ logger = logging.getLogger("llm-service")
 # Chargement des variables d'environnement
 load_dotenv()
 
-# Initialisation du cache pour les réponses
+# Initialisation du cache pour les réponses, partagé entre les workers
 # 1000 items, expiration après 1 heure
-response_cache = TTLCache(maxsize=1000, ttl=3600)
+response_cache = SharedCache("responses", maxsize=1000, ttl=3600)
 
 # Initialisation de l'application FastAPI
 app = FastAPI(
@@ -121,8 +121,8 @@ def generate_response(request: GenerateRequest):
         })
         
         # Vérification du cache
-        if cache_key in response_cache:
-            cached_response = response_cache[cache_key]
+        cached_response = response_cache.get(cache_key)
+        if cached_response is not None:
             cached_response["cached"] = True
             cached_response["processing_time"] = time.time() - start_time
             return cached_response
@@ -158,7 +158,7 @@ def generate_response(request: GenerateRequest):
     
     # Mise en cache si activé
     if request.cache:
-        response_cache[cache_key] = result
+        response_cache.set(cache_key, result)
     
     return result
 
@@ -260,4 +260,6 @@ def get_prompt_templates():
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("LLM_SERVICE_PORT", "8004"))
-    uvicorn.run("main:app", host="0.0.0.0", port=port, reload=True)
+    # WEB_CONCURRENCY > 1 active le mode production multi-workers (sans rechargement)
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    uvicorn.run("main:app", host="0.0.0.0", port=port, reload=workers == 1, workers=workers)
@@ -0,0 +1,442 @@
+"""
+Cache des résultats d'analyse d'images pour TechnicIA.
+
+Les mêmes schémas de câblage et vues éclatées reviennent d'une révision de
+manuel à l'autre et entre les manuels de machines sœurs, souvent réencodés ou
+légèrement redimensionnés. Chaque résultat d'analyse est donc conservé avec :
+- le SHA-256 du fichier, consulté en premier (image identique à l'octet près) ;
+- deux empreintes perceptuelles de 64 bits (pHash et dHash, calculées avec
+  NumPy), comparées à une distance de Hamming près.
+
+Les empreintes perceptuelles sont indexées en mémoire par hachage multi-index :
+découpée en IMAGE_CACHE_MAX_DISTANCE + 1 segments, une empreinte à distance
+inférieure ou égale à la tolérance partage au moins un segment exact avec
+l'empreinte cherchée, ce qui limite la comparaison à quelques candidats même
+avec des centaines de milliers d'entrées. Les résultats sont stockés dans un
+fichier SQLite en mode WAL, partagé par les workers du service.
+
+Ce module est copié à l'identique dans chaque service qui analyse des images,
+chaque service étant construit dans son propre contexte Docker.
+"""
+import hashlib
+import io
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Activation et emplacement du cache (volume partagé si disponible)
+IMAGE_CACHE_ENABLED = os.getenv("IMAGE_CACHE_ENABLED", "true").lower() == "true"
+IMAGE_CACHE_DIR = os.getenv(
+    "IMAGE_CACHE_DIR", os.path.join(os.getenv("TEMP_DIR", "/tmp/technicia-docs"), "image-cache")
+)
+
+# Distance de Hamming maximale (sur 64 bits) entre deux images considérées identiques
+IMAGE_CACHE_MAX_DISTANCE = int(os.getenv("IMAGE_CACHE_MAX_DISTANCE", "4"))
+
+# Écart relatif maximal des proportions largeur/hauteur entre deux images identiques
+IMAGE_CACHE_MAX_ASPECT_DELTA = float(os.getenv("IMAGE_CACHE_MAX_ASPECT_DELTA", "0.05"))
+
+# Écart-type minimal des niveaux de gris: en dessous (image presque uniforme),
+# l'empreinte perceptuelle n'est pas discriminante et seul le SHA-256 est utilisé
+IMAGE_CACHE_MIN_CONTRAST = float(os.getenv("IMAGE_CACHE_MIN_CONTRAST", "2.0"))
+
+# Nombre maximum d'entrées (les moins récemment utilisées sont retirées au-delà)
+IMAGE_CACHE_MAX_ENTRIES = int(os.getenv("IMAGE_CACHE_MAX_ENTRIES", "200000"))
+
+# Intervalle minimal entre deux relectures des entrées ajoutées par les autres workers (secondes)
+IMAGE_CACHE_SYNC_INTERVAL = float(os.getenv("IMAGE_CACHE_SYNC_INTERVAL", "2.0"))
+
+HASH_BITS = 64
+_HASH_MASK = (1 << HASH_BITS) - 1
+
+def _dct_matrix(size: int) -> np.ndarray:
+    """Matrice de la DCT-II orthonormée de taille size."""
+    k = np.arange(size)[:, None]
+    i = np.arange(size)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * size)) * np.sqrt(2.0 / size)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+_DCT_32 = _dct_matrix(32)
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    """Convertit un tableau de 64 booléens en entier."""
+    return int.from_bytes(np.packbits(bits.flatten()).tobytes(), "big")
+
+def hamming(a: int, b: int) -> int:
+    """Distance de Hamming entre deux empreintes."""
+    return bin(a ^ b).count("1")
+
+def _to_signed(value: int) -> int:
+    """Représentation signée d'une empreinte, stockable dans un INTEGER SQLite."""
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+def _grayscale(image: Image.Image) -> Image.Image:
+    """Convertit une image en niveaux de gris, la transparence étant rendue sur fond blanc."""
+    if image.mode in ("RGBA", "LA", "P", "PA"):
+        image = image.convert("RGBA")
+        background = Image.new("RGBA", image.size, (255, 255, 255, 255))
+        image = Image.alpha_composite(background, image)
+    return image.convert("L")
+
+def perceptual_hashes(content: bytes) -> Optional[Dict[str, Any]]:
+    """
+    Calcule les empreintes perceptuelles d'une image.
+
+    Args:
+        content: Contenu binaire de l'image
+
+    Returns:
+        Le pHash, le dHash et les proportions de l'image, ou None si l'image est
+        illisible ou trop uniforme pour être comparée
+    """
+    try:
+        with Image.open(io.BytesIO(content)) as image:
+            width, height = image.size
+            # Décodage JPEG directement à basse résolution
+            image.draft("L", (64, 64))
+            gray = _grayscale(image)
+    except Exception:
+        return None
+
+    if not width or not height:
+        return None
+
+    # pHash: signe des basses fréquences de la DCT par rapport à leur médiane
+    pixels = np.asarray(gray.resize((32, 32), Image.Resampling.LANCZOS), dtype=np.float64)
+    if pixels.std() < IMAGE_CACHE_MIN_CONTRAST:
+        return None
+    low = (_DCT_32 @ pixels @ _DCT_32.T)[:8, :8]
+    phash = _bits_to_int(low > np.median(low.flatten()[1:]))
+
+    # dHash: sens du gradient horizontal
+    pixels = np.asarray(gray.resize((9, 8), Image.Resampling.LANCZOS), dtype=np.int16)
+    dhash = _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+    return {"phash": phash, "dhash": dhash, "aspect": width / height}
+
+class ImageKey:
+    """Empreintes d'une image, les perceptuelles n'étant calculées qu'en cas de besoin."""
+
+    __slots__ = ("content", "sha256", "_perceptual")
+
+    def __init__(self, content: bytes):
+        self.content = content
+        self.sha256 = hashlib.sha256(content).hexdigest()
+        self._perceptual: Any = False
+
+    @property
+    def perceptual(self) -> Optional[Dict[str, Any]]:
+        """pHash, dHash et proportions de l'image (None si elle n'est pas comparable)."""
+        if self._perceptual is False:
+            self._perceptual = perceptual_hashes(self.content)
+        return self._perceptual
+
+class HammingIndex:
+    """Index multi-index des empreintes de 64 bits, pour une recherche à distance de Hamming bornée."""
+
+    def __init__(self, max_distance: int):
+        """
+        Initialise l'index.
+
+        Args:
+            max_distance: Distance de Hamming maximale des recherches
+        """
+        self.max_distance = max_distance
+        # Segments de tailles aussi égales que possible couvrant les 64 bits
+        count = min(max_distance + 1, HASH_BITS)
+        widths = [HASH_BITS // count + (1 if i < HASH_BITS % count else 0) for i in range(count)]
+        self._segments: List[Tuple[int, int]] = []
+        shift = 0
+        for width in widths:
+            self._segments.append((shift, (1 << width) - 1))
+            shift += width
+
+        self._tables: List[Dict[int, Set[int]]] = [{} for _ in self._segments]
+        self._entries: Dict[int, Tuple[int, int, float]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, entry_id: int, phash: int, dhash: int, aspect: float):
+        """Ajoute une entrée à l'index."""
+        self._entries[entry_id] = (phash, dhash, aspect)
+        for table, (shift, mask) in zip(self._tables, self._segments):
+            table.setdefault((phash >> shift) & mask, set()).add(entry_id)
+
+    def remove(self, entry_id: int):
+        """Retire une entrée de l'index."""
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        for table, (shift, mask) in zip(self._tables, self._segments):
+            key = (entry[0] >> shift) & mask
+            bucket = table.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del table[key]
+
+    def search(self, phash: int, dhash: int, aspect: float) -> Optional[Tuple[int, int]]:
+        """
+        Cherche l'entrée la plus proche d'une image.
+
+        Args:
+            phash: pHash de l'image
+            dhash: dHash de l'image
+            aspect: Proportions largeur/hauteur de l'image
+
+        Returns:
+            L'identifiant de l'entrée et sa distance (la plus grande des deux
+            empreintes), ou None si aucune entrée n'est dans la tolérance
+        """
+        best: Optional[Tuple[int, int]] = None
+        seen: Set[int] = set()
+        for table, (shift, mask) in zip(self._tables, self._segments):
+            for entry_id in table.get((phash >> shift) & mask, ()):
+                if entry_id in seen:
+                    continue
+                seen.add(entry_id)
+
+                entry_phash, entry_dhash, entry_aspect = self._entries[entry_id]
+                distance = max(hamming(phash, entry_phash), hamming(dhash, entry_dhash))
+                if distance > self.max_distance:
+                    continue
+                if abs(entry_aspect - aspect) > IMAGE_CACHE_MAX_ASPECT_DELTA * max(entry_aspect, aspect):
+                    continue
+                if best is None or distance < best[1]:
+                    best = (entry_id, distance)
+        return best
+
+class ImageAnalysisCache:
+    """Résultats d'analyse d'images retrouvés par SHA-256 puis par empreinte perceptuelle."""
+
+    def __init__(self, name: str, version: str = "1", max_distance: int = IMAGE_CACHE_MAX_DISTANCE,
+                 max_entries: int = IMAGE_CACHE_MAX_ENTRIES, path: Optional[str] = None):
+        """
+        Initialise le cache.
+
+        Args:
+            name: Nom du cache, utilisé pour le nom du fichier SQLite
+            version: Version du format des résultats (la changer repart d'un cache vide)
+            max_distance: Distance de Hamming maximale pour une correspondance perceptuelle
+            max_entries: Nombre maximum d'entrées
+            path: Chemin explicite du fichier SQLite
+        """
+        self.name = name
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.path = path or os.path.join(IMAGE_CACHE_DIR, f"{name}-v{version}.sqlite")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        # Une connexion par thread et par processus
+        self._local = threading.local()
+
+        # Index perceptuel par profil d'analyse, alimenté depuis SQLite
+        self._lock = threading.Lock()
+        self._indexes: Dict[str, HammingIndex] = {}
+        self._last_id = 0
+        self._last_sync = 0.0
+
+        # Statistiques propres au processus courant
+        self._stats = {"exactHits": 0, "perceptualHits": 0, "misses": 0, "stores": 0,
+                       "evictions": 0, "lookupTime": 0.0}
+
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, profile TEXT NOT NULL, sha256 TEXT NOT NULL, "
+            "phash INTEGER, dhash INTEGER, aspect REAL, result BLOB NOT NULL, "
+            "created_at REAL NOT NULL, used_at REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0, "
+            "UNIQUE (profile, sha256))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS entries_used_at ON entries (used_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        """Retourne la connexion du thread courant, en la rouvrant après un fork."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _sync(self, force: bool = False):
+        """Ajoute à l'index les entrées enregistrées depuis la dernière lecture, y compris par les autres workers."""
+        now = time.time()
+        if not force and now - self._last_sync < IMAGE_CACHE_SYNC_INTERVAL:
+            return
+        self._last_sync = now
+
+        rows = self._connect().execute(
+            "SELECT id, profile, phash, dhash, aspect FROM entries WHERE id > ? AND phash IS NOT NULL ORDER BY id",
+            (self._last_id,)
+        ).fetchall()
+        for entry_id, profile, phash, dhash, aspect in rows:
+            index = self._indexes.get(profile)
+            if index is None:
+                index = self._indexes[profile] = HammingIndex(self.max_distance)
+            index.add(entry_id, phash & _HASH_MASK, dhash & _HASH_MASK, aspect)
+            self._last_id = entry_id
+
+    def lookup(self, content: bytes, profile: str) -> Tuple[ImageKey, Optional[Dict[str, Any]]]:
+        """
+        Cherche le résultat d'analyse d'une image.
+
+        Args:
+            content: Contenu binaire de l'image
+            profile: Profil d'analyse (les résultats de profils différents ne se mélangent pas)
+
+        Returns:
+            Les empreintes de l'image (à transmettre à store) et, si l'image est connue,
+            {"result", "match" ("exact" ou "perceptual"), "distance"}
+        """
+        start = time.perf_counter()
+        key = ImageKey(content)
+        try:
+            if not IMAGE_CACHE_ENABLED:
+                return key, None
+
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT id, result FROM entries WHERE profile = ? AND sha256 = ?", (profile, key.sha256)
+            ).fetchone()
+            if row is not None:
+                self._touch(row[0])
+                self._stats["exactHits"] += 1
+                return key, {"result": json.loads(zlib.decompress(row[1])), "match": "exact", "distance": 0}
+
+            perceptual = key.perceptual
+            while perceptual is not None:
+                with self._lock:
+                    self._sync()
+                    index = self._indexes.get(profile)
+                    found = index.search(perceptual["phash"], perceptual["dhash"], perceptual["aspect"]) if index else None
+                if found is None:
+                    break
+
+                row = conn.execute("SELECT result FROM entries WHERE id = ?", (found[0],)).fetchone()
+                if row is None:
+                    # Entrée retirée ou remplacée par un autre worker: on cherche la suivante
+                    with self._lock:
+                        index.remove(found[0])
+                    continue
+
+                self._touch(found[0])
+                self._stats["perceptualHits"] += 1
+                return key, {"result": json.loads(zlib.decompress(row[0])), "match": "perceptual",
+                             "distance": found[1]}
+
+            self._stats["misses"] += 1
+            return key, None
+        except Exception as e:
+            # Le cache ne doit jamais empêcher l'analyse
+            logger.warning(f"Lecture du cache d'images {self.name} impossible: {str(e)}")
+            return key, None
+        finally:
+            self._stats["lookupTime"] += time.perf_counter() - start
+
+    def _touch(self, entry_id: int):
+        """Marque une entrée comme utilisée, pour l'éviction."""
+        self._connect().execute(
+            "UPDATE entries SET used_at = ?, hits = hits + 1 WHERE id = ?", (time.time(), entry_id)
+        )
+
+    def store(self, key: ImageKey, profile: str, result: Dict[str, Any]):
+        """
+        Enregistre le résultat d'analyse d'une image.
+
+        Args:
+            key: Empreintes de l'image, renvoyées par lookup
+            profile: Profil d'analyse
+            result: Résultat de l'analyse (sérialisable en JSON)
+        """
+        if not IMAGE_CACHE_ENABLED:
+            return
+
+        try:
+            perceptual = key.perceptual or {}
+            now = time.time()
+            conn = self._connect()
+            cursor = conn.execute(
+                "INSERT OR REPLACE INTO entries (profile, sha256, phash, dhash, aspect, result, created_at, used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    profile,
+                    key.sha256,
+                    _to_signed(perceptual["phash"]) if perceptual else None,
+                    _to_signed(perceptual["dhash"]) if perceptual else None,
+                    perceptual.get("aspect"),
+                    zlib.compress(json.dumps(result).encode("utf-8")),
+                    now,
+                    now
+                )
+            )
+            self._stats["stores"] += 1
+
+            if perceptual:
+                with self._lock:
+                    index = self._indexes.get(profile)
+                    if index is None:
+                        index = self._indexes[profile] = HammingIndex(self.max_distance)
+                    index.add(cursor.lastrowid, perceptual["phash"], perceptual["dhash"], perceptual["aspect"])
+
+            # Éviction par paquets, pour ne pas compter les entrées à chaque écriture
+            if cursor.lastrowid % 100 == 0:
+                self._evict()
+        except Exception as e:
+            logger.warning(f"Écriture dans le cache d'images {self.name} impossible: {str(e)}")
+
+    def _evict(self):
+        """Retire les entrées les moins récemment utilisées au-delà de max_entries."""
+        conn = self._connect()
+        excess = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0] - self.max_entries
+        if excess <= 0:
+            return
+
+        # Marge de 10% pour espacer les évictions
+        excess += self.max_entries // 10
+        rows = conn.execute("SELECT id, profile FROM entries ORDER BY used_at LIMIT ?", (excess,)).fetchall()
+        conn.executemany("DELETE FROM entries WHERE id = ?", [(row[0],) for row in rows])
+        with self._lock:
+            for entry_id, profile in rows:
+                index = self._indexes.get(profile)
+                if index is not None:
+                    index.remove(entry_id)
+        self._stats["evictions"] += len(rows)
+
+    def warm(self):
+        """Charge l'index perceptuel depuis le fichier SQLite (sinon fait à la première recherche)."""
+        if not IMAGE_CACHE_ENABLED:
+            return
+        try:
+            with self._lock:
+                self._sync(force=True)
+            logger.info(f"Cache d'images {self.name}: {sum(len(index) for index in self._indexes.values())} "
+                        f"empreinte(s) chargée(s)")
+        except Exception as e:
+            logger.warning(f"Chargement du cache d'images {self.name} impossible: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Retourne les compteurs du cache pour /health."""
+        lookups = self._stats["exactHits"] + self._stats["perceptualHits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "enabled": IMAGE_CACHE_ENABLED,
+            "indexedEntries": sum(len(index) for index in self._indexes.values()),
+            "meanLookupTime": self._stats["lookupTime"] / lookups if lookups else None,
+            "maxDistance": self.max_distance,
+            "maxEntries": self.max_entries
+        }
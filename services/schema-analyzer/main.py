@@ -2,19 +2,32 @@
 Service d'analyse de schémas techniques pour TechnicIA.
 Utilise Google Vision AI pour classifier et extraire du texte des schémas techniques.
 """
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from google.cloud import vision
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from enum import Enum
 import asyncio
+import base64
 import os
 import logging
+import random
 import time
 import json
 from pathlib import Path
-from typing import Dict, List, Any, Optional
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Any, Optional, Tuple
 from pydantic import BaseModel, Field
 
+from call_policy import CallDeadlineExceeded, RequestBudgetMiddleware, per_worker
+from image_cache import ImageAnalysisCache
+from keyword_scoring import KeywordScorer
+from preclassifier import PRECLASSIFY_ENABLED, PRECLASSIFY_THRESHOLD, preclassify
+from preprocessing import ImagePreprocessor
+from tiling import TEXT_FEATURE_TYPES, TiledOCR
+from vision_batch import VISION_PROFILES, VisionUnavailableError, profile_features
+from vision_gateway import VisionGateway, vision_priority
+
 # Configuration du logging
 logging.basicConfig(
     level=logging.INFO,
@@ -22,11 +35,51 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Lance l'initialisation du client Vision en arrière-plan."""
+    # Les appels Vision passent par asyncio.to_thread: le pool par défaut doit suivre la concurrence
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=ANALYZE_CONCURRENCY + 4, thread_name_prefix="vision")
+    )
+    init_task = asyncio.create_task(initialize_service())
+    yield
+    init_task.cancel()
+    if analyzer is not None:
+        analyzer.preprocessor.shutdown()
+
 # Configuration de l'application
 app = FastAPI(
     title="Schema Analyzer Service",
     description="Service d'analyse de schémas techniques pour TechnicIA",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
+)
+
+# Échéance de chaque requête (en-tête X-Request-Budget), appliquée aux appels Vision
+app.add_middleware(RequestBudgetMiddleware)
+
+# Configuration de l'initialisation (tentatives, backoff et préchauffage) ; au-delà de
+# INIT_MAX_ATTEMPTS tentatives (0: sans limite), le processus s'arrête pour être redémarré
+INIT_MAX_ATTEMPTS = int(os.getenv("INIT_MAX_ATTEMPTS", "0"))
+INIT_BACKOFF_BASE = float(os.getenv("INIT_BACKOFF_BASE", "1.0"))
+INIT_BACKOFF_MAX = float(os.getenv("INIT_BACKOFF_MAX", "30.0"))
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "false").lower() == "true"
+
+# Profil d'analyse Vision par défaut ("fast", "ocr", "full" ou "two-stage"), modifiable par requête
+VISION_PROFILE = os.getenv("VISION_PROFILE", "full")
+
+# Champs d'un résultat propres à l'appel qui l'a produit, retirés des réponses servies par le cache
+CALL_FIELDS = ("preclassification", "preprocessing", "visionTime", "tiling")
+
+# Analyses simultanées (pour tout le service, réparties entre ses workers) et délai par image ;
+# assez d'analyses doivent être en cours pour remplir les lots Vision
+ANALYZE_CONCURRENCY = per_worker(int(os.getenv("ANALYZE_CONCURRENCY", "32")))
+ANALYZE_IMAGE_TIMEOUT = float(os.getenv("ANALYZE_IMAGE_TIMEOUT", "60"))
+
+# Image PNG 1x1 blanche utilisée pour le préchauffage du canal Vision
+WARMUP_IMAGE = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAAAAAA6fptVAAAACklEQVR4nGP4DwABAQEAsTj2FAAAAABJRU5ErkJggg=="
 )
 
 class SchemaType(str, Enum):
@@ -42,6 +95,8 @@ class AnalyzeRequest(BaseModel):
     documentId: str = Field(..., description="Identifiant du document")
     images: List[Dict[str, Any]] = Field(..., description="Liste des images à analyser")
     basePath: str = Field(..., description="Répertoire de base du document")
+    profile: Optional[str] = Field(None, description="Profil d'analyse Vision: fast, ocr, full ou two-stage")
+    stream: bool = Field(False, description="Renvoyer les résultats en NDJSON, image par image, au fil de l'analyse")
 
 # Modèle pour l'analyse d'une image par chemin
 class ImagePathAnalysisRequest(BaseModel):
@@ -49,6 +104,7 @@ class ImagePathAnalysisRequest(BaseModel):
     imageId: Optional[str] = Field(None, description="Identifiant unique de l'image")
     documentId: Optional[str] = Field(None, description="Identifiant du document parent")
     page: Optional[int] = Field(None, description="Numéro de page où se trouve l'image")
+    profile: Optional[str] = Field(None, description="Profil d'analyse Vision: fast, ocr, full ou two-stage")
 
 class SchemaAnalyzer:
     """Classe pour l'analyse des schémas techniques avec Vision AI."""
@@ -56,21 +112,45 @@ class SchemaAnalyzer:
     def __init__(self):
         """Initialise l'analyseur de schémas."""
         self.client = vision.ImageAnnotatorClient()
+        # Appels Vision par lots, avec priorités, quota partagé et disjoncteur
+        self.vision = VisionGateway(self.client)
+        # Images réduites et réencodées avant l'envoi, dans un pool de processus
+        self.preprocessor = ImagePreprocessor()
+        # Schémas grand format lus en tuiles parallèles à pleine résolution
+        self.tiler = TiledOCR(self.vision, self.preprocessor)
+        # Résultats déjà obtenus pour une image identique ou visuellement identique
+        self.cache = ImageAnalysisCache("schema-analysis", version="2")
+        self.cache.warm()
+        # Chemin ayant tranché chaque image analysée par ce processus
+        self.decisions = {"cache": 0, "preclassifier": 0, "vision": 0}
+        # Vocabulaires (anglais et français) compilés en une seule expression régulière
+        self.scorer = KeywordScorer.from_file()
+    
+    async def warm_up(self) -> Dict[str, Any]:
+        """
+        Ouvre le canal gRPC vers Vision AI avec une annotation synthétique.
         
-        # Définition des features pour chaque type de schéma
-        self.schema_features = {
-            SchemaType.ELECTRICAL: ["circuit", "electrical", "wiring", "schematic", "diagram", "electronic"],
-            SchemaType.HYDRAULIC: ["hydraulic", "fluid", "pump", "valve", "cylinder", "pressure", "water"],
-            SchemaType.PNEUMATIC: ["pneumatic", "air", "compressor", "valve", "cylinder", "pressure", "gas"],
-            SchemaType.MECHANICAL: ["mechanical", "gear", "assembly", "machine", "part", "engine", "motor"]
-        }
+        Returns:
+            Durée et statut du préchauffage
+        """
+        start = time.time()
+        try:
+            request = vision.AnnotateImageRequest(
+                image=vision.Image(content=WARMUP_IMAGE),
+                features=[vision.Feature(type_=vision.Feature.Type.LABEL_DETECTION, max_results=1)]
+            )
+            await asyncio.to_thread(self.client.annotate_image, request=request)
+            return {"success": True, "duration": time.time() - start}
+        except Exception as e:
+            return {"success": False, "duration": time.time() - start, "error": str(e)}
     
-    async def analyze_image_from_path(self, image_path: str) -> Dict[str, Any]:
+    async def analyze_image_from_path(self, image_path: str, profile: Optional[str] = None) -> Dict[str, Any]:
         """
         Analyse une image à partir de son chemin.
         
         Args:
             image_path: Chemin vers l'image à analyser
+            profile: Profil d'analyse (par défaut VISION_PROFILE)
             
         Returns:
             Résultats de l'analyse
@@ -87,194 +167,341 @@ class SchemaAnalyzer:
             with open(image_path, "rb") as image_file:
                 content = image_file.read()
             
-            return await self._analyze_image_content(content)
+            return await self._analyze_image_content(content, profile)
             
         except Exception as e:
             logger.error(f"Erreur lors de l'analyse de l'image {image_path}: {str(e)}")
             raise
     
-    async def _analyze_image_content(self, image_content: bytes) -> Dict[str, Any]:
+    async def _annotate(self, image_content: bytes, profile: str) -> List[vision.AnnotateImageResponse]:
+        """
+        Envoie une image à Vision selon un profil d'analyse.
+        
+        Args:
+            image_content: Contenu binaire de l'image
+            profile: Profil d'analyse ("fast", "ocr", "full" ou "two-stage")
+            
+        Returns:
+            Les réponses Vision (deux en mode "two-stage" pour une image technique)
+        """
+        if profile != "two-stage":
+            return [await self.vision.annotate(image_content, profile_features(profile))]
+        
+        # Première passe sur les étiquettes seules: le texte n'est demandé que pour les images techniques
+        labels_response = await self.vision.annotate(image_content, profile_features("fast"))
+        labels = [label.description.lower() for label in labels_response.label_annotations]
+        if not self.scorer.score(labels, "")["isTechnical"]:
+            return [labels_response]
+        
+        return [labels_response, await self.vision.annotate(image_content, profile_features("ocr"))]
+    
+    async def _annotate_tiled(self, image_content: bytes, upload: bytes, profile: str,
+                              plan: Dict[str, Any]) -> Tuple[List[vision.AnnotateImageResponse], Optional[Dict[str, Any]]]:
+        """
+        Envoie une image grand format à Vision, son texte étant lu en tuiles.
+        
+        Les autres analyses du profil portent sur l'image réduite et sont demandées
+        en même temps que les tuiles.
+        
+        Args:
+            image_content: Contenu binaire de l'image, à pleine résolution
+            upload: Image réduite et réencodée
+            profile: Profil d'analyse ("ocr", "full" ou "two-stage")
+            plan: Découpage renvoyé par TiledOCR.plan()
+            
+        Returns:
+            Les réponses Vision de l'image réduite et le texte lu en tuiles (None pour une image non technique en "two-stage")
+        """
+        if profile == "ocr":
+            return [], await self.tiler.ocr(image_content, plan)
+        
+        if profile == "two-stage":
+            labels_response = await self.vision.annotate(upload, profile_features("fast"))
+            labels = [label.description.lower() for label in labels_response.label_annotations]
+            if not self.scorer.score(labels, "")["isTechnical"]:
+                return [labels_response], None
+            return [labels_response], await self.tiler.ocr(image_content, plan)
+        
+        features = [feature for feature in profile_features(profile) if feature.type_ not in TEXT_FEATURE_TYPES]
+        overview, tiled = await asyncio.gather(
+            self.vision.annotate(upload, features),
+            self.tiler.ocr(image_content, plan)
+        )
+        return [overview], tiled
+    
+    async def _analyze_image_content(self, image_content: bytes, profile: Optional[str] = None) -> Dict[str, Any]:
         """
         Analyse le contenu d'une image avec Vision AI.
         
         Args:
             image_content: Contenu binaire de l'image
+            profile: Profil d'analyse (par défaut VISION_PROFILE)
             
         Returns:
             Résultats de l'analyse
         """
         try:
-            # Créer l'objet Image
-            image = vision.Image(content=image_content)
+            profile = profile or VISION_PROFILE
             
-            # Définir les fonctionnalités à analyser
-            features = [
-                vision.Feature(type_=vision.Feature.Type.LABEL_DETECTION, max_results=20),
-                vision.Feature(type_=vision.Feature.Type.TEXT_DETECTION),
-                vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION),
-                vision.Feature(type_=vision.Feature.Type.IMAGE_PROPERTIES)
-            ]
+            # Image déjà analysée (à l'octet près ou visuellement identique)
+            cache_key, cached = await asyncio.to_thread(self.cache.lookup, image_content, profile)
+            if cached is not None:
+                self.decisions["cache"] += 1
+                # Les compteurs de l'appel d'origine (prétraitement, temps Vision, tuiles) ne concernent pas celui-ci
+                result = {key: value for key, value in cached["result"].items() if key not in CALL_FIELDS}
+                return {
+                    **result,
+                    "processingTime": time.time(),
+                    "decidedBy": "cache",
+                    "cache": {"match": cached["match"], "distance": cached["distance"]}
+                }
             
-            # Créer la requête d'annotation
-            request = vision.AnnotateImageRequest(image=image, features=features)
+            # Images vides, logos et photos évidents: tranchés sans appel à Vision
+            preclassification = await asyncio.to_thread(preclassify, image_content)
+            if preclassification["decision"] == "decorative":
+                self.decisions["preclassifier"] += 1
+                return {
+                    "classification": "decorative",
+                    "profile": profile,
+                    "schemaType": SchemaType.UNKNOWN.value,
+                    "confidence": preclassification["score"],
+                    "ocrText": None,
+                    "labels": [],
+                    "dominantColors": [],
+                    "processingTime": time.time(),
+                    "decidedBy": "preclassifier",
+                    "preclassification": preclassification
+                }
             
-            # Envoyer la requête (en asynchrone pour ne pas bloquer)
-            response = await asyncio.to_thread(
-                self.client.annotate_image,
-                request=request
-            )
+            # Réduire et réencoder l'image, puis l'envoyer à Vision selon le profil d'analyse
+            upload, preprocessing = await self.preprocessor.prepare(image_content, cache_key.sha256)
+            vision_start = time.time()
+            plan = self.tiler.plan(image_content) if profile != "fast" else None
+            tiled = None
+            if plan is None:
+                responses = await self._annotate(upload, profile)
+            else:
+                responses, tiled = await self._annotate_tiled(image_content, upload, profile, plan)
+            vision_time = time.time() - vision_start
+            self.decisions["vision"] += 1
             
             # Extraire les étiquettes
-            labels = []
-            if response.label_annotations:
-                labels = [
-                    {
-                        "description": label.description.lower(),
-                        "score": label.score,
-                        "topicality": label.topicality
-                    }
-                    for label in response.label_annotations
-                ]
+            labels = [
+                {
+                    "description": label.description.lower(),
+                    "score": label.score,
+                    "topicality": label.topicality
+                }
+                for response in responses
+                for label in response.label_annotations
+            ]
             
             # Extraire le texte (OCR)
             detected_text = ""
-            if response.document_text_annotation and response.document_text_annotation.text:
-                detected_text = response.document_text_annotation.text
-            elif response.text_annotations and response.text_annotations[0].description:
-                detected_text = response.text_annotations[0].description
+            for response in responses:
+                if response.document_text_annotation and response.document_text_annotation.text:
+                    detected_text = response.document_text_annotation.text
+                elif response.text_annotations and response.text_annotations[0].description:
+                    detected_text = response.text_annotations[0].description
+            if tiled is not None:
+                detected_text = tiled["text"]
             
-            # Déterminer le type de schéma et si c'est un schéma technique
-            label_descriptions = [label["description"] for label in labels]
-            is_technical = self._is_technical_diagram(label_descriptions, detected_text)
-            schema_type = self._determine_schema_type(label_descriptions, detected_text)
-            confidence = self._calculate_confidence(schema_type, label_descriptions, detected_text)
+            # Schéma technique, type de schéma et confiance, en un seul parcours des étiquettes et du texte
+            score = self.scorer.score([label["description"] for label in labels], detected_text)
+            is_technical = score["isTechnical"]
+            schema_type = score["schemaType"]
+            confidence = score["confidence"]
             
             # Extraire les couleurs dominantes
             colors = []
-            if response.image_properties and response.image_properties.dominant_colors:
-                colors = [
-                    {
-                        "red": color.color.red,
-                        "green": color.color.green,
-                        "blue": color.color.blue,
-                        "score": color.score,
-                        "pixel_fraction": color.pixel_fraction
-                    }
-                    for color in response.image_properties.dominant_colors.colors[:5]
-                ]
+            for response in responses:
+                if response.image_properties and response.image_properties.dominant_colors:
+                    colors = [
+                        {
+                            "red": color.color.red,
+                            "green": color.color.green,
+                            "blue": color.color.blue,
+                            "score": color.score,
+                            "pixel_fraction": color.pixel_fraction
+                        }
+                        for color in response.image_properties.dominant_colors.colors[:5]
+                    ]
             
             # Classification finale
             classification = "technical_diagram" if is_technical else "decorative"
             
-            return {
+            result = {
                 "classification": classification,
-                "schemaType": schema_type.value,
+                "profile": profile,
+                "schemaType": schema_type,
                 "confidence": confidence,
                 "ocrText": detected_text if detected_text else None,
                 "labels": labels,
                 "dominantColors": colors,
-                "processingTime": time.time()
+                "processingTime": time.time(),
+                "decidedBy": "vision",
+                "preclassification": preclassification,
+                "preprocessing": preprocessing,
+                "visionTime": vision_time
             }
+            if tiled is not None:
+                result["tiling"] = tiled["tiling"]
+            await asyncio.to_thread(self.cache.store, cache_key, profile, result)
+            return result
             
         except Exception as e:
             logger.error(f"Erreur lors de l'analyse de l'image: {str(e)}")
             raise
+
+# Instance de l'analyseur, créée au démarrage par initialize_service()
+analyzer: Optional[SchemaAnalyzer] = None
+
+# Sémaphore des analyses, créé dans la boucle d'événements au premier appel
+_analysis_semaphore: Optional[asyncio.Semaphore] = None
+
+# État de l'initialisation, exposé par /health
+service_state = {
+    "status": "starting",
+    "attempts": 0,
+    "error": None,
+    "ready_since": None,
+    "warmup": None
+}
+
+async def initialize_service():
+    """
+    Crée le client Vision en réessayant avec un backoff exponentiel,
+    puis exécute le préchauffage optionnel.
+    """
+    global analyzer
     
-    def _is_technical_diagram(self, labels: List[str], text: str) -> bool:
-        """
-        Détermine si l'image est un schéma technique.
-        
-        Args:
-            labels: Liste des étiquettes détectées
-            text: Texte détecté dans l'image
-            
-        Returns:
-            True si c'est un schéma technique, False sinon
-        """
-        # Indicateurs de schémas techniques
-        technical_indicators = [
-            "diagram", "schematic", "blueprint", "technical drawing", "circuit",
-            "plan", "design", "drawing", "schematics", "technical", "engineering"
-        ]
-        
-        # Vérifier dans les étiquettes
-        if any(indicator in label for label in labels for indicator in technical_indicators):
-            return True
-            
-        # Vérifier dans le texte
-        text_lower = text.lower()
-        if any(indicator in text_lower for indicator in technical_indicators):
-            return True
-            
-        return False
-    
-    def _determine_schema_type(self, labels: List[str], text: str) -> SchemaType:
-        """
-        Détermine le type de schéma technique.
-        
-        Args:
-            labels: Liste des étiquettes détectées
-            text: Texte détecté dans l'image
+    attempt = 0
+    while True:
+        attempt += 1
+        service_state["attempts"] = attempt
+        try:
+            # La création du client résout les identifiants Google (appel bloquant)
+            instance = await asyncio.to_thread(SchemaAnalyzer)
             
-        Returns:
-            Type de schéma
-        """
-        # Combiner les étiquettes et le texte
-        text_lower = text.lower()
-        combined_text = " ".join(labels) + " " + text_lower
-        
-        scores = {}
-        for schema_type, features in self.schema_features.items():
-            score = sum(1 for feature in features if feature in combined_text)
-            scores[schema_type] = score
-        
-        # Déterminer le type avec le score le plus élevé
-        if not scores or max(scores.values()) == 0:
-            return SchemaType.UNKNOWN
+            if WARMUP_ENABLED:
+                service_state["status"] = "warming_up"
+                service_state["warmup"] = await instance.warm_up()
             
-        return max(scores.items(), key=lambda x: x[1])[0]
+            analyzer = instance
+            service_state.update(status="ready", error=None, ready_since=time.time())
+            logger.info(f"Service prêt après {attempt} tentative(s)")
+            return
+        except Exception as e:
+            service_state.update(status="retrying", error=str(e))
+            if attempt == INIT_MAX_ATTEMPTS:
+                # Arrêt du processus pour que l'orchestrateur le redémarre, au lieu de répondre 503 indéfiniment
+                logger.error(f"Initialisation abandonnée après {attempt} tentatives, arrêt du processus: {str(e)}")
+                os._exit(1)
+            delay = min(INIT_BACKOFF_MAX, INIT_BACKOFF_BASE * 2 ** min(attempt - 1, 16))
+            delay *= random.uniform(0.5, 1.0)
+            logger.warning(f"Initialisation échouée (tentative {attempt}), "
+                           f"nouvel essai dans {delay:.1f}s: {str(e)}")
+            await asyncio.sleep(delay)
+
+def get_analyzer() -> SchemaAnalyzer:
+    """Dépendance FastAPI qui refuse les requêtes tant que le service n'est pas prêt."""
+    if analyzer is None:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Service non disponible (état: {service_state['status']})"
+        )
+    return analyzer
+
+def validate_profile(profile: Optional[str]):
+    """Refuse une requête dont le profil d'analyse est inconnu."""
+    if profile is not None and profile not in VISION_PROFILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Profil d'analyse inconnu: {profile} (profils: {', '.join(VISION_PROFILES)})"
+        )
+
+async def analyze_bounded(analyzer: SchemaAnalyzer, image_path: str, profile: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Analyse une image en respectant la limite d'analyses simultanées et le délai par image.
     
-    def _calculate_confidence(self, schema_type: SchemaType, labels: List[str], text: str) -> float:
-        """
-        Calcule la confiance dans la classification.
-        
-        Args:
-            schema_type: Type de schéma déterminé
-            labels: Liste des étiquettes détectées
-            text: Texte détecté dans l'image
-            
-        Returns:
-            Score de confiance entre 0 et 1
-        """
-        if schema_type == SchemaType.UNKNOWN:
-            return 0.0
-            
-        text_lower = text.lower()
-        combined_text = " ".join(labels) + " " + text_lower
-        features = self.schema_features[schema_type]
-        
-        # Calculer le nombre de caractéristiques détectées
-        detected = sum(1 for feature in features if feature in combined_text)
+    Args:
+        analyzer: Analyseur de schémas
+        image_path: Chemin vers l'image à analyser
+        profile: Profil d'analyse (par défaut VISION_PROFILE)
         
-        # Calculer le ratio
-        confidence = detected / len(features)
+    Returns:
+        Résultats de l'analyse
         
-        # Bonus si plusieurs caractéristiques sont détectées
-        if detected > 2:
-            confidence = min(1.0, confidence * 1.2)
-            
-        return confidence
+    Raises:
+        asyncio.TimeoutError: Si l'analyse dépasse ANALYZE_IMAGE_TIMEOUT
+    """
+    global _analysis_semaphore
+    if _analysis_semaphore is None:
+        _analysis_semaphore = asyncio.Semaphore(ANALYZE_CONCURRENCY)
+    
+    # Le délai ne court qu'une fois l'analyse démarrée, pas pendant l'attente du sémaphore
+    async with _analysis_semaphore:
+        return await asyncio.wait_for(analyzer.analyze_image_from_path(image_path, profile), ANALYZE_IMAGE_TIMEOUT)
 
-# Créer une instance de l'analyseur
-analyzer = SchemaAnalyzer()
+def timing_stats(durations: List[float]) -> Dict[str, Any]:
+    """
+    Résume la distribution des durées d'analyse.
+    
+    Args:
+        durations: Durées en secondes
+        
+    Returns:
+        Minimum, maximum, moyenne et percentiles (rang le plus proche)
+    """
+    if not durations:
+        return {"count": 0}
+    
+    ordered = sorted(durations)
+    def percentile(p: float) -> float:
+        return ordered[max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered))) - 1))]
+    
+    return {
+        "count": len(ordered),
+        "min": ordered[0],
+        "max": ordered[-1],
+        "mean": sum(ordered) / len(ordered),
+        "p50": percentile(50),
+        "p90": percentile(90),
+        "p99": percentile(99),
+        "total": sum(ordered)
+    }
 
 @app.get("/health")
 async def health_check():
     """Vérification de l'état du service."""
+    if analyzer is None:
+        return JSONResponse(
+            status_code=503,
+            content={
+                "status": service_state["status"],
+                "attempts": service_state["attempts"],
+                "error": service_state["error"]
+            }
+        )
+    
     try:
         return {
             "status": "healthy",
-            "google_vision_configured": True
+            "google_vision_configured": True,
+            "ready_since": service_state["ready_since"],
+            "warmup": service_state["warmup"],
+            "analysis": {
+                "profile": VISION_PROFILE,
+                "concurrency": ANALYZE_CONCURRENCY,
+                "imageTimeout": ANALYZE_IMAGE_TIMEOUT,
+                "preclassifier": {"enabled": PRECLASSIFY_ENABLED, "threshold": PRECLASSIFY_THRESHOLD},
+                "decidedBy": analyzer.decisions
+            },
+            "vision_batch": analyzer.vision.batcher.stats(),
+            "vision_gateway": analyzer.vision.stats(),
+            "image_cache": analyzer.cache.stats(),
+            "preprocessing": analyzer.preprocessor.stats(),
+            "tiled_ocr": analyzer.tiler.stats()
         }
     except Exception as e:
         logger.error(f"Erreur de santé: {str(e)}")
@@ -283,74 +510,157 @@ async def health_check():
             content={"status": "error", "message": str(e)}
         )
 
+def analysis_stats(total_images: int, outcomes: List[Dict[str, Any]], start: float) -> Dict[str, Any]:
+    """
+    Construit les statistiques d'une analyse de document.
+    
+    Args:
+        total_images: Nombre d'images demandées
+        outcomes: Résultats ou erreurs des images analysées
+        start: Début de l'analyse
+        
+    Returns:
+        Les compteurs, la durée totale et la répartition des durées par image
+    """
+    results = [outcome["result"] for outcome in outcomes if "result" in outcome]
+    return {
+        "totalImages": total_images,
+        "processedImages": len(results),
+        "failedImages": len(outcomes) - len(results),
+        "technicalDiagrams": sum(1 for img in results if img["classification"] == "technical_diagram"),
+        "concurrency": ANALYZE_CONCURRENCY,
+        "wallTime": time.time() - start,
+        # Durée par image, attente d'un emplacement d'analyse comprise
+        "imageTime": timing_stats([outcome["duration"] for outcome in outcomes if "duration" in outcome])
+    }
+
+async def stream_analysis(request: AnalyzeRequest, analyze_one: Callable[[int, Dict[str, Any]], Awaitable[Dict[str, Any]]],
+                          start: float) -> AsyncIterator[str]:
+    """
+    Produit les résultats d'une analyse de document en NDJSON, dans l'ordre où les images se terminent.
+    
+    Args:
+        request: Informations sur les images à analyser
+        analyze_one: Analyse d'une image, renvoyant son résultat ou son erreur
+        start: Début de l'analyse
+        
+    Yields:
+        Un enregistrement "image" ou "error" par image, puis un enregistrement "stats" final
+    """
+    tasks = [
+        asyncio.ensure_future(analyze_one(index, image_info))
+        for index, image_info in enumerate(request.images)
+    ]
+    outcomes = []
+    try:
+        for next_outcome in asyncio.as_completed(tasks):
+            outcome = await next_outcome
+            outcomes.append(outcome)
+            if "result" in outcome:
+                record = {"type": "image", "documentId": request.documentId, "index": outcome["index"],
+                          "image": outcome["result"]}
+            else:
+                record = {"type": "error", "documentId": request.documentId, "index": outcome["index"],
+                          "error": outcome["error"]}
+            yield json.dumps(record) + "\n"
+        
+        yield json.dumps({
+            "type": "stats",
+            "success": True,
+            "documentId": request.documentId,
+            "processingTimestamp": time.time(),
+            "stats": analysis_stats(len(request.images), outcomes, start)
+        }) + "\n"
+    finally:
+        # Client déconnecté: les analyses restantes sont abandonnées
+        for task in tasks:
+            task.cancel()
+
 @app.post("/api/analyze")
-async def analyze_document_images(request: AnalyzeRequest):
+async def analyze_document_images(request: AnalyzeRequest, http_request: Request,
+                                  analyzer: SchemaAnalyzer = Depends(get_analyzer)):
     """
     Analyse les images d'un document.
     
+    Les images sont analysées en parallèle (au plus ANALYZE_CONCURRENCY à la
+    fois), chacune avec son propre délai : une image en échec ou trop lente
+    n'empêche pas l'analyse des autres. Les résultats suivent l'ordre des
+    images de la requête.
+    
+    En mode flux ("stream": true ou en-tête Accept: application/x-ndjson),
+    chaque image est renvoyée dès qu'elle est analysée, sur une ligne NDJSON,
+    suivie d'une ligne de statistiques : l'appelant peut indexer les schémas
+    techniques sans attendre la fin du document.
+    
     Args:
         request: Informations sur les images à analyser
+        http_request: Requête HTTP, pour l'en-tête Accept
         
     Returns:
         Résultats de l'analyse pour chaque image
     """
+    validate_profile(request.profile)
+    stream = request.stream or "application/x-ndjson" in http_request.headers.get("accept", "")
+    
     try:
         logger.info(f"Analyse des images pour le document {request.documentId}")
+        start = time.time()
         
-        results = []
-        failed_images = []
-        
-        # Traiter chaque image
-        for image_info in request.images:
+        async def analyze_one(index: int, image_info: Dict[str, Any]) -> Dict[str, Any]:
+            # Récupérer le chemin de l'image
+            image_path = image_info.get("path")
+            if not image_path:
+                logger.warning(f"Chemin d'image manquant: {image_info}")
+                return {"index": index,
+                        "error": {"id": image_info.get("id", "unknown"), "error": "Chemin d'image manquant"}}
+            
+            # Si le chemin est relatif, le rendre absolu par rapport au basePath
+            if not os.path.isabs(image_path):
+                image_path = os.path.join(request.basePath, image_path)
+            
+            image_start = time.time()
             try:
-                # Récupérer le chemin de l'image
-                image_path = image_info.get("path")
-                if not image_path:
-                    logger.warning(f"Chemin d'image manquant: {image_info}")
-                    failed_images.append({
-                        "id": image_info.get("id", "unknown"),
-                        "error": "Chemin d'image manquant"
-                    })
-                    continue
-                
-                # Si le chemin est relatif, le rendre absolu par rapport au basePath
-                if not os.path.isabs(image_path):
-                    image_path = os.path.join(request.basePath, image_path)
-                
-                # Analyser l'image
-                analysis_result = await analyzer.analyze_image_from_path(image_path)
-                
+                analysis_result = await analyze_bounded(analyzer, image_path, request.profile)
+            except asyncio.TimeoutError:
+                error = f"Délai d'analyse dépassé ({ANALYZE_IMAGE_TIMEOUT:g}s)"
+            except Exception as e:
+                error = getattr(e, "detail", None) or str(e)
+            else:
                 # Ajouter les informations de l'image
                 analysis_result.update({
-                    "id": image_info.get("id", f"img-{len(results)}"),
+                    "id": image_info.get("id", f"img-{index}"),
                     "path": image_path,
                     "page": image_info.get("page"),
                     "width": image_info.get("width"),
                     "height": image_info.get("height")
                 })
-                
-                results.append(analysis_result)
-                
-            except Exception as e:
-                logger.error(f"Erreur lors de l'analyse de l'image {image_info.get('id', 'unknown')}: {str(e)}")
-                failed_images.append({
+                return {"index": index, "result": analysis_result, "duration": time.time() - image_start}
+            
+            logger.error(f"Erreur lors de l'analyse de l'image {image_info.get('id', 'unknown')}: {error}")
+            return {
+                "index": index,
+                "error": {
                     "id": image_info.get("id", "unknown"),
                     "path": image_info.get("path", "unknown"),
-                    "error": str(e)
-                })
+                    "error": error
+                },
+                "duration": time.time() - image_start
+            }
+        
+        if stream:
+            return StreamingResponse(stream_analysis(request, analyze_one, start), media_type="application/x-ndjson")
+        
+        outcomes = await asyncio.gather(*[
+            analyze_one(index, image_info) for index, image_info in enumerate(request.images)
+        ])
         
         return {
             "success": True,
             "documentId": request.documentId,
-            "images": results,
-            "failedImages": failed_images,
+            "images": [outcome["result"] for outcome in outcomes if "result" in outcome],
+            "failedImages": [outcome["error"] for outcome in outcomes if "error" in outcome],
             "processingTimestamp": time.time(),
-            "stats": {
-                "totalImages": len(request.images),
-                "processedImages": len(results),
-                "failedImages": len(failed_images),
-                "technicalDiagrams": sum(1 for img in results if img["classification"] == "technical_diagram")
-            }
+            "stats": analysis_stats(len(request.images), outcomes, start)
         }
         
     except Exception as e:
@@ -361,7 +671,7 @@ async def analyze_document_images(request: AnalyzeRequest):
         )
 
 @app.post("/api/analyze-image")
-async def analyze_single_image(request: ImagePathAnalysisRequest):
+async def analyze_single_image(request: ImagePathAnalysisRequest, analyzer: SchemaAnalyzer = Depends(get_analyzer)):
     """
     Analyse une seule image par son chemin.
     
@@ -373,9 +683,21 @@ async def analyze_single_image(request: ImagePathAnalysisRequest):
     """
     try:
         logger.info(f"Analyse de l'image: {request.imagePath}")
+        validate_profile(request.profile)
         
-        # Analyser l'image
-        analysis_result = await analyzer.analyze_image_from_path(request.imagePath)
+        # Analyser l'image (appel interactif: prioritaire sur les analyses de documents)
+        try:
+            with vision_priority("interactive"):
+                analysis_result = await analyze_bounded(analyzer, request.imagePath, request.profile)
+        except CallDeadlineExceeded as e:
+            raise HTTPException(status_code=504, detail=str(e))
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=504,
+                detail=f"Délai d'analyse dépassé ({ANALYZE_IMAGE_TIMEOUT:g}s): {request.imagePath}"
+            )
+        except VisionUnavailableError as e:
+            raise HTTPException(status_code=503, detail=str(e))
         
         # Ajouter les informations de l'image
         analysis_result.update({
@@ -401,17 +723,21 @@ async def analyze_single_image(request: ImagePathAnalysisRequest):
         )
 
 @app.post("/classify")
-async def classify_image(file: UploadFile = File(...)):
+async def classify_image(file: UploadFile = File(...), profile: Optional[str] = None,
+                         analyzer: SchemaAnalyzer = Depends(get_analyzer)):
     """
     Classifie une image uploadée.
     
     Args:
         file: Fichier image à classifier
+        profile: Profil d'analyse Vision (par défaut VISION_PROFILE)
         
     Returns:
         Résultats de la classification
     """
     try:
+        validate_profile(profile)
+        
         # Vérifier le type de fichier
         content_type = file.content_type or ""
         if not content_type.startswith("image/"):
@@ -423,8 +749,14 @@ async def classify_image(file: UploadFile = File(...)):
         # Lire le contenu de l'image
         image_content = await file.read()
         
-        # Analyser l'image
-        analysis_result = await analyzer._analyze_image_content(image_content)
+        # Analyser l'image (appel interactif: prioritaire sur les analyses de documents)
+        try:
+            with vision_priority("interactive"):
+                analysis_result = await analyzer._analyze_image_content(image_content, profile)
+        except CallDeadlineExceeded as e:
+            raise HTTPException(status_code=504, detail=str(e))
+        except VisionUnavailableError as e:
+            raise HTTPException(status_code=503, detail=str(e))
         
         return {
             "success": True,
@@ -443,4 +775,6 @@ async def classify_image(file: UploadFile = File(...)):
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8002, reload=True)
+    # WEB_CONCURRENCY > 1 active le mode production multi-workers (sans rechargement)
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    uvicorn.run("main:app", host="0.0.0.0", port=8002, reload=workers == 1, workers=workers)
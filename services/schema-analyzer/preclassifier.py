@@ -0,0 +1,193 @@
+"""
+Pré-classification locale des images avant leur envoi à Vision.
+
+Une part importante des images extraites des manuels sont des emplacements
+vides, des logos, des photos ou des rognures presque blanches, que Vision ne
+fait que qualifier de décoratives. Quelques statistiques calculées avec
+NumPy sur une version réduite de l'image suffisent à les reconnaître :
+- taille du fichier et dimensions de l'image ;
+- proportions de fond uni et d'encre (pixels qui s'écartent nettement du fond) ;
+  le test d'image vide compte l'encre avant réduction, case par case, pour
+  qu'un trait fin d'un schéma grand format ne disparaisse pas dans la moyenne ;
+- densité de contours ;
+- nombre de couleurs et saturation moyenne ;
+- histogramme des orientations des contours : les schémas sont faits de
+  traits horizontaux et verticaux, les photos n'ont pas d'orientation dominante.
+
+Seules les images évidentes sont tranchées localement ; dans le doute, l'image
+part chez Vision.
+"""
+import io
+import logging
+import os
+from typing import Any, Dict, Tuple
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Activation et seuil de décision locale (score de 0 à 1 au-delà duquel l'image est décorative)
+PRECLASSIFY_ENABLED = os.getenv("PRECLASSIFY_ENABLED", "true").lower() == "true"
+PRECLASSIFY_THRESHOLD = float(os.getenv("PRECLASSIFY_THRESHOLD", "0.7"))
+
+# Images vides: fichier minuscule ou presque pas d'encre
+PRECLASSIFY_MIN_BYTES = int(os.getenv("PRECLASSIFY_MIN_BYTES", "512"))
+PRECLASSIFY_BLANK_INK_RATIO = float(os.getenv("PRECLASSIFY_BLANK_INK_RATIO", "0.002"))
+
+# Images trop petites pour contenir un schéma lisible (pictogrammes, puces)
+PRECLASSIFY_MIN_SIDE = int(os.getenv("PRECLASSIFY_MIN_SIDE", "48"))
+
+# Résolution d'analyse (plus grand côté, en pixels)
+PRECLASSIFY_ANALYSIS_SIZE = int(os.getenv("PRECLASSIFY_ANALYSIS_SIZE", "512"))
+
+# Écarts au fond (niveaux de gris) d'un pixel de fond et d'un pixel d'encre, gradient minimal d'un contour
+PRECLASSIFY_BACKGROUND_DELTA = float(os.getenv("PRECLASSIFY_BACKGROUND_DELTA", "12"))
+PRECLASSIFY_INK_DELTA = float(os.getenv("PRECLASSIFY_INK_DELTA", "48"))
+PRECLASSIFY_EDGE_THRESHOLD = float(os.getenv("PRECLASSIFY_EDGE_THRESHOLD", "64"))
+
+def _clip(value: float) -> float:
+    """Ramène une valeur dans [0, 1]."""
+    return float(min(1.0, max(0.0, value)))
+
+def _pool(gray: np.ndarray, size: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Niveaux de gris extrêmes de chaque case d'une grille d'au plus size cases de côté.
+
+    Args:
+        gray: Niveaux de gris à pleine résolution
+        size: Nombre maximum de cases sur le plus grand côté
+
+    Returns:
+        Les minimums et maximums de chaque case
+    """
+    factor = max(1, -(-max(gray.shape) // size))
+    factor_y, factor_x = min(factor, gray.shape[0]), min(factor, gray.shape[1])
+    rows, columns = gray.shape[0] // factor_y, gray.shape[1] // factor_x
+    # Les derniers pixels qui ne remplissent pas une case sont ignorés
+    blocks = gray[:rows * factor_y, :columns * factor_x].reshape(rows, factor_y, columns, factor_x)
+    return blocks.min(axis=(1, 3)), blocks.max(axis=(1, 3))
+
+def image_features(content: bytes) -> Dict[str, Any]:
+    """
+    Calcule les statistiques d'une image utilisées par la pré-classification.
+
+    Args:
+        content: Contenu binaire de l'image
+
+    Returns:
+        Taille, dimensions, proportions de fond et d'encre, part des cases contenant de l'encre
+        à pleine résolution, densité de contours, nombre de couleurs, saturation et histogramme
+        des orientations (0°, 45°, 90°, 135°)
+
+    Raises:
+        Exception: Si l'image ne peut pas être décodée
+    """
+    with Image.open(io.BytesIO(content)) as image:
+        width, height = image.size
+        # Décodage JPEG réduit, mais pas au point d'effacer les traits fins
+        image.draft("RGB", (4 * PRECLASSIFY_ANALYSIS_SIZE, 4 * PRECLASSIFY_ANALYSIS_SIZE))
+        if image.mode in ("RGBA", "LA", "P", "PA"):
+            # Transparence rendue sur fond blanc, comme à l'impression
+            image = image.convert("RGBA")
+            image = Image.alpha_composite(Image.new("RGBA", image.size, (255, 255, 255, 255)), image)
+        image = image.convert("RGB")
+        low, high = _pool(np.asarray(image.convert("L"), dtype=np.int16), PRECLASSIFY_ANALYSIS_SIZE)
+        image.thumbnail((PRECLASSIFY_ANALYSIS_SIZE, PRECLASSIFY_ANALYSIS_SIZE))
+        rgb = np.asarray(image, dtype=np.int16)
+
+    gray = rgb.mean(axis=2)
+    features = {
+        "bytes": len(content),
+        "width": width,
+        "height": height
+    }
+
+    # Fond (niveau de gris dominant) et encre (pixels qui s'en écartent nettement)
+    deviation = np.abs(gray - float(np.median(gray)))
+    features["backgroundRatio"] = float((deviation <= PRECLASSIFY_BACKGROUND_DELTA).mean())
+    features["inkRatio"] = float((deviation > PRECLASSIFY_INK_DELTA).mean())
+
+    # Cases dont au moins un pixel pleine résolution est de l'encre (test d'image vide)
+    background = float(np.median(gray))
+    features["inkCoverage"] = float((np.maximum(background - low, high - background) > PRECLASSIFY_INK_DELTA).mean())
+
+    # Contours: gradient centré, puis orientation des pixels de contour
+    gx = np.zeros_like(gray)
+    gy = np.zeros_like(gray)
+    gx[:, 1:-1] = gray[:, 2:] - gray[:, :-2]
+    gy[1:-1, :] = gray[2:, :] - gray[:-2, :]
+    edges = np.hypot(gx, gy) > PRECLASSIFY_EDGE_THRESHOLD
+    features["edgeDensity"] = float(edges.mean())
+
+    angles = np.degrees(np.arctan2(gy[edges], gx[edges])) % 180.0
+    histogram = np.bincount(((angles + 22.5) // 45).astype(np.int64) % 4, minlength=4)
+    total = histogram.sum()
+    features["orientations"] = [float(count / total) if total else 0.0 for count in histogram]
+
+    # Couleurs: 4 bits par canal, en ignorant les teintes marginales (anticrénelage)
+    quantized = (rgb >> 4).reshape(-1, 3)
+    counts = np.bincount(quantized[:, 0] * 256 + quantized[:, 1] * 16 + quantized[:, 2], minlength=4096)
+    features["colorCount"] = int((counts > 0.001 * len(quantized)).sum())
+    features["saturation"] = float((rgb.max(axis=2) - rgb.min(axis=2)).mean() / 255.0)
+
+    return features
+
+def preclassify(content: bytes, threshold: float = PRECLASSIFY_THRESHOLD) -> Dict[str, Any]:
+    """
+    Décide localement si une image est évidemment décorative.
+
+    Args:
+        content: Contenu binaire de l'image
+        threshold: Score au-delà duquel l'image est déclarée décorative sans appel à Vision
+
+    Returns:
+        {"decision": "decorative" ou "vision", "reason", "score", "features"}
+    """
+    if not PRECLASSIFY_ENABLED:
+        return {"decision": "vision", "reason": "disabled", "score": 0.0, "features": {}}
+
+    if len(content) < PRECLASSIFY_MIN_BYTES:
+        return {"decision": "decorative", "reason": "blank", "score": 1.0, "features": {"bytes": len(content)}}
+
+    try:
+        features = image_features(content)
+    except Exception as e:
+        # Format inconnu de Pillow: Vision tranchera
+        logger.warning(f"Pré-classification impossible: {str(e)}")
+        return {"decision": "vision", "reason": "undecodable", "score": 0.0, "features": {"bytes": len(content)}}
+
+    if features["inkCoverage"] < PRECLASSIFY_BLANK_INK_RATIO:
+        return {"decision": "decorative", "reason": "blank", "score": 1.0, "features": features}
+
+    if min(features["width"], features["height"]) < PRECLASSIFY_MIN_SIDE:
+        return {"decision": "decorative", "reason": "tiny", "score": 1.0, "features": features}
+
+    # Part des contours horizontaux et verticaux: ~0.5 sans orientation dominante
+    orientations = features["orientations"]
+    axis_ratio = orientations[0] + orientations[2]
+
+    # Photo: nombreuses couleurs, contours sans orientation dominante, pas de fond uni
+    photo_score = (
+        _clip((features["colorCount"] - 64) / 448)
+        + _clip((0.75 - axis_ratio) / 0.25)
+        + _clip((features["saturation"] - 0.05) / 0.25)
+        + _clip((0.7 - features["backgroundRatio"]) / 0.4)
+    ) / 4
+
+    # Logo ou aplat: beaucoup d'encre mais peu de contours (surfaces pleines), couleurs vives
+    edges_per_ink = features["edgeDensity"] / features["inkRatio"] if features["inkRatio"] else 0.0
+    flat_score = (
+        _clip((features["inkRatio"] - 0.2) / 0.3)
+        + _clip((0.2 - edges_per_ink) / 0.15)
+        + _clip((features["saturation"] - 0.1) / 0.3)
+    ) / 3
+
+    reason, score = ("photo", photo_score) if photo_score >= flat_score else ("flat", flat_score)
+    features["axisRatio"] = axis_ratio
+    return {
+        "decision": "decorative" if score >= threshold else "vision",
+        "reason": reason,
+        "score": round(score, 3),
+        "features": features
+    }
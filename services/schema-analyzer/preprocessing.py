@@ -0,0 +1,308 @@
+"""
+Préparation des images avant leur envoi à Vision.
+
+Les pages rendues et les scans TIFF atteignent plusieurs mégaoctets, alors
+qu'une résolution bien plus faible suffit à la lecture de leur texte. Avant
+l'envoi, chaque image est décodée, réduite à PREPROCESS_MAX_SIDE pixels sur
+son plus grand côté, convertie en niveaux de gris si elle n'a pas de couleur
+(dessins au trait, scans) et réencodée en PNG ou JPEG, selon le plus compact.
+L'image d'origine est conservée quand la préparation ne la réduit pas.
+
+Le décodage et l'encodage, comme le découpage en tuiles des grands formats
+(tiling.py), sont exécutés dans un pool de processus. L'image préparée est
+conservée sur disque, indexée par le SHA-256 de l'image source, pour que les
+workers du service et les analyses suivantes la réutilisent.
+"""
+import asyncio
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Activation et taille minimale des images préparées (les petites partent telles quelles)
+PREPROCESS_ENABLED = os.getenv("PREPROCESS_ENABLED", "true").lower() == "true"
+PREPROCESS_MIN_BYTES = int(os.getenv("PREPROCESS_MIN_BYTES", str(256 * 1024)))
+
+# Plus grand côté après réduction: assez pour que l'OCR lise les annotations
+PREPROCESS_MAX_SIDE = int(os.getenv("PREPROCESS_MAX_SIDE", "2400"))
+
+# Saturation moyenne (0 à 255) en dessous de laquelle l'image est traitée en niveaux de gris
+PREPROCESS_GRAY_SATURATION = float(os.getenv("PREPROCESS_GRAY_SATURATION", "8"))
+
+# Qualité JPEG des images réencodées
+PREPROCESS_JPEG_QUALITY = int(os.getenv("PREPROCESS_JPEG_QUALITY", "85"))
+
+# Pool de processus de préparation
+PREPROCESS_WORKERS = int(os.getenv("PREPROCESS_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Cache disque des images préparées
+PREPROCESS_CACHE_DIR = os.getenv(
+    "PREPROCESS_CACHE_DIR", os.path.join(os.getenv("TEMP_DIR", "/tmp/technicia-docs"), "preprocessed")
+)
+PREPROCESS_CACHE_MAX_FILES = int(os.getenv("PREPROCESS_CACHE_MAX_FILES", "5000"))
+
+# Formats acceptés tels quels par Vision (les autres, dont le TIFF, sont toujours convertis)
+VISION_FORMATS = ("JPEG", "PNG", "GIF", "BMP", "WEBP")
+
+def encode_compact(image: Any, jpeg_quality: int) -> Tuple[str, bytes]:
+    """
+    Encode une image en PNG et en JPEG et garde le plus compact.
+
+    Le PNG l'emporte sur les aplats et les traits, le JPEG sur les scans bruités et les photos.
+
+    Args:
+        image: Image Pillow (RGB ou niveaux de gris)
+        jpeg_quality: Qualité JPEG
+
+    Returns:
+        Le format retenu et le contenu encodé
+    """
+    candidates = []
+    for image_format, options in (("PNG", {"compress_level": 6}), ("JPEG", {"quality": jpeg_quality})):
+        buffer = io.BytesIO()
+        image.save(buffer, image_format, **options)
+        candidates.append((len(buffer.getvalue()), image_format, buffer.getvalue()))
+    _, image_format, encoded = min(candidates)
+    return image_format, encoded
+
+def cut_tiles(content: bytes, boxes: List[List[int]], jpeg_quality: int) -> List[bytes]:
+    """
+    Découpe une image en tuiles à pleine résolution, en niveaux de gris (exécuté dans le pool de processus).
+
+    Args:
+        content: Contenu binaire de l'image
+        boxes: Rectangles [x0, y0, x1, y1] des tuiles, en pixels de l'image
+        jpeg_quality: Qualité JPEG
+
+    Returns:
+        Le contenu encodé de chaque tuile, dans l'ordre des rectangles
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(content)) as source:
+        if source.mode in ("RGBA", "LA", "P", "PA"):
+            rgba = source.convert("RGBA")
+            image = Image.alpha_composite(Image.new("RGBA", rgba.size, (255, 255, 255, 255)), rgba).convert("L")
+        else:
+            image = source.convert("L")
+
+    return [encode_compact(image.crop(tuple(box)), jpeg_quality)[1] for box in boxes]
+
+def prepare_image(content: bytes, max_side: int, gray_saturation: float, jpeg_quality: int) -> Dict[str, Any]:
+    """
+    Réduit et réencode une image (exécuté dans le pool de processus).
+
+    Args:
+        content: Contenu binaire de l'image
+        max_side: Plus grand côté après réduction
+        gray_saturation: Saturation moyenne en dessous de laquelle l'image passe en niveaux de gris
+        jpeg_quality: Qualité JPEG
+
+    Returns:
+        Le contenu à envoyer (None pour garder l'original), son format, les dimensions
+        avant et après réduction et la conversion en niveaux de gris
+    """
+    import numpy as np
+    from PIL import Image
+
+    with Image.open(io.BytesIO(content)) as source:
+        source_format = source.format
+        width, height = source.size
+        # Réduction dès le décodage pour les JPEG
+        source.draft("RGB", (max_side, max_side))
+        image = source.convert("RGBA") if source.mode in ("RGBA", "LA", "P", "PA") else source.convert("RGB")
+
+    if image.mode == "RGBA":
+        # Transparence rendue sur fond blanc, comme à l'impression
+        image = Image.alpha_composite(Image.new("RGBA", image.size, (255, 255, 255, 255)), image).convert("RGB")
+
+    resized = max(width, height) > max_side
+    if resized:
+        image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+
+    # Dessin au trait ou scan monochrome: une seule composante suffit
+    sample = np.asarray(image.resize((min(image.width, 256), min(image.height, 256))), dtype=np.int16)
+    grayscale = float((sample.max(axis=2) - sample.min(axis=2)).mean()) < gray_saturation
+    if grayscale:
+        image = image.convert("L")
+
+    image_format, encoded = encode_compact(image, jpeg_quality)
+    size = len(encoded)
+
+    # L'original est conservé s'il est déjà plus compact et lisible par Vision
+    keep_original = not resized and source_format in VISION_FORMATS and size >= len(content)
+    return {
+        "content": None if keep_original else encoded,
+        "format": source_format if keep_original else image_format,
+        "originalSize": [width, height],
+        "size": [width, height] if keep_original else list(image.size),
+        "grayscale": grayscale and not keep_original
+    }
+
+class ImagePreprocessor:
+    """Préparation des images dans un pool de processus, avec cache disque par SHA-256."""
+
+    def __init__(self, cache_dir: str = PREPROCESS_CACHE_DIR, workers: int = PREPROCESS_WORKERS):
+        """
+        Initialise la préparation.
+
+        Args:
+            cache_dir: Répertoire du cache des images préparées
+            workers: Nombre de processus de préparation
+        """
+        self.cache_dir = cache_dir
+        self.workers = workers
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # Pool créé au premier appel
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._writes = 0
+
+        self._stats = {"images": 0, "prepared": 0, "cacheHits": 0, "unchanged": 0, "failures": 0,
+                       "originalBytes": 0, "bytes": 0, "time": 0.0}
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        """
+        Retourne le pool de processus, créé au premier appel.
+
+        Les processus sont lancés en mode "spawn" : le processus parent possède des
+        threads gRPC qu'un fork ne dupliquerait pas correctement.
+        """
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._pool
+
+    def _cache_path(self, sha256: str) -> str:
+        """Chemin de l'image préparée d'une source."""
+        return os.path.join(self.cache_dir, sha256[:2], sha256)
+
+    async def prepare(self, content: bytes, sha256: Optional[str] = None) -> Tuple[bytes, Dict[str, Any]]:
+        """
+        Prépare une image pour Vision.
+
+        Args:
+            content: Contenu binaire de l'image
+            sha256: SHA-256 du contenu, s'il est déjà connu
+
+        Returns:
+            Le contenu à envoyer et le compte rendu de la préparation (tailles avant et après)
+        """
+        start = time.time()
+        self._stats["images"] += 1
+        self._stats["originalBytes"] += len(content)
+        info: Dict[str, Any] = {"originalBytes": len(content), "bytes": len(content), "cached": False}
+
+        # Les petites images partent telles quelles, sauf les TIFF que Vision ne lit pas
+        is_tiff = content[:4] in (b"II*\x00", b"MM\x00*")
+        if not PREPROCESS_ENABLED or (len(content) < PREPROCESS_MIN_BYTES and not is_tiff):
+            self._stats["unchanged"] += 1
+            self._stats["bytes"] += len(content)
+            return content, info
+
+        sha256 = sha256 or hashlib.sha256(content).hexdigest()
+        path = self._cache_path(sha256)
+        try:
+            prepared = await asyncio.to_thread(self._read, path)
+            if prepared is not None:
+                self._stats["cacheHits"] += 1
+                info.update(bytes=len(prepared), cached=True)
+            else:
+                result = await asyncio.get_running_loop().run_in_executor(
+                    self._get_pool(), prepare_image, content,
+                    PREPROCESS_MAX_SIDE, PREPROCESS_GRAY_SATURATION, PREPROCESS_JPEG_QUALITY
+                )
+                # Un original conservé est mis en cache tel quel: la décision n'est prise qu'une fois
+                prepared = result.pop("content") or content
+                info.update(result, bytes=len(prepared))
+                await asyncio.to_thread(self._write, path, prepared)
+        except Exception as e:
+            # L'image d'origine reste analysable
+            logger.warning(f"Préparation de l'image {sha256[:12]} impossible: {str(e)}")
+            self._stats["failures"] += 1
+            self._stats["bytes"] += len(content)
+            return content, info
+        finally:
+            self._stats["time"] += time.time() - start
+
+        if prepared == content:
+            self._stats["unchanged"] += 1
+        else:
+            self._stats["prepared"] += 1
+        self._stats["bytes"] += len(prepared)
+        return prepared, info
+
+    def _read(self, path: str) -> Optional[bytes]:
+        """Lit une image préparée du cache."""
+        try:
+            with open(path, "rb") as cached_file:
+                return cached_file.read()
+        except FileNotFoundError:
+            return None
+
+    def _write(self, path: str, content: bytes):
+        """Écrit une image préparée dans le cache (écriture atomique), puis purge périodiquement."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as cached_file:
+            cached_file.write(content)
+        os.replace(temp_path, path)
+
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self._prune()
+
+    def _prune(self):
+        """Supprime les images préparées les plus anciennes au-delà de PREPROCESS_CACHE_MAX_FILES."""
+        files = []
+        for directory, _, names in os.walk(self.cache_dir):
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    files.append((os.path.getmtime(path), path))
+                except OSError:
+                    continue
+        files.sort()
+        for _, path in files[:max(0, len(files) - PREPROCESS_CACHE_MAX_FILES)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    async def cut_tiles(self, content: bytes, boxes: List[List[int]]) -> List[bytes]:
+        """
+        Découpe une image en tuiles dans le pool de processus.
+
+        Args:
+            content: Contenu binaire de l'image
+            boxes: Rectangles [x0, y0, x1, y1] des tuiles
+
+        Returns:
+            Le contenu encodé de chaque tuile
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            self._get_pool(), cut_tiles, content, boxes, PREPROCESS_JPEG_QUALITY
+        )
+
+    def shutdown(self):
+        """Arrête le pool de processus."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """Retourne les compteurs de la préparation pour /health."""
+        return {
+            **self._stats,
+            "enabled": PREPROCESS_ENABLED,
+            "savedBytes": self._stats["originalBytes"] - self._stats["bytes"],
+            "maxSide": PREPROCESS_MAX_SIDE,
+            "workers": self.workers
+        }
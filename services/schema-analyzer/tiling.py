@@ -0,0 +1,276 @@
+"""
+OCR en tuiles des schémas grand format.
+
+Envoyé d'un seul tenant, un schéma électrique A1 ou A0 numérisé est réduit par
+Vision au point de perdre les repères de bornes, et son appel est le plus long
+du traitement. Au-delà de TILED_OCR_MIN_SIDE pixels, l'image est découpée en
+tuiles qui se chevauchent, lues à pleine résolution et en parallèle (les
+tuiles passent par la passerelle Vision, avec la priorité de la requête).
+
+Les mots de chaque tuile sont replacés dans les coordonnées de l'image. Un
+mot n'est retenu que par la tuile qui possède son centre : chaque tuile
+possède sa zone propre, bornée au milieu des chevauchements, ce qui élimine
+les doublons des zones communes sans perdre les mots coupés par un bord.
+Le texte est enfin reconstitué ligne par ligne.
+"""
+import asyncio
+import io
+import logging
+import os
+import statistics
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from google.cloud import vision
+from PIL import Image
+
+from vision_gateway import VisionGateway
+
+logger = logging.getLogger(__name__)
+
+# Activation et plus grand côté (en pixels) à partir duquel une image est découpée
+TILED_OCR_ENABLED = os.getenv("TILED_OCR_ENABLED", "true").lower() == "true"
+TILED_OCR_MIN_SIDE = int(os.getenv("TILED_OCR_MIN_SIDE", "4000"))
+
+# Taille des tuiles et largeur du chevauchement (plus large que les plus grands repères)
+TILED_OCR_TILE_SIZE = int(os.getenv("TILED_OCR_TILE_SIZE", "2048"))
+TILED_OCR_OVERLAP = int(os.getenv("TILED_OCR_OVERLAP", "256"))
+
+# Nombre maximum de tuiles par image (les tuiles sont agrandies au-delà)
+TILED_OCR_MAX_TILES = int(os.getenv("TILED_OCR_MAX_TILES", "64"))
+
+# Analyses de texte, remplacées par l'OCR en tuiles
+TEXT_FEATURE_TYPES = (vision.Feature.Type.TEXT_DETECTION, vision.Feature.Type.DOCUMENT_TEXT_DETECTION)
+
+def image_size(content: bytes) -> Optional[List[int]]:
+    """Dimensions d'une image, lues dans son en-tête (None si elle est illisible)."""
+    try:
+        with Image.open(io.BytesIO(content)) as image:
+            return list(image.size)
+    except Exception:
+        return None
+
+def _axis(length: int, tile: int, overlap: int) -> List[List[int]]:
+    """Découpe un côté en segments de taille tile qui se chevauchent d'au moins overlap."""
+    if length <= tile:
+        return [[0, length]]
+    count = -(-(length - overlap) // (tile - overlap))
+    step = (length - tile) / (count - 1)
+    return [[round(i * step), round(i * step) + tile] for i in range(count)]
+
+def plan_tiles(width: int, height: int, tile_size: int = TILED_OCR_TILE_SIZE,
+               overlap: int = TILED_OCR_OVERLAP, max_tiles: int = TILED_OCR_MAX_TILES) -> List[List[int]]:
+    """
+    Découpe une image en tuiles qui se chevauchent.
+
+    Args:
+        width: Largeur de l'image
+        height: Hauteur de l'image
+        tile_size: Côté des tuiles
+        overlap: Chevauchement minimal entre tuiles voisines
+        max_tiles: Nombre maximum de tuiles (la taille des tuiles augmente au besoin)
+
+    Returns:
+        Les rectangles [x0, y0, x1, y1] des tuiles, ligne par ligne
+    """
+    while True:
+        columns = _axis(width, tile_size, overlap)
+        rows = _axis(height, tile_size, overlap)
+        if len(columns) * len(rows) <= max_tiles:
+            return [[x0, y0, x1, y1] for y0, y1 in rows for x0, x1 in columns]
+        tile_size = int(tile_size * 1.25)
+
+def _owned_region(box: List[int], width: int, height: int, boxes: List[List[int]]) -> List[float]:
+    """Zone propre d'une tuile: son rectangle, réduit au milieu des chevauchements avec ses voisines."""
+    x0, y0, x1, y1 = box
+    left, top, right, bottom = float(x0), float(y0), float(x1), float(y1)
+    for other in boxes:
+        ox0, oy0, ox1, oy1 = other
+        if other is box:
+            continue
+        # Voisine sur la même ligne ou la même colonne
+        if oy0 == y0 and ox0 < x0 < ox1:
+            left = max(left, (x0 + ox1) / 2)
+        if oy0 == y0 and ox0 < x1 < ox1:
+            right = min(right, (ox0 + x1) / 2)
+        if ox0 == x0 and oy0 < y0 < oy1:
+            top = max(top, (y0 + oy1) / 2)
+        if ox0 == x0 and oy0 < y1 < oy1:
+            bottom = min(bottom, (oy0 + y1) / 2)
+    return [left, top, right if x1 < width else float(width), bottom if y1 < height else float(height)]
+
+def merge_words(tiles: List[Dict[str, Any]], width: int, height: int) -> Dict[str, Any]:
+    """
+    Rassemble les mots des tuiles dans les coordonnées de l'image et reconstitue le texte.
+
+    Args:
+        tiles: Pour chaque tuile, {"box": [x0, y0, x1, y1], "words": [{"text", "box"}]}
+            (boîtes des mots relatives à la tuile ; "words" vaut None pour une tuile en échec)
+        width: Largeur de l'image
+        height: Hauteur de l'image
+
+    Returns:
+        Le texte reconstitué, les mots retenus (coordonnées de l'image) et le nombre de doublons écartés
+    """
+    # Une tuile en échec ne possède rien: ses voisines gardent tout le chevauchement commun
+    boxes = [tile["box"] for tile in tiles if tile["words"] is not None]
+    words = []
+    positions: Dict[str, List[Tuple[float, float]]] = {}
+    duplicates = 0
+    for tile in tiles:
+        if tile["words"] is None:
+            continue
+        left, top, right, bottom = _owned_region(tile["box"], width, height, boxes)
+        x_offset, y_offset = tile["box"][0], tile["box"][1]
+        for word in tile["words"]:
+            wx0, wy0, wx1, wy1 = word["box"]
+            box = [wx0 + x_offset, wy0 + y_offset, wx1 + x_offset, wy1 + y_offset]
+            center_x, center_y = (box[0] + box[2]) / 2, (box[1] + box[3]) / 2
+            if not (left <= center_x < right and top <= center_y < bottom):
+                duplicates += 1
+                continue
+            # Deux tuiles peuvent posséder la même zone autour d'une tuile en échec:
+            # un mot déjà lu au même endroit par une autre tuile est écarté
+            tolerance = max(1, box[3] - box[1]) / 2
+            seen = positions.setdefault(word["text"], [])
+            if any(abs(center_x - x) <= tolerance and abs(center_y - y) <= tolerance for x, y in seen):
+                duplicates += 1
+                continue
+            seen.append((center_x, center_y))
+            words.append({"text": word["text"], "box": box})
+
+    return {"text": words_to_text(words), "words": words, "duplicates": duplicates}
+
+def words_to_text(words: List[Dict[str, Any]]) -> str:
+    """
+    Reconstitue le texte d'une liste de mots positionnés, ligne par ligne.
+
+    Args:
+        words: Mots {"text", "box": [x0, y0, x1, y1]}
+
+    Returns:
+        Le texte, une ligne par rangée de mots, de haut en bas et de gauche à droite
+    """
+    if not words:
+        return ""
+
+    # Deux mots sont sur la même ligne si leurs centres sont à moins d'une demi-hauteur de mot
+    tolerance = statistics.median(max(1, word["box"][3] - word["box"][1]) for word in words) / 2
+    lines: List[Dict[str, Any]] = []
+    for word in sorted(words, key=lambda word: (word["box"][1] + word["box"][3]) / 2):
+        center_y = (word["box"][1] + word["box"][3]) / 2
+        if lines and center_y - lines[-1]["y"] <= tolerance:
+            lines[-1]["words"].append(word)
+        else:
+            lines.append({"y": center_y, "words": [word]})
+
+    return "\n".join(
+        " ".join(word["text"] for word in sorted(line["words"], key=lambda word: word["box"][0]))
+        for line in lines
+    )
+
+def response_words(response: vision.AnnotateImageResponse) -> List[Dict[str, Any]]:
+    """Mots d'une réponse Vision avec leur boîte englobante (la première annotation est le texte entier)."""
+    words = []
+    for annotation in list(response.text_annotations)[1:]:
+        vertices = annotation.bounding_poly.vertices
+        xs = [vertex.x for vertex in vertices] or [0]
+        ys = [vertex.y for vertex in vertices] or [0]
+        words.append({"text": annotation.description, "box": [min(xs), min(ys), max(xs), max(ys)]})
+    return words
+
+class TiledOCR:
+    """OCR en tuiles parallèles des images grand format."""
+
+    def __init__(self, vision_gateway: VisionGateway, preprocessor: Any):
+        """
+        Initialise l'OCR en tuiles.
+
+        Args:
+            vision_gateway: Passerelle d'accès à Vision
+            preprocessor: Préparation des images (pool de processus du découpage)
+        """
+        self.vision = vision_gateway
+        self.preprocessor = preprocessor
+        self._stats = {"images": 0, "tiles": 0, "failedTiles": 0, "duplicates": 0, "time": 0.0}
+
+    def plan(self, content: bytes) -> Optional[Dict[str, Any]]:
+        """
+        Détermine si une image doit être lue en tuiles.
+
+        Args:
+            content: Contenu binaire de l'image
+
+        Returns:
+            Les dimensions de l'image et les rectangles des tuiles, ou None si l'image est lue d'un seul tenant
+        """
+        if not TILED_OCR_ENABLED:
+            return None
+        size = image_size(content)
+        if size is None or max(size) < TILED_OCR_MIN_SIDE:
+            return None
+        return {"width": size[0], "height": size[1], "boxes": plan_tiles(size[0], size[1])}
+
+    async def ocr(self, content: bytes, plan: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Lit le texte d'une image tuile par tuile.
+
+        Args:
+            content: Contenu binaire de l'image, à pleine résolution
+            plan: Découpage renvoyé par plan()
+
+        Returns:
+            Le texte reconstitué et le compte rendu du découpage
+
+        Raises:
+            Exception: Si aucune tuile n'a pu être lue
+        """
+        start = time.time()
+        tiles = await self.preprocessor.cut_tiles(content, plan["boxes"])
+        features = [vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)]
+        responses = await asyncio.gather(
+            *[self.vision.annotate(tile, features) for tile in tiles],
+            return_exceptions=True
+        )
+
+        tile_words = []
+        failed = 0
+        for box, response in zip(plan["boxes"], responses):
+            if isinstance(response, BaseException):
+                failed += 1
+                logger.warning(f"OCR d'une tuile {box} impossible: {str(response)}")
+                tile_words.append({"box": box, "words": None})
+            else:
+                tile_words.append({"box": box, "words": response_words(response)})
+        if failed == len(tiles):
+            raise responses[0]
+
+        merged = merge_words(tile_words, plan["width"], plan["height"])
+        elapsed = time.time() - start
+        self._stats["images"] += 1
+        self._stats["tiles"] += len(tiles)
+        self._stats["failedTiles"] += failed
+        self._stats["duplicates"] += merged["duplicates"]
+        self._stats["time"] += elapsed
+
+        return {
+            "text": merged["text"],
+            "tiling": {
+                "tiles": len(tiles),
+                "failedTiles": failed,
+                "words": len(merged["words"]),
+                "duplicatesRemoved": merged["duplicates"],
+                "tileBytes": sum(len(tile) for tile in tiles),
+                "time": elapsed
+            }
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """Retourne les compteurs de l'OCR en tuiles pour /health."""
+        return {
+            **self._stats,
+            "enabled": TILED_OCR_ENABLED,
+            "minSide": TILED_OCR_MIN_SIDE,
+            "tileSize": TILED_OCR_TILE_SIZE,
+            "overlap": TILED_OCR_OVERLAP
+        }
@@ -2,18 +2,25 @@
 Service de vectorisation et d'indexation pour TechnicIA.
 Utilise VoyageAI pour générer des embeddings et Qdrant pour la recherche vectorielle.
 """
-from fastapi import FastAPI, HTTPException, Body
+from fastapi import FastAPI, HTTPException, Body, Depends
 from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
+import asyncio
+import hashlib
 import httpx
 import os
 import logging
 import json
+import random
 import time
 import uuid
-from typing import Dict, List, Any, Optional, Union
+from typing import Dict, List, Any, Optional, Tuple, Union
 from pydantic import BaseModel, Field
 from qdrant_client import QdrantClient
 from qdrant_client.http import models
+from call_policy import CallDeadlineExceeded, CallPolicy, RequestBudgetMiddleware
+from job_store import Checkpoints, JobStore
+from shared_cache import SharedCache
 
 # Configuration du logging
 logging.basicConfig(
@@ -22,13 +29,28 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Lance l'initialisation en arrière-plan et libère les ressources à l'arrêt."""
+    init_task = asyncio.create_task(initialize_service())
+    yield
+    init_task.cancel()
+    if maintenance_task is not None:
+        maintenance_task.cancel()
+    if vector_engine is not None:
+        await vector_engine.aclose()
+
 # Configuration de l'application
 app = FastAPI(
     title="Vector Engine Service",
     description="Service de vectorisation et d'indexation pour TechnicIA",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# Échéance de chaque requête (en-tête X-Request-Budget), appliquée aux appels VoyageAI
+app.add_middleware(RequestBudgetMiddleware)
+
 # Configuration Qdrant
 QDRANT_HOST = os.getenv("QDRANT_HOST", "qdrant")
 QDRANT_PORT = int(os.getenv("QDRANT_PORT", "6333"))
@@ -40,6 +62,89 @@ VOYAGE_API_KEY = os.getenv("VOYAGE_API_KEY")
 VOYAGE_BASE_URL = "https://api.voyageai.com/v1"
 VOYAGE_TEXT_MODEL = "voyage-large-2"
 
+# Délai maximum d'un appel à VoyageAI (secondes), borné par le budget de la requête, et
+# doublement des appels lents (désactivé par défaut: chaque appel est facturé)
+VOYAGE_TIMEOUT = float(os.getenv("VOYAGE_TIMEOUT", "30"))
+VOYAGE_HEDGE = os.getenv("VOYAGE_HEDGE", "false").lower() == "true"
+voyage_policy = CallPolicy("voyageai", VOYAGE_TIMEOUT, hedge=VOYAGE_HEDGE)
+
+# Nombre de textes par appel d'embedding (et par point de reprise de l'indexation)
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+
+# Espace de noms des identifiants de points Qdrant, dérivés des identifiants des éléments
+POINT_ID_NAMESPACE = uuid.UUID("6f1c2a52-3d0b-4f6e-9b8a-7c4e5d2f1a90")
+
+# Configuration de l'initialisation (tentatives, backoff et préchauffage) ; au-delà de
+# INIT_MAX_ATTEMPTS tentatives (0: sans limite), le processus s'arrête pour être redémarré
+INIT_MAX_ATTEMPTS = int(os.getenv("INIT_MAX_ATTEMPTS", "0"))
+INIT_BACKOFF_BASE = float(os.getenv("INIT_BACKOFF_BASE", "1.0"))
+INIT_BACKOFF_MAX = float(os.getenv("INIT_BACKOFF_MAX", "30.0"))
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "false").lower() == "true"
+
+# Caches partagés entre les workers (embeddings et résultats de recherche)
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "50000"))
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "1000"))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "60"))
+
+embedding_cache = SharedCache("embeddings", maxsize=EMBEDDING_CACHE_SIZE)
+search_cache = SharedCache("search", maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL)
+
+# Journal persistant des indexations et de leurs points de reprise
+JOB_WAIT_TIMEOUT = float(os.getenv("JOB_WAIT_TIMEOUT", "600"))
+
+job_store = JobStore("vector-engine")
+maintenance_task: Optional[asyncio.Task] = None
+resumed_jobs = set()
+
+def point_id(item_id: str) -> str:
+    """
+    Dérive l'identifiant de point Qdrant d'un élément.
+    
+    L'identifiant est stable : réindexer le même élément remplace le point
+    existant au lieu de créer un doublon.
+    
+    Args:
+        item_id: Identifiant de l'élément (bloc de texte, image, métadonnées)
+        
+    Returns:
+        Un UUID accepté par Qdrant
+    """
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, item_id))
+
+def content_id(prefix: str, document_id: str, page: Any, content: str) -> str:
+    """
+    Identifiant par défaut d'un élément sans identifiant, dérivé de sa page et de son contenu.
+    
+    Deux appels qui envoient des éléments différents du même document (indexation
+    page par page) n'écrasent pas leurs points ; le même élément renvoyé retrouve le sien.
+    
+    Args:
+        prefix: Type d'élément ("txt" ou "img")
+        document_id: Identifiant du document
+        page: Page de l'élément (None si inconnue)
+        content: Texte du bloc, ou chemin de l'image
+        
+    Returns:
+        L'identifiant
+    """
+    digest = hashlib.sha256(json.dumps([page, content]).encode("utf-8")).hexdigest()[:24]
+    return f"{prefix}-{document_id}-{digest}"
+
+def batch_checkpoint_key(kind: str, item_ids: List[str], contents: List[Any]) -> str:
+    """
+    Construit la clé du point de reprise d'un lot indexé.
+    
+    Args:
+        kind: Type des éléments ("text" ou "image")
+        item_ids: Identifiants des éléments du lot
+        contents: Contenu vectorisé de chaque élément
+        
+    Returns:
+        La clé, qui change si le contenu ou le modèle change
+    """
+    digest = hashlib.sha256(json.dumps([VOYAGE_TEXT_MODEL, item_ids, contents]).encode("utf-8")).hexdigest()
+    return f"{kind}:{digest}"
+
 # Modèles de données
 class TextBlock(BaseModel):
     text: str = Field(..., description="Texte du bloc")
@@ -61,6 +166,9 @@ class ProcessRequest(BaseModel):
     images: List[Dict[str, Any]] = Field([], description="Images à traiter")
     metadata: Optional[Dict[str, Any]] = Field({}, description="Métadonnées du document")
 
+class RetirePagesRequest(BaseModel):
+    pages: List[int] = Field(..., description="Numéros des pages dont les vecteurs sont retirés")
+
 class SearchQuery(BaseModel):
     query: str = Field(..., description="Requête de recherche")
     documentId: Optional[str] = Field(None, description="Filtrer par document spécifique")
@@ -85,8 +193,58 @@ class VectorEngineService:
         self.collection_name = collection_name
         self.vector_size = vector_size
         
-        # Assurer que la collection existe
-        self._ensure_collection_exists()
+        # Client HTTP partagé pour réutiliser les connexions vers VoyageAI
+        self.http_client = httpx.AsyncClient(timeout=VOYAGE_TIMEOUT)
+    
+    async def aclose(self):
+        """Ferme les connexions ouvertes par le service."""
+        await self.http_client.aclose()
+    
+    async def warm_up(self) -> Dict[str, Any]:
+        """
+        Préchauffe le service avant de le déclarer prêt.
+        
+        Ouvre les connexions vers Qdrant et VoyageAI en exécutant un embedding
+        et une recherche synthétiques. Les échecs sont rapportés mais ne
+        bloquent pas la mise en service.
+        
+        Returns:
+            Durée et statut de chaque étape du préchauffage
+        """
+        steps = {}
+        
+        start = time.time()
+        try:
+            await asyncio.to_thread(self.qdrant_client.get_collection, self.collection_name)
+            steps["qdrant"] = {"success": True, "duration": time.time() - start}
+        except Exception as e:
+            steps["qdrant"] = {"success": False, "duration": time.time() - start, "error": str(e)}
+        
+        if not VOYAGE_API_KEY:
+            steps["embedding"] = {"success": False, "error": "Clé API VoyageAI non configurée"}
+            return steps
+        
+        start = time.time()
+        try:
+            query_vector = await self.create_text_embedding("préchauffage TechnicIA")
+            steps["embedding"] = {"success": True, "duration": time.time() - start}
+        except Exception as e:
+            steps["embedding"] = {"success": False, "duration": time.time() - start, "error": str(e)}
+            return steps
+        
+        start = time.time()
+        try:
+            await asyncio.to_thread(
+                self.qdrant_client.search,
+                collection_name=self.collection_name,
+                query_vector=query_vector,
+                limit=1
+            )
+            steps["search"] = {"success": True, "duration": time.time() - start}
+        except Exception as e:
+            steps["search"] = {"success": False, "duration": time.time() - start, "error": str(e)}
+        
+        return steps
     
     def _ensure_collection_exists(self):
         """Crée la collection si elle n'existe pas déjà."""
@@ -118,37 +276,74 @@ class VectorEngineService:
         Returns:
             Vecteur d'embedding
         """
+        embeddings = await self.create_text_embeddings([text])
+        return embeddings[0]
+    
+    async def create_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """
+        Crée les embeddings d'une liste de textes en un seul appel à VoyageAI.
+        
+        Les textes déjà vectorisés sont servis par le cache ; seuls les autres
+        sont envoyés à l'API.
+        
+        Args:
+            texts: Textes à vectoriser
+            
+        Returns:
+            Vecteurs d'embedding, dans l'ordre des textes
+        """
         if not VOYAGE_API_KEY:
             raise HTTPException(
                 status_code=500,
                 detail="Clé API VoyageAI non configurée"
             )
         
+        embeddings: List[Optional[List[float]]] = []
+        missing = []
+        for index, text in enumerate(texts):
+            cached = embedding_cache.get(f"{VOYAGE_TEXT_MODEL}:search_document:{text}")
+            embeddings.append(cached)
+            if cached is None:
+                missing.append(index)
+        
+        if not missing:
+            return embeddings
+        
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{VOYAGE_BASE_URL}/embeddings",
-                    headers={
-                        "Authorization": f"Bearer {VOYAGE_API_KEY}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": VOYAGE_TEXT_MODEL,
-                        "input": text,
-                        "input_type": "search_document"
-                    },
-                    timeout=30.0
+            # Délai borné par le budget de la requête, appel lent doublé (l'embedding est idempotent)
+            response = await voyage_policy.run(lambda timeout: self.http_client.post(
+                f"{VOYAGE_BASE_URL}/embeddings",
+                headers={
+                    "Authorization": f"Bearer {VOYAGE_API_KEY}",
+                    "Content-Type": "application/json"
+                },
+                json={
+                    "model": VOYAGE_TEXT_MODEL,
+                    "input": [texts[index] for index in missing],
+                    "input_type": "search_document"
+                },
+                timeout=timeout
+            ))
+            
+            if response.status_code != 200:
+                logger.error(f"Erreur API VoyageAI: {response.text}")
+                raise HTTPException(
+                    status_code=response.status_code,
+                    detail=f"Erreur API VoyageAI: {response.text}"
                 )
-                
-                if response.status_code != 200:
-                    logger.error(f"Erreur API VoyageAI: {response.text}")
-                    raise HTTPException(
-                        status_code=response.status_code,
-                        detail=f"Erreur API VoyageAI: {response.text}"
-                    )
-                
-                data = response.json()
-                return data["data"][0]["embedding"]
+            
+            data = response.json()
+            for item in data["data"]:
+                index = missing[item["index"]]
+                embeddings[index] = item["embedding"]
+                embedding_cache.set(f"{VOYAGE_TEXT_MODEL}:search_document:{texts[index]}", item["embedding"])
+            return embeddings
+        except CallDeadlineExceeded as e:
+            logger.error(f"Délai dépassé lors de l'appel à VoyageAI: {str(e)}")
+            raise HTTPException(
+                status_code=504,
+                detail=f"Délai dépassé lors de l'appel à VoyageAI: {str(e)}"
+            )
         except Exception as e:
             logger.error(f"Erreur lors de la création de l'embedding texte: {str(e)}")
             raise
@@ -214,74 +409,95 @@ class VectorEngineService:
             logger.error(f"Erreur lors de la création de l'embedding image: {str(e)}")
             raise
     
-    async def process_text_blocks(self, document_id: str, text_blocks: List[Dict[str, Any]]) -> List[str]:
+    async def process_text_blocks(self, document_id: str, text_blocks: List[Dict[str, Any]],
+                                  checkpoints: Optional[Checkpoints] = None) -> Tuple[List[str], int]:
         """
-        Traite et indexe des blocs de texte.
+        Traite et indexe des blocs de texte, par lots.
+        
+        Chaque lot indexé est enregistré dans les points de reprise : à la
+        reprise d'une indexation interrompue, il n'est ni revectorisé ni
+        réinséré.
         
         Args:
             document_id: Identifiant du document
             text_blocks: Liste des blocs de texte
+            checkpoints: Points de reprise du job d'indexation
             
         Returns:
-            Liste des identifiants générés
+            Liste des identifiants générés et nombre de lots repris
         """
         ids = []
-        points = []
+        skipped_batches = 0
         
-        for block in text_blocks:
-            # Extraire le texte et autres informations
-            text = block.get("text", "")
-            if not text.strip():
-                continue
-            
-            # Générer un identifiant unique
-            block_id = block.get("id") or f"txt-{document_id}-{str(uuid.uuid4())}"
-            ids.append(block_id)
+        # Les identifiants par défaut dépendent de la page et du texte du bloc: ils sont stables d'un essai à l'autre
+        blocks = [
+            (block.get("id") or content_id("txt", document_id, block.get("page"), block["text"]), block)
+            for block in text_blocks
+            if block.get("text", "").strip()
+        ]
+        
+        for start in range(0, len(blocks), EMBEDDING_BATCH_SIZE):
+            batch = blocks[start:start + EMBEDDING_BATCH_SIZE]
+            batch_ids = [block_id for block_id, _ in batch]
+            texts = [block["text"] for _, block in batch]
             
-            # Créer l'embedding
-            embedding = await self.create_text_embedding(text)
+            checkpoint_key = batch_checkpoint_key("text", batch_ids, texts)
+            if checkpoints is not None and await asyncio.to_thread(checkpoints.get, checkpoint_key) is not None:
+                ids.extend(batch_ids)
+                skipped_batches += 1
+                continue
             
-            # Préparer les métadonnées
-            metadata = {
-                "type": "text",
-                "documentId": document_id,
-                "text": text,
-                "page": block.get("page"),
-                "confidence": block.get("confidence")
-            }
+            # Créer les embeddings du lot en un seul appel
+            embeddings = await self.create_text_embeddings(texts)
             
-            # Créer le point Qdrant
-            point = models.PointStruct(
-                id=block_id,
-                vector=embedding,
-                payload=metadata
-            )
+            points = []
+            for (block_id, block), embedding in zip(batch, embeddings):
+                # Préparer les métadonnées
+                metadata = {
+                    "type": "text",
+                    "itemId": block_id,
+                    "documentId": document_id,
+                    "text": block["text"],
+                    "page": block.get("page"),
+                    "confidence": block.get("confidence")
+                }
+                
+                points.append(models.PointStruct(
+                    id=point_id(block_id),
+                    vector=embedding,
+                    payload=metadata
+                ))
             
-            points.append(point)
-        
-        # Insérer les points dans Qdrant
-        if points:
-            self.qdrant_client.upsert(
+            # Insérer les points du lot dans Qdrant
+            await asyncio.to_thread(
+                self.qdrant_client.upsert,
                 collection_name=self.collection_name,
                 points=points
             )
+            
+            if checkpoints is not None:
+                await asyncio.to_thread(checkpoints.put, checkpoint_key, batch_ids)
+            ids.extend(batch_ids)
         
-        return ids
+        return ids, skipped_batches
     
-    async def process_images(self, document_id: str, images: List[Dict[str, Any]]) -> List[str]:
+    async def process_images(self, document_id: str, images: List[Dict[str, Any]],
+                             checkpoints: Optional[Checkpoints] = None) -> Tuple[List[str], int]:
         """
-        Traite et indexe des images.
+        Traite et indexe des images, par lots.
         
         Args:
             document_id: Identifiant du document
             images: Liste des informations d'images
+            checkpoints: Points de reprise du job d'indexation
             
         Returns:
-            Liste des identifiants générés
+            Liste des identifiants générés et nombre de lots repris
         """
         ids = []
-        points = []
+        skipped_batches = 0
         
+        selected = []
         for image in images:
             # Vérifier le type de classification
             classification = image.get("classification")
@@ -290,46 +506,62 @@ class VectorEngineService:
                 continue
             
             # Récupérer le chemin de l'image
-            image_path = image.get("path")
-            if not image_path:
+            if not image.get("path"):
                 logger.warning(f"Chemin d'image manquant: {image}")
                 continue
             
-            # Utiliser l'ID existant ou en générer un nouveau
-            image_id = image.get("id") or f"img-{document_id}-{str(uuid.uuid4())}"
-            ids.append(image_id)
-            
-            # Créer l'embedding
-            embedding = await self.create_image_embedding(image_path)
+            # Utiliser l'ID existant ou un identifiant stable dérivé de la page et de l'image
+            image_id = image.get("id") or content_id("img", document_id, image.get("page"),
+                                                     image.get("sha256") or image["path"])
+            selected.append((image_id, image))
+        
+        for start in range(0, len(selected), EMBEDDING_BATCH_SIZE):
+            batch = selected[start:start + EMBEDDING_BATCH_SIZE]
+            batch_ids = [image_id for image_id, _ in batch]
             
-            # Préparer les métadonnées
-            metadata = {
-                "type": "image",
-                "documentId": document_id,
-                "path": image_path,
-                "page": image.get("page"),
-                "schemaType": image.get("schemaType"),
-                "ocrText": image.get("ocrText"),
-                "classification": classification
-            }
+            checkpoint_key = batch_checkpoint_key("image", batch_ids, [image["path"] for _, image in batch])
+            if checkpoints is not None and await asyncio.to_thread(checkpoints.get, checkpoint_key) is not None:
+                ids.extend(batch_ids)
+                skipped_batches += 1
+                continue
             
-            # Créer le point Qdrant
-            point = models.PointStruct(
-                id=image_id,
-                vector=embedding,
-                payload=metadata
-            )
+            points = []
+            for image_id, image in batch:
+                # Créer l'embedding
+                embedding = await self.create_image_embedding(image["path"])
+                
+                # Préparer les métadonnées
+                metadata = {
+                    "type": "image",
+                    "itemId": image_id,
+                    "documentId": document_id,
+                    "path": image["path"],
+                    "page": image.get("page"),
+                    # Toutes les pages où figure l'image, pour le retrait par page
+                    "pages": image.get("pages") or [image.get("page")],
+                    "schemaType": image.get("schemaType"),
+                    "ocrText": image.get("ocrText"),
+                    "classification": image.get("classification")
+                }
+                
+                points.append(models.PointStruct(
+                    id=point_id(image_id),
+                    vector=embedding,
+                    payload=metadata
+                ))
             
-            points.append(point)
-        
-        # Insérer les points dans Qdrant
-        if points:
-            self.qdrant_client.upsert(
+            # Insérer les points du lot dans Qdrant
+            await asyncio.to_thread(
+                self.qdrant_client.upsert,
                 collection_name=self.collection_name,
                 points=points
             )
+            
+            if checkpoints is not None:
+                await asyncio.to_thread(checkpoints.put, checkpoint_key, batch_ids)
+            ids.extend(batch_ids)
         
-        return ids
+        return ids, skipped_batches
     
     async def search(self, query: str, limit: int = 5, document_id: Optional[str] = None, 
                      include_images: bool = True, include_text: bool = True) -> List[Dict[str, Any]]:
@@ -346,6 +578,11 @@ class VectorEngineService:
         Returns:
             Liste des résultats
         """
+        cache_key = json.dumps([query, limit, document_id, include_images, include_text])
+        cached = search_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
         # Créer l'embedding de la requête
         query_vector = await self.create_text_embedding(query)
         
@@ -387,7 +624,7 @@ class VectorEngineService:
             result_type = payload.get("type")
             
             formatted_result = {
-                "id": result.id,
+                "id": payload.get("itemId", result.id),
                 "score": result.score,
                 "type": result_type,
                 "documentId": payload.get("documentId")
@@ -404,6 +641,7 @@ class VectorEngineService:
             
             results.append(formatted_result)
         
+        search_cache.set(cache_key, results)
         return results
     
     async def get_document_status(self, document_id: str) -> Dict[str, Any]:
@@ -459,28 +697,182 @@ class VectorEngineService:
             "totalCount": text_count + image_count,
             "indexedAt": time.time()
         }
+    
+    def retire_pages(self, document_id: str, pages: List[int]) -> Dict[str, Any]:
+        """
+        Retire de l'index les vecteurs de pages d'un document (pages modifiées ou supprimées).
+        
+        Les blocs de texte des pages sont supprimés. Une image n'est supprimée que
+        si toutes les pages où elle figure sont retirées ; les autres sont
+        conservées et signalées, pour ne pas être analysées à nouveau.
+        
+        Args:
+            document_id: Identifiant du document
+            pages: Numéros des pages à retirer
+            
+        Returns:
+            Le nombre de points retirés et les identifiants des images conservées
+        """
+        text_filter = models.Filter(
+            must=[
+                models.FieldCondition(key="documentId", match=models.MatchValue(value=document_id)),
+                models.FieldCondition(key="type", match=models.MatchValue(value="text")),
+                models.FieldCondition(key="page", match=models.MatchAny(any=pages))
+            ]
+        )
+        retired_text = self.qdrant_client.count(
+            collection_name=self.collection_name,
+            count_filter=text_filter
+        ).count
+        self.qdrant_client.delete(
+            collection_name=self.collection_name,
+            points_selector=models.FilterSelector(filter=text_filter)
+        )
+        
+        # Images touchant au moins une des pages (page principale ou liste des pages)
+        image_filter = models.Filter(
+            must=[
+                models.FieldCondition(key="documentId", match=models.MatchValue(value=document_id)),
+                models.FieldCondition(key="type", match=models.MatchValue(value="image"))
+            ],
+            should=[
+                models.FieldCondition(key="page", match=models.MatchAny(any=pages)),
+                models.FieldCondition(key="pages", match=models.MatchAny(any=pages))
+            ]
+        )
+        retired_pages = set(pages)
+        retired_images = []
+        kept_images = []
+        offset = None
+        while True:
+            points, offset = self.qdrant_client.scroll(
+                collection_name=self.collection_name,
+                scroll_filter=image_filter,
+                limit=256,
+                offset=offset,
+                with_payload=True,
+                with_vectors=False
+            )
+            for point in points:
+                image_pages = set(point.payload.get("pages") or [point.payload.get("page")])
+                if image_pages <= retired_pages:
+                    retired_images.append(point.id)
+                else:
+                    kept_images.append(point.payload.get("itemId", point.id))
+            if offset is None:
+                break
+        
+        if retired_images:
+            self.qdrant_client.delete(
+                collection_name=self.collection_name,
+                points_selector=models.PointIdsList(points=retired_images)
+            )
+        
+        return {
+            "retiredTextPoints": retired_text,
+            "retiredImages": len(retired_images),
+            "keptImages": kept_images
+        }
 
-# Créer une instance du service
-vector_engine = VectorEngineService(
-    qdrant_host=QDRANT_HOST,
-    qdrant_port=QDRANT_PORT,
-    collection_name=COLLECTION_NAME,
-    vector_size=VECTOR_SIZE
-)
+# Instance du service, créée au démarrage par initialize_service()
+vector_engine: Optional[VectorEngineService] = None
+
+# État de l'initialisation, exposé par /health
+service_state = {
+    "status": "starting",
+    "attempts": 0,
+    "error": None,
+    "ready_since": None,
+    "warmup": None
+}
+
+async def initialize_service():
+    """
+    Crée le service en réessayant avec un backoff exponentiel tant que
+    Qdrant n'est pas joignable, puis exécute le préchauffage optionnel.
+    """
+    global vector_engine, maintenance_task
+    
+    attempt = 0
+    while True:
+        attempt += 1
+        service_state["attempts"] = attempt
+        service = VectorEngineService(
+            qdrant_host=QDRANT_HOST,
+            qdrant_port=QDRANT_PORT,
+            collection_name=COLLECTION_NAME,
+            vector_size=VECTOR_SIZE
+        )
+        try:
+            await asyncio.to_thread(service._ensure_collection_exists)
+            
+            if WARMUP_ENABLED:
+                service_state["status"] = "warming_up"
+                service_state["warmup"] = await service.warm_up()
+            
+            vector_engine = service
+            service_state.update(status="ready", error=None, ready_since=time.time())
+            logger.info(f"Service prêt après {attempt} tentative(s)")
+            
+            # Reprise des indexations interrompues par un redémarrage
+            maintenance_task = asyncio.create_task(job_store.maintain(resume_index_job, kind="index"))
+            return
+        except asyncio.CancelledError:
+            await service.aclose()
+            raise
+        except Exception as e:
+            await service.aclose()
+            service_state.update(status="retrying", error=str(e))
+            if attempt == INIT_MAX_ATTEMPTS:
+                # Arrêt du processus pour que l'orchestrateur le redémarre, au lieu de répondre 503 indéfiniment
+                logger.error(f"Initialisation abandonnée après {attempt} tentatives, arrêt du processus: {str(e)}")
+                os._exit(1)
+            delay = min(INIT_BACKOFF_MAX, INIT_BACKOFF_BASE * 2 ** min(attempt - 1, 16))
+            delay *= random.uniform(0.5, 1.0)
+            logger.warning(f"Initialisation échouée (tentative {attempt}), "
+                           f"nouvel essai dans {delay:.1f}s: {str(e)}")
+            await asyncio.sleep(delay)
+
+def get_vector_engine() -> VectorEngineService:
+    """Dépendance FastAPI qui refuse les requêtes tant que le service n'est pas prêt."""
+    if vector_engine is None:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Service non disponible (état: {service_state['status']})"
+        )
+    return vector_engine
 
 @app.get("/health")
 async def health_check():
     """Vérification de l'état du service."""
+    if vector_engine is None:
+        return JSONResponse(
+            status_code=503,
+            content={
+                "status": service_state["status"],
+                "attempts": service_state["attempts"],
+                "error": service_state["error"]
+            }
+        )
+    
     try:
         # Vérifier que Qdrant est accessible
-        collections = vector_engine.qdrant_client.get_collections()
+        collections = await asyncio.to_thread(vector_engine.qdrant_client.get_collections)
         collection_exists = COLLECTION_NAME in [c.name for c in collections.collections]
         
         return {
             "status": "healthy",
             "qdrant_connected": True,
             "collection_exists": collection_exists,
-            "voyage_api_configured": bool(VOYAGE_API_KEY)
+            "voyage_api_configured": bool(VOYAGE_API_KEY),
+            "ready_since": service_state["ready_since"],
+            "warmup": service_state["warmup"],
+            "caches": {
+                "embeddings": embedding_cache.stats(),
+                "search": search_cache.stats()
+            },
+            "voyage_calls": voyage_policy.stats(),
+            "jobs": job_store.stats()
         }
     except Exception as e:
         logger.error(f"Erreur de santé: {str(e)}")
@@ -489,35 +881,54 @@ async def health_check():
             content={"status": "error", "message": str(e)}
         )
 
-@app.post("/api/process")
-async def process_document(request: ProcessRequest):
+def index_job_id(request: ProcessRequest) -> str:
     """
-    Traite et indexe le contenu d'un document.
+    Dérive l'identifiant du job d'indexation du contenu de la requête.
+    
+    Une nouvelle tentative de l'appelant avec le même contenu retrouve ainsi
+    le job précédent et ses points de reprise.
+    
+    Args:
+        request: Informations sur le document à traiter
+        
+    Returns:
+        L'identifiant du job
+    """
+    content = json.dumps([VOYAGE_TEXT_MODEL, request.model_dump()], sort_keys=True)
+    return f"index-{request.documentId}-{hashlib.sha256(content.encode('utf-8')).hexdigest()[:24]}"
+
+async def run_index_job(vector_engine: VectorEngineService, job_id: str, request: ProcessRequest) -> Dict[str, Any]:
+    """
+    Indexe le contenu d'un document sous le contrôle du journal des jobs.
     
     Args:
+        vector_engine: Service de vectorisation
+        job_id: Identifiant du job, dont ce processus est propriétaire
         request: Informations sur le document à traiter
         
     Returns:
         Résultats du traitement
     """
+    checkpoints = job_store.checkpoints(job_id)
+    
     try:
-        logger.info(f"Traitement du document: {request.documentId}")
-        
         # Traiter les blocs de texte
-        text_ids = await vector_engine.process_text_blocks(
+        text_ids, skipped_text_batches = await vector_engine.process_text_blocks(
             document_id=request.documentId,
-            text_blocks=request.textBlocks
+            text_blocks=request.textBlocks,
+            checkpoints=checkpoints
         )
         
         # Traiter les images
-        image_ids = await vector_engine.process_images(
+        image_ids, skipped_image_batches = await vector_engine.process_images(
             document_id=request.documentId,
-            images=request.images
+            images=request.images,
+            checkpoints=checkpoints
         )
         
         # Indexer les métadonnées du document
         if request.metadata:
-            # Générer un identifiant unique pour les métadonnées
+            # Identifiant stable des métadonnées
             metadata_id = f"meta-{request.documentId}"
             
             # Créer un embedding à partir d'une description du document
@@ -527,38 +938,138 @@ async def process_document(request: ProcessRequest):
             # Préparer les métadonnées
             metadata_payload = {
                 "type": "metadata",
+                "itemId": metadata_id,
                 "documentId": request.documentId,
                 **request.metadata
             }
             
             # Créer le point Qdrant
             metadata_point = models.PointStruct(
-                id=metadata_id,
+                id=point_id(metadata_id),
                 vector=metadata_embedding,
                 payload=metadata_payload
             )
             
             # Insérer le point dans Qdrant
-            vector_engine.qdrant_client.upsert(
+            await asyncio.to_thread(
+                vector_engine.qdrant_client.upsert,
                 collection_name=vector_engine.collection_name,
                 points=[metadata_point]
             )
         
-        return {
-            "success": True,
-            "documentId": request.documentId,
-            "stats": {
-                "totalTextBlocks": len(request.textBlocks),
-                "indexedTextBlocks": len(text_ids),
-                "totalImages": len(request.images),
-                "indexedImages": len(image_ids),
-                "chunksCount": len(text_ids) + len(image_ids),
-                "indexedCount": len(text_ids) + len(image_ids)
-            },
-            "searchEndpoint": "/api/search",
-            "processingTimestamp": time.time()
-        }
+        # Les résultats de recherche en cache ne reflètent plus l'index
+        search_cache.clear()
+    except Exception as e:
+        await asyncio.to_thread(job_store.fail, job_id, getattr(e, "detail", None) or str(e))
+        raise
+    
+    result = {
+        "success": True,
+        "documentId": request.documentId,
+        "jobId": job_id,
+        "stats": {
+            "totalTextBlocks": len(request.textBlocks),
+            "indexedTextBlocks": len(text_ids),
+            "totalImages": len(request.images),
+            "indexedImages": len(image_ids),
+            "chunksCount": len(text_ids) + len(image_ids),
+            "indexedCount": len(text_ids) + len(image_ids),
+            "skippedBatches": skipped_text_batches + skipped_image_batches
+        },
+        "searchEndpoint": "/api/search",
+        "processingTimestamp": time.time()
+    }
+    
+    await asyncio.to_thread(job_store.finish, job_id, result)
+    return result
+
+async def resume_index_job(job: Dict[str, Any]):
+    """
+    Reprend en arrière-plan une indexation interrompue par un redémarrage.
+    
+    Args:
+        job: Le job repris, tel qu'enregistré dans le journal
+    """
+    request = ProcessRequest(**job["payload"]["request"])
+    
+    async def resume():
+        try:
+            result = await run_index_job(vector_engine, job["job_id"], request)
+            logger.info(f"Job {job['job_id']} repris et terminé ({result['stats']['skippedBatches']} lot(s) sautés)")
+        except Exception as e:
+            logger.error(f"Échec de la reprise du job {job['job_id']}: {str(e)}")
+    
+    # Conserver une référence jusqu'à la fin de la reprise
+    task = asyncio.create_task(resume())
+    resumed_jobs.add(task)
+    task.add_done_callback(resumed_jobs.discard)
+
+async def wait_for_job(job_id: str, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Attend la fin d'un job exécuté par un autre processus.
+    
+    Args:
+        job_id: Identifiant du job
+        payload: Requête du job, pour le recréer s'il a été oublié pendant l'attente
+        
+    Returns:
+        Le job terminé, ou None si ce processus en a pris la main (job oublié ou propriétaire disparu)
+    """
+    deadline = time.time() + JOB_WAIT_TIMEOUT
+    while time.time() < deadline:
+        job = await asyncio.to_thread(job_store.get, job_id)
+        if job is None:
+            # Job oublié pendant l'attente (pages retirées, purge): l'indexation est à refaire
+            await asyncio.to_thread(job_store.create, job_id, "index", payload)
+        elif job["status"] in ("completed", "error"):
+            return job
+        if await asyncio.to_thread(job_store.claim, job_id):
+            return None
+        await asyncio.sleep(1.0)
+    
+    raise HTTPException(
+        status_code=504,
+        detail=f"L'indexation {job_id} est toujours en cours"
+    )
+
+@app.post("/api/process")
+async def process_document(request: ProcessRequest, vector_engine: VectorEngineService = Depends(get_vector_engine)):
+    """
+    Traite et indexe le contenu d'un document.
+    
+    Une requête identique à une indexation déjà terminée est servie depuis le
+    journal ; une indexation interrompue reprend après son dernier lot indexé.
+    
+    Args:
+        request: Informations sur le document à traiter
+        
+    Returns:
+        Résultats du traitement
+    """
+    try:
+        logger.info(f"Traitement du document: {request.documentId}")
+        
+        job_id = index_job_id(request)
+        payload = {"request": request.model_dump()}
+        job = await asyncio.to_thread(job_store.create, job_id, "index", payload)
+        
+        if job["status"] != "completed":
+            if await asyncio.to_thread(job_store.claim, job_id):
+                return await run_index_job(vector_engine, job_id, request)
+            
+            # Le même contenu est en cours d'indexation par un autre processus
+            logger.info(f"Indexation {job_id} déjà en cours, attente de sa fin")
+            job = await wait_for_job(job_id, payload)
+            if job is None:
+                return await run_index_job(vector_engine, job_id, request)
+            if job["status"] == "error":
+                raise HTTPException(status_code=500, detail=job["error"])
         
+        logger.info(f"Indexation {job_id} déjà terminée")
+        return job["result"]
+        
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Erreur lors du traitement du document: {str(e)}")
         raise HTTPException(
@@ -567,7 +1078,7 @@ async def process_document(request: ProcessRequest):
         )
 
 @app.post("/api/search")
-async def search(query: SearchQuery):
+async def search(query: SearchQuery, vector_engine: VectorEngineService = Depends(get_vector_engine)):
     """
     Recherche des éléments similaires à la requête.
     
@@ -604,7 +1115,7 @@ async def search(query: SearchQuery):
         )
 
 @app.get("/api/document/{document_id}/status")
-async def get_document_status(document_id: str):
+async def get_document_status(document_id: str, vector_engine: VectorEngineService = Depends(get_vector_engine)):
     """
     Récupère l'état d'indexation d'un document.
     
@@ -633,6 +1144,49 @@ async def get_document_status(document_id: str):
             detail=f"Erreur lors de la récupération du statut: {str(e)}"
         )
 
+@app.post("/api/document/{document_id}/retire-pages")
+async def retire_document_pages(document_id: str, request: RetirePagesRequest,
+                                vector_engine: VectorEngineService = Depends(get_vector_engine)):
+    """
+    Retire les vecteurs de pages d'un document avant l'indexation d'une nouvelle révision.
+    
+    Les indexations terminées du document sont aussi oubliées : sans cela, un
+    lot identique à un lot déjà indexé serait servi depuis le journal sans
+    recréer les points retirés.
+    
+    Args:
+        document_id: Identifiant du document
+        request: Pages à retirer
+        
+    Returns:
+        Le nombre de points retirés et les identifiants des images conservées
+    """
+    try:
+        logger.info(f"Retrait de {len(request.pages)} page(s) du document {document_id}")
+        
+        result = await asyncio.to_thread(vector_engine.retire_pages, document_id, request.pages)
+        forgotten_jobs = await asyncio.to_thread(job_store.forget, "index", f"index-{document_id}-")
+        
+        # Les résultats de recherche en cache ne reflètent plus l'index
+        search_cache.clear()
+        
+        return {
+            "success": True,
+            "documentId": document_id,
+            **result,
+            "forgottenJobs": forgotten_jobs,
+            "timestamp": time.time()
+        }
+        
+    except Exception as e:
+        logger.error(f"Erreur lors du retrait des pages: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Erreur lors du retrait des pages: {str(e)}"
+        )
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8003, reload=True)
+    # WEB_CONCURRENCY > 1 active le mode production multi-workers (sans rechargement)
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    uvicorn.run("main:app", host="0.0.0.0", port=8003, reload=workers == 1, workers=workers)
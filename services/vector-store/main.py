@@ -2,17 +2,23 @@
 Service de gestion des embeddings et interface avec Qdrant pour TechnicIA.
 Utilise VoyageAI pour la génération d'embeddings et Qdrant pour le stockage et la recherche vectorielle.
 """
-from fastapi import FastAPI, HTTPException, Body
+from fastapi import FastAPI, HTTPException, Body, Depends
 from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
+import asyncio
 import httpx
 import os
 import logging
 import json
+import random
+import time
 import uuid
 from typing import Dict, List, Any, Optional
 from pydantic import BaseModel, Field
 from qdrant_client import QdrantClient
 from qdrant_client.http import models
+from call_policy import CallDeadlineExceeded, CallPolicy, RequestBudgetMiddleware
+from shared_cache import SharedCache
 
 # Configuration du logging
 logging.basicConfig(
@@ -21,13 +27,26 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Lance l'initialisation en arrière-plan et libère les ressources à l'arrêt."""
+    init_task = asyncio.create_task(initialize_service())
+    yield
+    init_task.cancel()
+    if vector_store is not None:
+        await vector_store.aclose()
+
 # Configuration de l'application
 app = FastAPI(
     title="Vector Store Service",
     description="Service de gestion des embeddings et interface avec Qdrant pour TechnicIA",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# Échéance de chaque requête (en-tête X-Request-Budget), appliquée aux appels VoyageAI
+app.add_middleware(RequestBudgetMiddleware)
+
 # Configuration Qdrant
 QDRANT_HOST = os.getenv("QDRANT_HOST", "qdrant")
 QDRANT_PORT = int(os.getenv("QDRANT_PORT", "6333"))
@@ -41,6 +60,27 @@ VOYAGE_BASE_URL = "https://api.voyageai.com/v1"
 # Modèle utilisé pour les embeddings texte
 VOYAGE_TEXT_MODEL = "voyage-large-2"
 
+# Délai maximum d'un appel à VoyageAI (secondes), borné par le budget de la requête, et
+# doublement des appels lents (désactivé par défaut: chaque appel est facturé)
+VOYAGE_TIMEOUT = float(os.getenv("VOYAGE_TIMEOUT", "30"))
+VOYAGE_HEDGE = os.getenv("VOYAGE_HEDGE", "false").lower() == "true"
+voyage_policy = CallPolicy("voyageai", VOYAGE_TIMEOUT, hedge=VOYAGE_HEDGE)
+
+# Configuration de l'initialisation (tentatives, backoff et préchauffage) ; au-delà de
+# INIT_MAX_ATTEMPTS tentatives (0: sans limite), le processus s'arrête pour être redémarré
+INIT_MAX_ATTEMPTS = int(os.getenv("INIT_MAX_ATTEMPTS", "0"))
+INIT_BACKOFF_BASE = float(os.getenv("INIT_BACKOFF_BASE", "1.0"))
+INIT_BACKOFF_MAX = float(os.getenv("INIT_BACKOFF_MAX", "30.0"))
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "false").lower() == "true"
+
+# Caches partagés entre les workers (embeddings et résultats de recherche)
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "50000"))
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "1000"))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "60"))
+
+embedding_cache = SharedCache("embeddings", maxsize=EMBEDDING_CACHE_SIZE)
+search_cache = SharedCache("search", maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL)
+
 # Modèles Pydantic pour la validation des données
 class TextItem(BaseModel):
     text: str = Field(..., description="Texte à vectoriser")
@@ -77,8 +117,66 @@ class VectorStoreService:
         self.collection_name = collection_name
         self.vector_size = vector_size
 
-        # Vérifier et créer la collection si nécessaire
-        self._ensure_collection_exists()
+        # Client HTTP partagé pour réutiliser les connexions vers VoyageAI
+        self.http_client = httpx.AsyncClient(timeout=VOYAGE_TIMEOUT)
+
+    async def _post_embeddings(self, payload: Dict[str, Any]) -> httpx.Response:
+        """
+        Appelle l'API d'embeddings de VoyageAI (délai borné par le budget de la requête, appel lent doublé).
+        
+        Args:
+            payload: Corps de la requête
+            
+        Returns:
+            La réponse HTTP de VoyageAI
+        """
+        return await voyage_policy.run(lambda timeout: self.http_client.post(
+            f"{VOYAGE_BASE_URL}/embeddings",
+            headers={
+                "Authorization": f"Bearer {VOYAGE_API_KEY}",
+                "Content-Type": "application/json"
+            },
+            json=payload,
+            timeout=timeout
+        ))
+
+    async def aclose(self):
+        """Ferme les connexions ouvertes par le service."""
+        await self.http_client.aclose()
+
+    async def warm_up(self) -> Dict[str, Any]:
+        """
+        Préchauffe le service avant de le déclarer prêt.
+        
+        Ouvre les connexions vers Qdrant et VoyageAI en exécutant un embedding
+        et une recherche synthétiques. Les échecs sont rapportés mais ne
+        bloquent pas la mise en service.
+        
+        Returns:
+            Durée et statut de chaque étape du préchauffage
+        """
+        steps = {}
+
+        start = time.time()
+        try:
+            await asyncio.to_thread(self.qdrant_client.get_collection, self.collection_name)
+            steps["qdrant"] = {"success": True, "duration": time.time() - start}
+        except Exception as e:
+            steps["qdrant"] = {"success": False, "duration": time.time() - start, "error": str(e)}
+
+        if not VOYAGE_API_KEY:
+            steps["search"] = {"success": False, "error": "Clé API VoyageAI non configurée"}
+            return steps
+
+        # search_vectors enchaîne un embedding et une recherche Qdrant
+        start = time.time()
+        try:
+            await self.search_vectors("préchauffage TechnicIA", limit=1)
+            steps["search"] = {"success": True, "duration": time.time() - start}
+        except Exception as e:
+            steps["search"] = {"success": False, "duration": time.time() - start, "error": str(e)}
+
+        return steps
 
     def _ensure_collection_exists(self):
         """Vérifie que la collection existe et la crée si nécessaire."""
@@ -115,31 +213,35 @@ class VectorStoreService:
                 detail="Clé API VoyageAI non configurée"
             )
 
+        cache_key = f"{VOYAGE_TEXT_MODEL}:search_document:{text}"
+        cached = embedding_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{VOYAGE_BASE_URL}/embeddings",
-                    headers={
-                        "Authorization": f"Bearer {VOYAGE_API_KEY}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": VOYAGE_TEXT_MODEL,
-                        "input": text,
-                        "input_type": "search_document"
-                    },
-                    timeout=30.0
+            response = await self._post_embeddings({
+                "model": VOYAGE_TEXT_MODEL,
+                "input": text,
+                "input_type": "search_document"
+            })
+
+            if response.status_code != 200:
+                logger.error(f"Erreur API VoyageAI: {response.text}")
+                raise HTTPException(
+                    status_code=response.status_code,
+                    detail=f"Erreur API VoyageAI: {response.text}"
                 )
 
-                if response.status_code != 200:
-                    logger.error(f"Erreur API VoyageAI: {response.text}")
-                    raise HTTPException(
-                        status_code=response.status_code,
-                        detail=f"Erreur API VoyageAI: {response.text}"
-                    )
-
-                data = response.json()
-                return data["data"][0]["embedding"]
+            data = response.json()
+            embedding = data["data"][0]["embedding"]
+            embedding_cache.set(cache_key, embedding)
+            return embedding
+        except CallDeadlineExceeded as e:
+            logger.error(f"Délai dépassé lors de l'appel à VoyageAI: {str(e)}")
+            raise HTTPException(
+                status_code=504,
+                detail=f"Délai dépassé lors de l'appel à VoyageAI: {str(e)}"
+            )
         except httpx.HTTPError as e:
             logger.error(f"Erreur HTTP lors de l'appel à VoyageAI: {str(e)}")
             raise HTTPException(
@@ -170,30 +272,27 @@ class VectorStoreService:
             )
 
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{VOYAGE_BASE_URL}/embeddings",
-                    headers={
-                        "Authorization": f"Bearer {VOYAGE_API_KEY}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": "voyage-large-2",
-                        "input": image_url,
-                        "input_type": "image_url"
-                    },
-                    timeout=30.0
+            response = await self._post_embeddings({
+                "model": "voyage-large-2",
+                "input": image_url,
+                "input_type": "image_url"
+            })
+
+            if response.status_code != 200:
+                logger.error(f"Erreur API VoyageAI: {response.text}")
+                raise HTTPException(
+                    status_code=response.status_code,
+                    detail=f"Erreur API VoyageAI: {response.text}"
                 )
 
-                if response.status_code != 200:
-                    logger.error(f"Erreur API VoyageAI: {response.text}")
-                    raise HTTPException(
-                        status_code=response.status_code,
-                        detail=f"Erreur API VoyageAI: {response.text}"
-                    )
-
-                data = response.json()
-                return data["data"][0]["embedding"]
+            data = response.json()
+            return data["data"][0]["embedding"]
+        except CallDeadlineExceeded as e:
+            logger.error(f"Délai dépassé lors de l'appel à VoyageAI: {str(e)}")
+            raise HTTPException(
+                status_code=504,
+                detail=f"Délai dépassé lors de l'appel à VoyageAI: {str(e)}"
+            )
         except httpx.HTTPError as e:
             logger.error(f"Erreur HTTP lors de l'appel à VoyageAI: {str(e)}")
             raise HTTPException(
@@ -233,6 +332,9 @@ class VectorStoreService:
                 points=points
             )
 
+            # Les résultats de recherche en cache ne reflètent plus l'index
+            search_cache.clear()
+
             return {"status": "success", "operation_id": str(operation_result.operation_id)}
         except Exception as e:
             logger.error(f"Erreur lors de l'upsert des vecteurs: {str(e)}")
@@ -253,6 +355,11 @@ class VectorStoreService:
         Returns:
             Liste des résultats
         """
+        cache_key = json.dumps([query, limit, filter], sort_keys=True)
+        cached = search_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
         try:
             # Créer un embedding pour la requête
             query_vector = await self.create_text_embedding(query)
@@ -280,6 +387,7 @@ class VectorStoreService:
                     "metadata": result.payload
                 })
 
+            search_cache.set(cache_key, results)
             return results
         except Exception as e:
             logger.error(f"Erreur lors de la recherche de vecteurs: {str(e)}")
@@ -288,27 +396,101 @@ class VectorStoreService:
                 detail=f"Erreur lors de la recherche de vecteurs: {str(e)}"
             )
 
-# Créer une instance du service
-vector_store = VectorStoreService(
-    host=QDRANT_HOST,
-    port=QDRANT_PORT,
-    collection_name=COLLECTION_NAME,
-    vector_size=VECTOR_SIZE
-)
+# Instance du service, créée au démarrage par initialize_service()
+vector_store: Optional[VectorStoreService] = None
+
+# État de l'initialisation, exposé par /health
+service_state = {
+    "status": "starting",
+    "attempts": 0,
+    "error": None,
+    "ready_since": None,
+    "warmup": None
+}
+
+async def initialize_service():
+    """
+    Crée le service en réessayant avec un backoff exponentiel tant que
+    Qdrant n'est pas joignable, puis exécute le préchauffage optionnel.
+    """
+    global vector_store
+
+    attempt = 0
+    while True:
+        attempt += 1
+        service_state["attempts"] = attempt
+        service = VectorStoreService(
+            host=QDRANT_HOST,
+            port=QDRANT_PORT,
+            collection_name=COLLECTION_NAME,
+            vector_size=VECTOR_SIZE
+        )
+        try:
+            await asyncio.to_thread(service._ensure_collection_exists)
+
+            if WARMUP_ENABLED:
+                service_state["status"] = "warming_up"
+                service_state["warmup"] = await service.warm_up()
+
+            vector_store = service
+            service_state.update(status="ready", error=None, ready_since=time.time())
+            logger.info(f"Service prêt après {attempt} tentative(s)")
+            return
+        except asyncio.CancelledError:
+            await service.aclose()
+            raise
+        except Exception as e:
+            await service.aclose()
+            service_state.update(status="retrying", error=str(e))
+            if attempt == INIT_MAX_ATTEMPTS:
+                # Arrêt du processus pour que l'orchestrateur le redémarre, au lieu de répondre 503 indéfiniment
+                logger.error(f"Initialisation abandonnée après {attempt} tentatives, arrêt du processus: {str(e)}")
+                os._exit(1)
+            delay = min(INIT_BACKOFF_MAX, INIT_BACKOFF_BASE * 2 ** min(attempt - 1, 16))
+            delay *= random.uniform(0.5, 1.0)
+            logger.warning(f"Initialisation échouée (tentative {attempt}), "
+                           f"nouvel essai dans {delay:.1f}s: {str(e)}")
+            await asyncio.sleep(delay)
+
+def get_vector_store() -> VectorStoreService:
+    """Dépendance FastAPI qui refuse les requêtes tant que le service n'est pas prêt."""
+    if vector_store is None:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Service non disponible (état: {service_state['status']})"
+        )
+    return vector_store
 
 @app.get("/health")
 async def health_check():
     """Vérification de l'état du service."""
+    if vector_store is None:
+        return JSONResponse(
+            status_code=503,
+            content={
+                "status": service_state["status"],
+                "attempts": service_state["attempts"],
+                "error": service_state["error"]
+            }
+        )
+
     try:
         # Vérifier que Qdrant est accessible
-        collections = vector_store.qdrant_client.get_collections()
+        collections = await asyncio.to_thread(vector_store.qdrant_client.get_collections)
         collection_exists = COLLECTION_NAME in [c.name for c in collections.collections]
 
         return {
             "status": "healthy",
             "qdrant_connected": True,
             "collection_exists": collection_exists,
-            "voyage_api_configured": bool(VOYAGE_API_KEY)
+            "voyage_api_configured": bool(VOYAGE_API_KEY),
+            "ready_since": service_state["ready_since"],
+            "warmup": service_state["warmup"],
+            "caches": {
+                "embeddings": embedding_cache.stats(),
+                "search": search_cache.stats()
+            },
+            "voyage_calls": voyage_policy.stats()
         }
     except Exception as e:
         logger.error(f"Erreur de santé: {str(e)}")
@@ -318,7 +500,7 @@ async def health_check():
         )
 
 @app.post("/embed-text")
-async def embed_text(item: TextItem):
+async def embed_text(item: TextItem, vector_store: VectorStoreService = Depends(get_vector_store)):
     """
     Crée un embedding à partir d'un texte.
     
@@ -367,7 +549,7 @@ async def embed_text(item: TextItem):
         )
 
 @app.post("/embed-image")
-async def embed_image(item: ImageItem):
+async def embed_image(item: ImageItem, vector_store: VectorStoreService = Depends(get_vector_store)):
     """
     Crée un embedding à partir d'une image.
     
@@ -416,7 +598,7 @@ async def embed_image(item: ImageItem):
         )
 
 @app.post("/search")
-async def search(query: SearchQuery):
+async def search(query: SearchQuery, vector_store: VectorStoreService = Depends(get_vector_store)):
     """
     Recherche des vecteurs similaires à partir d'une requête.
     
@@ -449,7 +631,7 @@ async def search(query: SearchQuery):
         )
 
 @app.post("/upsert")
-async def upsert_vector(vector: VectorRecord):
+async def upsert_vector(vector: VectorRecord, vector_store: VectorStoreService = Depends(get_vector_store)):
     """
     Insère ou met à jour un vecteur dans Qdrant.
     
@@ -478,7 +660,7 @@ async def upsert_vector(vector: VectorRecord):
         )
 
 @app.post("/upsert-batch")
-async def upsert_vectors_batch(vectors: List[VectorRecord]):
+async def upsert_vectors_batch(vectors: List[VectorRecord], vector_store: VectorStoreService = Depends(get_vector_store)):
     """
     Insère ou met à jour plusieurs vecteurs dans Qdrant.
     
@@ -508,4 +690,6 @@ async def upsert_vectors_batch(vectors: List[VectorRecord]):
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    # WEB_CONCURRENCY > 1 active le mode production multi-workers (sans rechargement)
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=workers == 1, workers=workers)
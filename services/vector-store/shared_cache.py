@@ -0,0 +1,207 @@
+"""
+Cache partagé entre les workers d'un même service TechnicIA.
+
+Les entrées sont stockées dans un fichier SQLite en mode WAL et projeté en
+mémoire (mmap), ce qui permet à tous les processus uvicorn d'un conteneur de
+lire et d'alimenter le même cache (embeddings, résultats de recherche,
+réponses LLM). Les valeurs sont sérialisées en JSON compressé.
+
+Ce module est copié à l'identique dans chaque service qui en a besoin, chaque
+service étant construit dans son propre contexte Docker.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Répertoire des fichiers de cache et taille de la projection mémoire
+SHARED_CACHE_DIR = os.getenv("SHARED_CACHE_DIR", os.path.join(tempfile.gettempdir(), "technicia-cache"))
+SHARED_CACHE_MMAP_SIZE = int(os.getenv("SHARED_CACHE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+class SharedCache:
+    """Cache clé/valeur inter-processus avec expiration et éviction LRU."""
+
+    def __init__(self, name: str, maxsize: int = 1000, ttl: Optional[float] = None,
+                 max_bytes: Optional[int] = None, path: Optional[str] = None):
+        """
+        Initialise le cache.
+
+        Args:
+            name: Nom du cache, utilisé pour le nom du fichier SQLite
+            maxsize: Nombre maximum d'entrées
+            ttl: Durée de vie par défaut des entrées en secondes (None: sans expiration)
+            max_bytes: Taille maximale cumulée des valeurs compressées (None: illimitée)
+            path: Chemin explicite du fichier SQLite
+        """
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.path = path or os.path.join(SHARED_CACHE_DIR, f"{name}.sqlite")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        # Une connexion par thread et par processus
+        self._local = threading.local()
+
+        # Statistiques propres au processus courant
+        self.hits = 0
+        self.misses = 0
+
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+            "expires_at REAL, accessed_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_accessed ON entries (accessed_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        """Retourne la connexion du thread courant, en la rouvrant après un fork."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA mmap_size={SHARED_CACHE_MMAP_SIZE}")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _hash_key(key: str) -> str:
+        """Réduit une clé arbitraire à une empreinte de taille fixe."""
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """
+        Récupère une valeur du cache.
+
+        Args:
+            key: Clé de l'entrée
+            default: Valeur retournée si l'entrée est absente ou expirée
+
+        Returns:
+            La valeur en cache ou la valeur par défaut
+        """
+        hashed = self._hash_key(key)
+        now = time.time()
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT value, expires_at FROM entries WHERE key = ?", (hashed,)
+            ).fetchone()
+
+            if row is None or (row[1] is not None and row[1] < now):
+                if row is not None:
+                    conn.execute("DELETE FROM entries WHERE key = ?", (hashed,))
+                self.misses += 1
+                return default
+
+            conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, hashed))
+            self.hits += 1
+            return json.loads(zlib.decompress(row[0]))
+        except (sqlite3.Error, zlib.error, ValueError) as e:
+            logger.warning(f"Lecture du cache {self.name} impossible: {str(e)}")
+            self.misses += 1
+            return default
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        """
+        Ajoute ou remplace une valeur dans le cache.
+
+        Args:
+            key: Clé de l'entrée
+            value: Valeur sérialisable en JSON
+            ttl: Durée de vie en secondes (par défaut celle du cache)
+        """
+        ttl = ttl if ttl is not None else self.ttl
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else None
+        blob = zlib.compress(json.dumps(value).encode("utf-8"))
+
+        try:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, size, expires_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (self._hash_key(key), blob, len(blob), expires_at, now)
+                )
+                self._evict(conn, now)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            logger.warning(f"Écriture dans le cache {self.name} impossible: {str(e)}")
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        """Supprime les entrées expirées puis les moins récemment utilisées."""
+        conn.execute("DELETE FROM entries WHERE expires_at IS NOT NULL AND expires_at < ?", (now,))
+
+        count, total_bytes = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+
+        if count > self.maxsize:
+            conn.execute(
+                "DELETE FROM entries WHERE key IN "
+                "(SELECT key FROM entries ORDER BY accessed_at LIMIT ?)",
+                (count - self.maxsize,)
+            )
+
+        if self.max_bytes is not None and total_bytes > self.max_bytes:
+            excess = total_bytes - self.max_bytes
+            victims = []
+            for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed_at"):
+                victims.append((key,))
+                excess -= size
+                if excess <= 0:
+                    break
+            conn.executemany("DELETE FROM entries WHERE key = ?", victims)
+
+    def delete(self, key: str):
+        """Supprime une entrée du cache."""
+        try:
+            self._connect().execute("DELETE FROM entries WHERE key = ?", (self._hash_key(key),))
+        except sqlite3.Error as e:
+            logger.warning(f"Suppression dans le cache {self.name} impossible: {str(e)}")
+
+    def clear(self):
+        """Vide le cache pour tous les workers."""
+        try:
+            self._connect().execute("DELETE FROM entries")
+        except sqlite3.Error as e:
+            logger.warning(f"Vidage du cache {self.name} impossible: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Retourne les statistiques du cache.
+
+        Returns:
+            Nombre d'entrées et taille partagés, succès et échecs du processus courant
+        """
+        try:
+            count, total_bytes = self._connect().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+        except sqlite3.Error:
+            count, total_bytes = None, None
+
+        return {
+            "name": self.name,
+            "entries": count,
+            "bytes": total_bytes,
+            "maxsize": self.maxsize,
+            "maxBytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "pid": os.getpid()
+        }
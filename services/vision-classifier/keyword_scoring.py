@@ -0,0 +1,185 @@
+"""
+Score des mots-clés techniques dans les étiquettes et le texte d'une image.
+
+Les vocabulaires (indicateurs de schéma technique et caractéristiques de
+chaque type de schéma) sont lus depuis un fichier JSON, en anglais et en
+français, puis compilés en une seule expression régulière, factorisée en
+arbre de préfixes. Un seul parcours
+des étiquettes et du texte OCR suffit alors à déterminer si l'image est un
+schéma technique, son type et la confiance de la classification.
+
+Chaque vocabulaire associe une notion à ses variantes (synonymes, traductions) :
+une notion compte une fois, quelle que soit la langue ou la variante trouvée.
+Les variantes sont comparées sans accents ni casse, en début de mot, de sorte
+que "schema" reconnaît aussi "schémas" et "schematic".
+
+Ce module est copié à l'identique dans chaque service qui classifie des images,
+chaque service étant construit dans son propre contexte Docker.
+"""
+import json
+import logging
+import os
+import re
+import unicodedata
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Fichier des vocabulaires (par défaut celui livré avec le service)
+KEYWORD_VOCABULARY_PATH = os.getenv(
+    "KEYWORD_VOCABULARY_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "vocabularies.json")
+)
+
+# Groupe des indicateurs de schéma technique
+TECHNICAL_GROUP = "technical"
+
+# Diacritiques séparés de leur lettre par la décomposition NFKD
+_COMBINING_MARKS = re.compile("[\u0300-\u036f]")
+
+def normalize(text: str) -> str:
+    """Met un texte en minuscules et retire ses accents."""
+    text = text.lower()
+    if text.isascii():
+        return text
+    return _COMBINING_MARKS.sub("", unicodedata.normalize("NFKD", text))
+
+def _trie_pattern(node: Dict[str, Any]) -> str:
+    """
+    Construit l'expression régulière d'un arbre de préfixes.
+
+    Args:
+        node: Nœud de l'arbre ({caractère: sous-arbre}, "" marquant la fin d'une variante)
+
+    Returns:
+        L'expression reconnaissant les variantes du sous-arbre, la plus longue d'abord
+    """
+    branches = []
+    for char in sorted(key for key in node if key):
+        # Une espace d'une variante accepte toute suite de blancs (retours à la ligne de l'OCR)
+        prefix = r"\s+" if char == " " else re.escape(char)
+        branches.append(prefix + _trie_pattern(node[char]))
+
+    if not branches:
+        return ""
+    pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    # Fin de variante possible ici: le reste est facultatif (quantificateur glouton)
+    return f"(?:{pattern})?" if "" in node else pattern
+
+class KeywordScorer:
+    """Vocabulaires compilés en une expression régulière unique."""
+
+    def __init__(self, vocabularies: Dict[str, Any]):
+        """
+        Compile les vocabulaires.
+
+        Args:
+            vocabularies: {"technical": {notion: [variantes]},
+                "schemaTypes": {type de schéma: {notion: [variantes]}}}
+
+        Raises:
+            ValueError: Si un vocabulaire est vide ou mal formé
+        """
+        technical = vocabularies.get(TECHNICAL_GROUP) or {}
+        schema_types = vocabularies.get("schemaTypes") or {}
+        if not technical or not schema_types:
+            raise ValueError("Les vocabulaires doivent définir 'technical' et 'schemaTypes'")
+
+        # Notions de chaque groupe, dans l'ordre du fichier (départage des types à égalité)
+        self.groups: Dict[str, List[str]] = {TECHNICAL_GROUP: list(technical)}
+        groups = [(TECHNICAL_GROUP, technical)]
+        for schema_type, concepts in schema_types.items():
+            if not concepts:
+                raise ValueError(f"Vocabulaire vide pour le type de schéma {schema_type}")
+            self.groups[schema_type] = list(concepts)
+            groups.append((schema_type, concepts))
+        self.schema_types = list(schema_types)
+
+        # Variante normalisée -> notions (groupe, notion) qu'elle désigne
+        self._variants: Dict[str, Set[Tuple[str, str]]] = {}
+        for group, concepts in groups:
+            for concept, variants in concepts.items():
+                if isinstance(variants, str) or not variants:
+                    raise ValueError(f"Variantes invalides pour {group}/{concept}: liste attendue")
+                for variant in variants:
+                    key = " ".join(normalize(variant).split())
+                    self._variants.setdefault(key, set()).add((group, concept))
+
+        # Variantes factorisées en arbre de préfixes: à chaque position du texte,
+        # l'expression ne suit qu'une branche au lieu d'essayer chaque variante
+        trie: Dict[str, Any] = {}
+        for variant in self._variants:
+            node = trie
+            for char in variant:
+                node = node.setdefault(char, {})
+            node[""] = {}
+        self._pattern = re.compile(r"\b(" + _trie_pattern(trie) + r")")
+
+    @classmethod
+    def from_file(cls, path: str = KEYWORD_VOCABULARY_PATH) -> "KeywordScorer":
+        """
+        Charge et compile les vocabulaires d'un fichier JSON.
+
+        Args:
+            path: Chemin du fichier des vocabulaires
+
+        Returns:
+            Le moteur de score
+        """
+        with open(path, "r", encoding="utf-8") as vocabulary_file:
+            scorer = cls(json.load(vocabulary_file))
+        logger.info(f"Vocabulaires chargés depuis {path}: {len(scorer._variants)} variante(s), "
+                    f"{len(scorer.schema_types)} type(s) de schéma")
+        return scorer
+
+    def matches(self, labels: Iterable[str], text: Optional[str]) -> Dict[str, Set[str]]:
+        """
+        Recherche les notions présentes dans les étiquettes et le texte, en un seul parcours.
+
+        Args:
+            labels: Étiquettes détectées
+            text: Texte détecté dans l'image
+
+        Returns:
+            Les notions trouvées, par groupe
+        """
+        content = normalize("\n".join(list(labels) + [text or ""]))
+        found: Dict[str, Set[str]] = {}
+        for match in self._pattern.finditer(content):
+            for group, concept in self._variants[" ".join(match.group(1).split())]:
+                found.setdefault(group, set()).add(concept)
+        return found
+
+    def score(self, labels: Iterable[str], text: Optional[str]) -> Dict[str, Any]:
+        """
+        Classifie une image d'après ses étiquettes et son texte.
+
+        Args:
+            labels: Étiquettes détectées
+            text: Texte détecté dans l'image
+
+        Returns:
+            {"isTechnical", "schemaType" ("unknown" si aucun type), "confidence" (entre 0 et 1),
+            "matches" (notions trouvées par groupe)}
+        """
+        found = self.matches(labels, text)
+
+        # Type de schéma: le plus de notions trouvées, le premier du fichier à égalité
+        schema_type, detected = "unknown", 0
+        for candidate in self.schema_types:
+            count = len(found.get(candidate, ()))
+            if count > detected:
+                schema_type, detected = candidate, count
+
+        confidence = 0.0
+        if detected:
+            confidence = detected / len(self.groups[schema_type])
+            # Bonus si plusieurs caractéristiques sont détectées
+            if detected > 2:
+                confidence = min(1.0, confidence * 1.2)
+
+        return {
+            "isTechnical": bool(found.get(TECHNICAL_GROUP)),
+            "schemaType": schema_type,
+            "confidence": confidence,
+            "matches": {group: sorted(concepts) for group, concepts in found.items()}
+        }
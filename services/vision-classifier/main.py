@@ -2,17 +2,27 @@
 Service de classification d'images pour TechnicIA.
 Utilise Google Vision AI pour détecter et classifier les schémas techniques.
 """
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends
 from fastapi.responses import JSONResponse
 from google.cloud import vision
+from contextlib import asynccontextmanager
 from enum import Enum
 import asyncio
 import os
 import base64
 import logging
 import io
-from typing import Dict, List, Any, Optional
+import random
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Any, Optional
 import time
+from pydantic import BaseModel, Field
+
+from call_policy import CallDeadlineExceeded, RequestBudgetMiddleware, per_worker
+from image_cache import ImageAnalysisCache
+from keyword_scoring import KeywordScorer
+from vision_batch import VISION_PROFILES, VisionUnavailableError, profile_features
+from vision_gateway import VisionGateway, vision_priority
 
 # Configuration du logging
 logging.basicConfig(
@@ -21,11 +31,49 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Lance l'initialisation du client Vision en arrière-plan."""
+    init_task = asyncio.create_task(initialize_service())
+    yield
+    init_task.cancel()
+
 # Configuration de l'application
 app = FastAPI(
     title="Vision Classifier Service",
     description="Service de classification d'images pour TechnicIA",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
+)
+
+# Échéance de chaque requête (en-tête X-Request-Budget), appliquée aux appels Vision
+app.add_middleware(RequestBudgetMiddleware)
+
+# Configuration de l'initialisation (tentatives, backoff et préchauffage) ; au-delà de
+# INIT_MAX_ATTEMPTS tentatives (0: sans limite), le processus s'arrête pour être redémarré
+INIT_MAX_ATTEMPTS = int(os.getenv("INIT_MAX_ATTEMPTS", "0"))
+INIT_BACKOFF_BASE = float(os.getenv("INIT_BACKOFF_BASE", "1.0"))
+INIT_BACKOFF_MAX = float(os.getenv("INIT_BACKOFF_MAX", "30.0"))
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "false").lower() == "true"
+
+# Profil d'analyse Vision par défaut ("fast", "ocr", "full" ou "two-stage"), modifiable par requête
+VISION_PROFILE = os.getenv("VISION_PROFILE", "full")
+
+# Répertoire partagé avec document-processor (volume TEMP_DIR): seules ses images sont lisibles par chemin
+SHARED_DIR = Path(os.getenv("TEMP_DIR", "/tmp/technicia-docs")).resolve()
+
+# Classification de plusieurs images: nombre maximum par requête, taille maximale
+# et classifications simultanées (pour tout le service, réparties entre ses workers)
+CLASSIFY_MAX_IMAGES = int(os.getenv("CLASSIFY_MAX_IMAGES", "32"))
+CLASSIFY_MAX_IMAGE_BYTES = int(os.getenv("CLASSIFY_MAX_IMAGE_BYTES", str(20 * 1024 * 1024)))
+CLASSIFY_CONCURRENCY = per_worker(int(os.getenv("CLASSIFY_CONCURRENCY", "8")))
+
+# Lecture des fichiers uploadés par blocs
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Image PNG 1x1 blanche utilisée pour le préchauffage du canal Vision
+WARMUP_IMAGE = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAAAAAA6fptVAAAACklEQVR4nGP4DwABAQEAsTj2FAAAAABJRU5ErkJggg=="
 )
 
 class SchemaType(str, Enum):
@@ -42,203 +90,337 @@ class VisionClassifier:
     def __init__(self):
         """Initialise le classificateur Vision."""
         self.client = vision.ImageAnnotatorClient()
+        # Appels Vision par lots, avec priorités, quota partagé et disjoncteur
+        self.vision = VisionGateway(self.client)
+        # Résultats déjà obtenus pour une image identique ou visuellement identique
+        self.cache = ImageAnalysisCache("vision-classification", version="2")
+        self.cache.warm()
+        # Vocabulaires (anglais et français) compilés en une seule expression régulière
+        self.scorer = KeywordScorer.from_file()
+    
+    async def warm_up(self) -> Dict[str, Any]:
+        """
+        Ouvre le canal gRPC vers Vision AI avec une annotation synthétique.
         
-        # Définition des features pour chaque type de schéma
-        self.schema_features = {
-            SchemaType.ELECTRICAL: ["circuit", "electrical", "wiring", "schematic", "diagram", "electronic"],
-            SchemaType.HYDRAULIC: ["hydraulic", "fluid", "pump", "valve", "cylinder", "pressure", "water"],
-            SchemaType.PNEUMATIC: ["pneumatic", "air", "compressor", "valve", "cylinder", "pressure", "gas"],
-            SchemaType.MECHANICAL: ["mechanical", "gear", "assembly", "machine", "part", "engine", "motor"]
-        }
+        Returns:
+            Durée et statut du préchauffage
+        """
+        start = time.time()
+        try:
+            request = vision.AnnotateImageRequest(
+                image=vision.Image(content=WARMUP_IMAGE),
+                features=[vision.Feature(type_=vision.Feature.Type.LABEL_DETECTION, max_results=1)]
+            )
+            await asyncio.to_thread(self.client.annotate_image, request=request)
+            return {"success": True, "duration": time.time() - start}
+        except Exception as e:
+            return {"success": False, "duration": time.time() - start, "error": str(e)}
     
-    async def classify_image(self, image_content: bytes) -> Dict[str, Any]:
+    async def _annotate(self, image_content: bytes, profile: str) -> List[vision.AnnotateImageResponse]:
+        """
+        Envoie une image à Vision selon un profil d'analyse.
+        
+        Args:
+            image_content: Contenu binaire de l'image
+            profile: Profil d'analyse ("fast", "ocr", "full" ou "two-stage")
+            
+        Returns:
+            Les réponses Vision (deux en mode "two-stage" pour une image technique)
+        """
+        if profile != "two-stage":
+            return [await self.vision.annotate(image_content, profile_features(profile))]
+        
+        # Première passe sur les étiquettes seules: le texte n'est demandé que pour les images techniques
+        labels_response = await self.vision.annotate(image_content, profile_features("fast"))
+        labels = [label.description.lower() for label in labels_response.label_annotations]
+        if not self.scorer.score(labels, "")["isTechnical"]:
+            return [labels_response]
+        
+        return [labels_response, await self.vision.annotate(image_content, profile_features("ocr"))]
+    
+    async def classify_image(self, image_content: bytes, profile: Optional[str] = None) -> Dict[str, Any]:
         """
         Classifie une image avec Vision AI.
         
         Args:
             image_content: Le contenu binaire de l'image
+            profile: Profil d'analyse (par défaut VISION_PROFILE)
             
         Returns:
             Un dictionnaire avec les résultats de classification
         """
         try:
-            # Créer l'objet Image
-            image = vision.Image(content=image_content)
+            profile = profile or VISION_PROFILE
             
-            # Exécuter les différentes analyses en parallèle pour optimiser
-            features = [
-                vision.Feature(type_=vision.Feature.Type.LABEL_DETECTION, max_results=20),
-                vision.Feature(type_=vision.Feature.Type.TEXT_DETECTION),
-                vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION),
-                vision.Feature(type_=vision.Feature.Type.IMAGE_PROPERTIES)
-            ]
-            
-            # Créer la requête d'annotation
-            request = vision.AnnotateImageRequest(image=image, features=features)
+            # Image déjà classifiée (à l'octet près ou visuellement identique)
+            cache_key, cached = await asyncio.to_thread(self.cache.lookup, image_content, profile)
+            if cached is not None:
+                return {**cached["result"], "cache": {"match": cached["match"], "distance": cached["distance"]}}
             
-            # Envoyer la requête
-            response = await asyncio.to_thread(
-                self.client.annotate_image,
-                request=request
-            )
+            # Envoyer l'image à Vision selon le profil d'analyse
+            responses = await self._annotate(image_content, profile)
             
             # Extraire les résultats
-            labels = []
-            if response.label_annotations:
-                labels = [
-                    {
-                        "description": label.description.lower(),
-                        "score": label.score,
-                        "topicality": label.topicality
-                    }
-                    for label in response.label_annotations
-                ]
+            labels = [
+                {
+                    "description": label.description.lower(),
+                    "score": label.score,
+                    "topicality": label.topicality
+                }
+                for response in responses
+                for label in response.label_annotations
+            ]
             
             # Extraire le texte détecté (utiliser document_text si disponible, sinon text)
             detected_text = ""
-            if response.document_text_annotation and response.document_text_annotation.text:
-                detected_text = response.document_text_annotation.text
-            elif response.text_annotations and response.text_annotations[0].description:
-                detected_text = response.text_annotations[0].description
-            
-            # Déterminer le type de schéma
-            label_descriptions = [label["description"] for label in labels]
-            schema_type = self._determine_schema_type(label_descriptions, detected_text)
+            for response in responses:
+                if response.document_text_annotation and response.document_text_annotation.text:
+                    detected_text = response.document_text_annotation.text
+                elif response.text_annotations and response.text_annotations[0].description:
+                    detected_text = response.text_annotations[0].description
             
-            # Vérifier si c'est un schéma technique
-            is_technical = self._is_technical_diagram(label_descriptions, detected_text)
-            
-            # Calculer la confiance
-            confidence = self._calculate_confidence(schema_type, label_descriptions, detected_text)
+            # Schéma technique, type de schéma et confiance, en un seul parcours des étiquettes et du texte
+            score = self.scorer.score([label["description"] for label in labels], detected_text)
+            is_technical = score["isTechnical"]
+            schema_type = score["schemaType"]
+            confidence = score["confidence"]
             
             # Analyser les couleurs dominantes
             colors = []
-            if response.image_properties and response.image_properties.dominant_colors:
-                colors = [
-                    {
-                        "red": color.color.red,
-                        "green": color.color.green,
-                        "blue": color.color.blue,
-                        "score": color.score,
-                        "pixel_fraction": color.pixel_fraction
-                    }
-                    for color in response.image_properties.dominant_colors.colors[:5]
-                ]
+            for response in responses:
+                if response.image_properties and response.image_properties.dominant_colors:
+                    colors = [
+                        {
+                            "red": color.color.red,
+                            "green": color.color.green,
+                            "blue": color.color.blue,
+                            "score": color.score,
+                            "pixel_fraction": color.pixel_fraction
+                        }
+                        for color in response.image_properties.dominant_colors.colors[:5]
+                    ]
             
-            return {
+            result = {
                 "is_technical_diagram": is_technical,
-                "schema_type": schema_type.value,
+                "profile": profile,
+                "schema_type": schema_type,
                 "confidence": confidence,
                 "labels": labels,
                 "detected_text": detected_text,
                 "dominant_colors": colors,
                 "processing_time": time.time()
             }
+            await asyncio.to_thread(self.cache.store, cache_key, profile, result)
+            return result
             
+        except CallDeadlineExceeded as e:
+            raise HTTPException(status_code=504, detail=str(e))
+        except VisionUnavailableError as e:
+            raise HTTPException(status_code=503, detail=str(e))
         except Exception as e:
             logger.error(f"Erreur lors de la classification de l'image: {str(e)}")
             raise HTTPException(
                 status_code=500,
                 detail=f"Erreur lors de la classification: {str(e)}"
             )
+
+# Instance du classificateur, créée au démarrage par initialize_service()
+classifier: Optional[VisionClassifier] = None
+
+# État de l'initialisation, exposé par /health
+service_state = {
+    "status": "starting",
+    "attempts": 0,
+    "error": None,
+    "ready_since": None,
+    "warmup": None
+}
+
+async def initialize_service():
+    """
+    Crée le client Vision en réessayant avec un backoff exponentiel,
+    puis exécute le préchauffage optionnel.
+    """
+    global classifier
     
-    def _is_technical_diagram(self, labels: List[str], text: str) -> bool:
-        """
-        Détermine si l'image est un schéma technique.
-        
-        Args:
-            labels: Liste des labels détectés
-            text: Texte détecté dans l'image
-            
-        Returns:
-            True si l'image est un schéma technique, False sinon
-        """
-        # Indicateurs de schémas techniques
-        technical_indicators = [
-            "diagram", "schematic", "blueprint", "technical drawing", "circuit",
-            "plan", "design", "drawing", "schematics", "technical", "engineering"
-        ]
-        
-        # Vérifier si les labels ou le texte contiennent des indicateurs
-        if any(indicator in labels for indicator in technical_indicators):
-            return True
-            
-        # Vérifier dans le texte détecté
-        text_lower = text.lower()
-        if any(indicator in text_lower for indicator in technical_indicators):
-            return True
-            
-        return False
-    
-    def _determine_schema_type(self, labels: List[str], text: str) -> SchemaType:
-        """
-        Détermine le type de schéma technique.
-        
-        Args:
-            labels: Liste des labels détectés
-            text: Texte détecté dans l'image
+    attempt = 0
+    while True:
+        attempt += 1
+        service_state["attempts"] = attempt
+        try:
+            # La création du client résout les identifiants Google (appel bloquant)
+            instance = await asyncio.to_thread(VisionClassifier)
             
-        Returns:
-            Le type de schéma
-        """
-        # Combiner les labels et le texte pour une meilleure détection
-        text_lower = text.lower()
-        combined_text = " ".join(labels) + " " + text_lower
-        
-        scores = {}
-        for schema_type, features in self.schema_features.items():
-            # Calculer le score basé sur le nombre de features détectées
-            score = sum(1 for feature in features if feature in combined_text)
-            scores[schema_type] = score
-        
-        # Déterminer le type avec le score le plus élevé
-        if not scores or max(scores.values()) == 0:
-            return SchemaType.UNKNOWN
+            if WARMUP_ENABLED:
+                service_state["status"] = "warming_up"
+                service_state["warmup"] = await instance.warm_up()
             
-        return max(scores.items(), key=lambda x: x[1])[0]
+            classifier = instance
+            service_state.update(status="ready", error=None, ready_since=time.time())
+            logger.info(f"Service prêt après {attempt} tentative(s)")
+            return
+        except Exception as e:
+            service_state.update(status="retrying", error=str(e))
+            if attempt == INIT_MAX_ATTEMPTS:
+                # Arrêt du processus pour que l'orchestrateur le redémarre, au lieu de répondre 503 indéfiniment
+                logger.error(f"Initialisation abandonnée après {attempt} tentatives, arrêt du processus: {str(e)}")
+                os._exit(1)
+            delay = min(INIT_BACKOFF_MAX, INIT_BACKOFF_BASE * 2 ** min(attempt - 1, 16))
+            delay *= random.uniform(0.5, 1.0)
+            logger.warning(f"Initialisation échouée (tentative {attempt}), "
+                           f"nouvel essai dans {delay:.1f}s: {str(e)}")
+            await asyncio.sleep(delay)
+
+def get_classifier() -> VisionClassifier:
+    """Dépendance FastAPI qui refuse les requêtes tant que le service n'est pas prêt."""
+    if classifier is None:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Service non disponible (état: {service_state['status']})"
+        )
+    return classifier
+
+def validate_profile(profile: Optional[str]):
+    """Refuse une requête dont le profil d'analyse est inconnu."""
+    if profile is not None and profile not in VISION_PROFILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Profil d'analyse inconnu: {profile} (profils: {', '.join(VISION_PROFILES)})"
+        )
+
+class PathClassificationRequest(BaseModel):
+    paths: List[str] = Field(..., description="Chemins des images, relatifs au répertoire partagé (TEMP_DIR) ou absolus sous celui-ci")
+    profile: Optional[str] = Field(None, description="Profil d'analyse Vision: fast, ocr, full ou two-stage")
+
+# Limite des classifications simultanées, créée dans la boucle d'événements au premier appel
+_classify_semaphore: Optional[asyncio.Semaphore] = None
+
+async def read_upload(file: UploadFile) -> bytes:
+    """
+    Lit un fichier uploadé par blocs, sans dépasser CLASSIFY_MAX_IMAGE_BYTES.
     
-    def _calculate_confidence(self, schema_type: SchemaType, labels: List[str], text: str) -> float:
-        """
-        Calcule le niveau de confiance pour le type de schéma déterminé.
+    Args:
+        file: Fichier uploadé
         
-        Args:
-            schema_type: Le type de schéma déterminé
-            labels: Liste des labels détectés
-            text: Texte détecté dans l'image
-            
-        Returns:
-            Le niveau de confiance entre 0 et 1
-        """
-        if schema_type == SchemaType.UNKNOWN:
-            return 0.0
-            
-        text_lower = text.lower()
-        combined_text = " ".join(labels) + " " + text_lower
-        features = self.schema_features[schema_type]
+    Returns:
+        Le contenu du fichier
         
-        # Calculer le nombre de features détectées
-        detected = sum(1 for feature in features if feature in combined_text)
+    Raises:
+        HTTPException: 413 si le fichier dépasse la taille maximale
+    """
+    chunks = []
+    size = 0
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > CLASSIFY_MAX_IMAGE_BYTES:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Image trop volumineuse (maximum {CLASSIFY_MAX_IMAGE_BYTES} octets): {file.filename}"
+            )
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+def resolve_shared_path(path: str) -> Path:
+    """
+    Résout le chemin d'une image du répertoire partagé.
+    
+    Args:
+        path: Chemin relatif à SHARED_DIR, ou absolu sous SHARED_DIR
         
-        # Calculer le ratio de features détectées
-        confidence = detected / len(features)
+    Returns:
+        Le chemin absolu de l'image
         
-        # Bonus si plusieurs features sont détectées
-        if detected > 2:
-            confidence = min(1.0, confidence * 1.2)
-            
-        return confidence
+    Raises:
+        HTTPException: 400 si le chemin sort du répertoire partagé
+    """
+    resolved = (SHARED_DIR / path).resolve()
+    if resolved != SHARED_DIR and SHARED_DIR not in resolved.parents:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Chemin hors du répertoire partagé ({SHARED_DIR}): {path}"
+        )
+    return resolved
 
-# Créer une instance du classificateur
-classifier = VisionClassifier()
+def check_image_count(count: int):
+    """Refuse une requête sans image ou avec trop d'images."""
+    if not 0 < count <= CLASSIFY_MAX_IMAGES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Nombre d'images invalide: {count} (entre 1 et {CLASSIFY_MAX_IMAGES})"
+        )
+
+async def classify_all(classifier: VisionClassifier, loaders: List[Callable[[], Awaitable[bytes]]],
+                       profile: Optional[str]) -> Dict[str, Any]:
+    """
+    Classifie plusieurs images simultanément, au plus CLASSIFY_CONCURRENCY à la fois.
+    
+    Chaque image n'est lue qu'au moment de sa classification, pour ne garder en
+    mémoire que les images en cours.
+    
+    Args:
+        classifier: Classificateur Vision
+        loaders: Lecture du contenu de chaque image
+        profile: Profil d'analyse (par défaut VISION_PROFILE)
+        
+    Returns:
+        Les résultats, dans l'ordre des images (l'échec d'une image n'interrompt pas les autres), et les statistiques
+    """
+    global _classify_semaphore
+    if _classify_semaphore is None:
+        _classify_semaphore = asyncio.Semaphore(CLASSIFY_CONCURRENCY)
+    
+    async def classify_one(index: int, load: Callable[[], Awaitable[bytes]]) -> Dict[str, Any]:
+        async with _classify_semaphore:
+            try:
+                content = await load()
+                return {"index": index, "success": True,
+                        "classification": await classifier.classify_image(content, profile)}
+            except HTTPException as e:
+                return {"index": index, "success": False, "status": e.status_code, "error": e.detail}
+            except Exception as e:
+                logger.error(f"Erreur lors de la classification de l'image {index}: {str(e)}")
+                return {"index": index, "success": False, "status": 500, "error": str(e)}
+    
+    start = time.time()
+    results = await asyncio.gather(*[classify_one(index, load) for index, load in enumerate(loaders)])
+    succeeded = sum(1 for result in results if result["success"])
+    return {
+        "results": results,
+        "stats": {
+            "total": len(results),
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded,
+            "processingTime": time.time() - start
+        }
+    }
 
 @app.get("/health")
 async def health_check():
     """Vérification de l'état du service."""
+    if classifier is None:
+        return JSONResponse(
+            status_code=503,
+            content={
+                "status": service_state["status"],
+                "attempts": service_state["attempts"],
+                "error": service_state["error"]
+            }
+        )
+    
     try:
         # Vérifier que Vision AI est configuré
         return {
             "status": "healthy",
-            "google_vision_initialized": True
+            "google_vision_initialized": True,
+            "ready_since": service_state["ready_since"],
+            "warmup": service_state["warmup"],
+            "vision_profile": VISION_PROFILE,
+            "vision_batch": classifier.vision.batcher.stats(),
+            "vision_gateway": classifier.vision.stats(),
+            "image_cache": classifier.cache.stats()
         }
     except Exception as e:
         logger.error(f"Erreur de santé: {str(e)}")
@@ -248,17 +430,21 @@ async def health_check():
         )
 
 @app.post("/classify")
-async def classify_image(file: UploadFile = File(...)):
+async def classify_image(file: UploadFile = File(...), profile: Optional[str] = None,
+                         classifier: VisionClassifier = Depends(get_classifier)):
     """
     Classifie une image avec Vision AI.
     
     Args:
         file: Le fichier image à classifier
+        profile: Profil d'analyse Vision: fast, ocr, full ou two-stage (par défaut VISION_PROFILE)
         
     Returns:
         Les résultats de classification
     """
     try:
+        validate_profile(profile)
+        
         # Vérifier le type de fichier
         content_type = file.content_type or ""
         if not content_type.startswith("image/"):
@@ -268,10 +454,11 @@ async def classify_image(file: UploadFile = File(...)):
             )
         
         # Lire le contenu de l'image
-        image_content = await file.read()
+        image_content = await read_upload(file)
         
-        # Classifier l'image
-        results = await classifier.classify_image(image_content)
+        # Classifier l'image (appel interactif: prioritaire sur les analyses de documents)
+        with vision_priority("interactive"):
+            results = await classifier.classify_image(image_content, profile)
         
         return results
         
@@ -285,15 +472,18 @@ async def classify_image(file: UploadFile = File(...)):
         )
 
 @app.post("/classify-base64")
-async def classify_image_base64(data: Dict[str, str]):
+async def classify_image_base64(data: Dict[str, str], classifier: VisionClassifier = Depends(get_classifier)):
     """
     Classifie une image encodée en base64.
     
     Args:
-        data: Dictionnaire contenant l'image encodée en base64
+        data: Dictionnaire contenant l'image encodée en base64 et, en option, le profil d'analyse ("profile")
         
     Returns:
         Les résultats de classification
+        
+    Raises:
+        HTTPException: 413 si l'image dépasse CLASSIFY_MAX_IMAGE_BYTES
     """
     try:
         # Vérifier que les données sont présentes
@@ -302,6 +492,14 @@ async def classify_image_base64(data: Dict[str, str]):
                 status_code=400,
                 detail="Données manquantes. Le champ 'image' est requis."
             )
+        validate_profile(data.get("profile"))
+        
+        # Refuser une image trop volumineuse avant de la décoder (4 caractères base64 pour 3 octets)
+        if len(data["image"]) * 3 // 4 > CLASSIFY_MAX_IMAGE_BYTES:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Image trop volumineuse (maximum {CLASSIFY_MAX_IMAGE_BYTES} octets)"
+            )
         
         # Décoder l'image base64
         try:
@@ -317,8 +515,9 @@ async def classify_image_base64(data: Dict[str, str]):
                 detail=f"Erreur lors du décodage de l'image: {str(e)}"
             )
         
-        # Classifier l'image
-        results = await classifier.classify_image(image_content)
+        # Classifier l'image (appel interactif: prioritaire sur les analyses de documents)
+        with vision_priority("interactive"):
+            results = await classifier.classify_image(image_content, data.get("profile"))
         
         return results
         
@@ -331,6 +530,96 @@ async def classify_image_base64(data: Dict[str, str]):
             detail=f"Erreur lors de la classification: {str(e)}"
         )
 
+@app.post("/classify-batch")
+async def classify_images(files: List[UploadFile] = File(...), profile: Optional[str] = None,
+                          classifier: VisionClassifier = Depends(get_classifier)):
+    """
+    Classifie plusieurs images envoyées en multipart (sans encodage base64).
+    
+    Args:
+        files: Les fichiers image à classifier (champ "files" répété)
+        profile: Profil d'analyse Vision: fast, ocr, full ou two-stage (par défaut VISION_PROFILE)
+        
+    Returns:
+        Les résultats de classification, dans l'ordre des fichiers
+    """
+    try:
+        validate_profile(profile)
+        check_image_count(len(files))
+        
+        def loader(file: UploadFile) -> Callable[[], Awaitable[bytes]]:
+            async def load() -> bytes:
+                if not (file.content_type or "").startswith("image/"):
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"Type de fichier non supporté: {file.content_type} ({file.filename})"
+                    )
+                return await read_upload(file)
+            return load
+        
+        # Appel interactif: prioritaire sur les analyses de documents
+        with vision_priority("interactive"):
+            outcome = await classify_all(classifier, [loader(file) for file in files], profile)
+        
+        for result, file in zip(outcome["results"], files):
+            result["filename"] = file.filename
+        return {"success": True, **outcome}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Erreur lors de la classification multiple: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Erreur lors de la classification: {str(e)}"
+        )
+
+@app.post("/classify-paths")
+async def classify_shared_images(request: PathClassificationRequest,
+                                 classifier: VisionClassifier = Depends(get_classifier)):
+    """
+    Classifie des images du répertoire partagé avec document-processor, sans les réenvoyer.
+    
+    Args:
+        request: Chemins des images (relatifs à TEMP_DIR ou absolus sous TEMP_DIR) et profil d'analyse
+        
+    Returns:
+        Les résultats de classification, dans l'ordre des chemins
+    """
+    try:
+        validate_profile(request.profile)
+        check_image_count(len(request.paths))
+        
+        def loader(path: str) -> Callable[[], Awaitable[bytes]]:
+            async def load() -> bytes:
+                image_path = resolve_shared_path(path)
+                if not image_path.is_file():
+                    raise HTTPException(status_code=404, detail=f"Image non trouvée: {path}")
+                if image_path.stat().st_size > CLASSIFY_MAX_IMAGE_BYTES:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"Image trop volumineuse (maximum {CLASSIFY_MAX_IMAGE_BYTES} octets): {path}"
+                    )
+                return await asyncio.to_thread(image_path.read_bytes)
+            return load
+        
+        outcome = await classify_all(classifier, [loader(path) for path in request.paths], request.profile)
+        
+        for result, path in zip(outcome["results"], request.paths):
+            result["path"] = path
+        return {"success": True, **outcome}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Erreur lors de la classification par chemins: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Erreur lors de la classification: {str(e)}"
+        )
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    # WEB_CONCURRENCY > 1 active le mode production multi-workers (sans rechargement)
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=workers == 1, workers=workers)
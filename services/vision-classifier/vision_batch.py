@@ -0,0 +1,253 @@
+"""
+Regroupement des appels Google Vision pour TechnicIA.
+
+Au lieu d'un appel annotate_image par image, les images en attente sont
+regroupées en requêtes batch_annotate_images, bornées en nombre d'images et
+en octets. Chaque réponse du lot est rendue à l'image qui l'a demandée ;
+seules les entrées en échec pour une cause transitoire (quota, indisponibilité)
+sont renvoyées dans un lot ultérieur.
+
+Les lots ne regroupent que des images de même priorité et sont transmis à la
+passerelle Vision (vision_gateway.py), qui décide de leur ordre d'envoi.
+
+Ce module est copié à l'identique dans chaque service qui appelle Vision,
+chaque service étant construit dans son propre contexte Docker.
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from google.api_core import exceptions as google_exceptions
+from google.cloud import vision
+
+from call_policy import per_worker
+
+logger = logging.getLogger(__name__)
+
+# Taille des lots: l'API accepte au plus 16 images par requête synchrone
+VISION_BATCH_MAX_IMAGES = int(os.getenv("VISION_BATCH_MAX_IMAGES", "16"))
+VISION_BATCH_MAX_BYTES = int(os.getenv("VISION_BATCH_MAX_BYTES", str(8 * 1024 * 1024)))
+
+# Attente maximale d'autres images avant l'envoi d'un lot incomplet (secondes)
+VISION_BATCH_WINDOW = float(os.getenv("VISION_BATCH_WINDOW", "0.05"))
+
+# Lots envoyés simultanément par le service (répartis entre ses workers) et nouvelles tentatives des entrées en échec
+VISION_BATCH_CONCURRENCY = per_worker(int(os.getenv("VISION_BATCH_CONCURRENCY", "4")))
+VISION_BATCH_MAX_RETRIES = int(os.getenv("VISION_BATCH_MAX_RETRIES", "3"))
+VISION_BATCH_BACKOFF_BASE = float(os.getenv("VISION_BATCH_BACKOFF_BASE", "0.5"))
+
+# Codes google.rpc transitoires: DEADLINE_EXCEEDED, RESOURCE_EXHAUSTED, INTERNAL, UNAVAILABLE
+RETRYABLE_CODES = {4, 8, 13, 14}
+
+# Mêmes causes, levées par le client pour l'appel entier
+RETRYABLE_EXCEPTIONS = (
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.InternalServerError,
+    google_exceptions.ServiceUnavailable
+)
+
+# Profils d'analyse: analyses Vision demandées pour chaque image.
+# "two-stage" demande d'abord les étiquettes, puis le texte des seules images techniques.
+VISION_PROFILES = ("fast", "ocr", "full", "two-stage")
+
+def profile_features(profile: str) -> List[vision.Feature]:
+    """
+    Retourne les analyses Vision d'un profil.
+
+    Args:
+        profile: "fast" (étiquettes), "ocr" (texte du document) ou "full" (étiquettes,
+            texte, texte du document et couleurs dominantes)
+
+    Returns:
+        Les analyses à demander
+
+    Raises:
+        ValueError: Si le profil est inconnu ("two-stage" se compose de "fast" puis "ocr")
+    """
+    if profile == "fast":
+        return [vision.Feature(type_=vision.Feature.Type.LABEL_DETECTION, max_results=20)]
+    if profile == "ocr":
+        return [vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)]
+    if profile == "full":
+        return [
+            vision.Feature(type_=vision.Feature.Type.LABEL_DETECTION, max_results=20),
+            vision.Feature(type_=vision.Feature.Type.TEXT_DETECTION),
+            vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION),
+            vision.Feature(type_=vision.Feature.Type.IMAGE_PROPERTIES)
+        ]
+    raise ValueError(f"Profil d'analyse inconnu: {profile} (profils: {', '.join(VISION_PROFILES)})")
+
+def is_retryable(error: BaseException) -> bool:
+    """Indique si l'échec d'un appel Vision entier est transitoire (les erreurs réseau hors API le sont)."""
+    return isinstance(error, RETRYABLE_EXCEPTIONS) or not isinstance(
+        error, (google_exceptions.GoogleAPICallError, VisionBatchError)
+    )
+
+class VisionBatchError(Exception):
+    """Échec de l'annotation d'une image par Vision."""
+
+    def __init__(self, message: str, code: Optional[int] = None):
+        super().__init__(message)
+        self.code = code
+
+class VisionUnavailableError(VisionBatchError):
+    """Vision refusé sans appel (disjoncteur ouvert): l'image n'est pas réessayée."""
+
+# Envoi d'un lot: (requêtes, priorité) -> réponse batch_annotate_images
+Dispatch = Callable[[List[vision.AnnotateImageRequest], str], Awaitable[vision.BatchAnnotateImagesResponse]]
+
+class _Pending:
+    """Image en attente d'annotation."""
+
+    __slots__ = ("request", "size", "future", "priority", "attempts")
+
+    def __init__(self, request: vision.AnnotateImageRequest, size: int, future: asyncio.Future, priority: str):
+        self.request = request
+        self.size = size
+        self.future = future
+        self.priority = priority
+        self.attempts = 0
+
+class VisionBatcher:
+    """Regroupe les annotations d'images en appels batch_annotate_images."""
+
+    def __init__(self, dispatch: Dispatch, max_images: int = VISION_BATCH_MAX_IMAGES,
+                 max_bytes: int = VISION_BATCH_MAX_BYTES, window: float = VISION_BATCH_WINDOW):
+        """
+        Initialise le regroupement.
+
+        Args:
+            dispatch: Envoi d'un lot à Vision (VisionGateway.dispatch)
+            max_images: Nombre maximum d'images par lot
+            max_bytes: Taille cumulée maximale des images d'un lot (une image plus grande part seule)
+            window: Attente maximale d'autres images avant l'envoi d'un lot incomplet
+        """
+        self.dispatch = dispatch
+        self.max_images = max(1, min(max_images, 16))
+        self.max_bytes = max_bytes
+        self.window = window
+
+        # Créé dans la boucle d'événements au premier appel
+        self._pending: List[_Pending] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+        self._stats = {"images": 0, "calls": 0, "batchedImages": 0, "retries": 0, "failures": 0, "callTime": 0.0}
+
+    async def annotate(self, content: bytes, features: List[vision.Feature],
+                       priority: str = "bulk") -> vision.AnnotateImageResponse:
+        """
+        Annote une image, au sein d'un lot partagé avec les autres images en attente.
+
+        Args:
+            content: Contenu binaire de l'image
+            features: Analyses demandées
+            priority: Priorité de l'image ("interactive" ou "bulk")
+
+        Returns:
+            La réponse Vision de cette image
+
+        Raises:
+            VisionBatchError: Si l'annotation de l'image échoue définitivement
+        """
+        loop = asyncio.get_running_loop()
+        request = vision.AnnotateImageRequest(image=vision.Image(content=content), features=features)
+        item = _Pending(request, len(content), loop.create_future(), priority)
+        self._stats["images"] += 1
+        self._enqueue(item)
+        return await item.future
+
+    def _enqueue(self, item: _Pending):
+        """Ajoute une image au lot en cours et l'envoie s'il est plein."""
+        self._pending.append(item)
+        if len(self._pending) >= self.max_images or sum(entry.size for entry in self._pending) >= self.max_bytes:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush)
+
+    def _flush(self):
+        """Envoie les images en attente, découpées en lots respectant les limites."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        # Les appelants partis (délai dépassé) ne consomment pas de quota ;
+        # les images de même priorité sont regroupées, les interactives d'abord
+        pending = sorted(
+            (item for item in self._pending if not item.future.done()),
+            key=lambda item: item.priority != "interactive"
+        )
+        self._pending = []
+
+        batch: List[_Pending] = []
+        batch_bytes = 0
+        for item in pending:
+            if batch and (len(batch) >= self.max_images or batch_bytes + item.size > self.max_bytes
+                          or item.priority != batch[0].priority):
+                asyncio.ensure_future(self._send(batch))
+                batch, batch_bytes = [], 0
+            batch.append(item)
+            batch_bytes += item.size
+        if batch:
+            asyncio.ensure_future(self._send(batch))
+
+    async def _send(self, batch: List[_Pending]):
+        """Envoie un lot et rend à chaque image sa réponse ; les échecs transitoires sont réessayés."""
+        start = time.time()
+        try:
+            response = await self.dispatch([item.request for item in batch], batch[0].priority)
+            responses = list(response.responses)
+            if len(responses) != len(batch):
+                raise VisionBatchError(f"Réponse incomplète: {len(responses)} réponse(s) pour {len(batch)} image(s)")
+        except Exception as e:
+            # Échec de l'appel entier: toutes les images du lot sont concernées
+            logger.warning(f"Échec d'un lot Vision de {len(batch)} image(s): {str(e)}")
+            # Les erreurs réseau hors API sont aussi considérées transitoires
+            retryable = is_retryable(e)
+            error = e if isinstance(e, VisionBatchError) else VisionBatchError(str(e))
+            for item in batch:
+                self._retry_or_fail(item, error, retryable)
+            return
+        finally:
+            self._stats["calls"] += 1
+            self._stats["batchedImages"] += len(batch)
+            self._stats["callTime"] += time.time() - start
+
+        for item, result in zip(batch, responses):
+            if result.error and result.error.code:
+                self._retry_or_fail(
+                    item,
+                    VisionBatchError(f"Erreur Vision {result.error.code}: {result.error.message}", result.error.code),
+                    result.error.code in RETRYABLE_CODES
+                )
+            elif not item.future.done():
+                item.future.set_result(result)
+
+    def _retry_or_fail(self, item: _Pending, error: VisionBatchError, retryable: bool):
+        """Remet une image en attente après un délai, ou lui transmet l'erreur."""
+        if item.future.done():
+            return
+
+        item.attempts += 1
+        if not retryable or item.attempts > VISION_BATCH_MAX_RETRIES:
+            self._stats["failures"] += 1
+            item.future.set_exception(error)
+            return
+
+        self._stats["retries"] += 1
+        delay = VISION_BATCH_BACKOFF_BASE * 2 ** (item.attempts - 1) * random.uniform(0.5, 1.0)
+        asyncio.get_running_loop().call_later(delay, self._enqueue, item)
+
+    def stats(self) -> Dict[str, Any]:
+        """Retourne les compteurs du regroupement pour /health."""
+        calls = self._stats["calls"]
+        return {
+            **self._stats,
+            "pending": len(self._pending),
+            "meanBatchSize": self._stats["batchedImages"] / calls if calls else None,
+            "maxImages": self.max_images,
+            "maxBytes": self.max_bytes
+        }
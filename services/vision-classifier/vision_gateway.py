@@ -0,0 +1,435 @@
+"""
+Passerelle d'accès à Google Vision pour TechnicIA.
+
+Tous les appels Vision d'un service passent par la passerelle, qui applique :
+
+- un seau à jetons conservé dans SQLite (VISION_QUOTA_DIR) : tous les
+  processus qui montent ce répertoire consomment le même quota d'images par
+  minute. Les fichiers compose y montent le volume nommé
+  technicia-vision-quota, commun à vision-classifier et schema-analyzer même
+  lancés par des fichiers compose différents sur le même hôte. Une erreur de
+  quota de Vision vide le seau pour tous ;
+- une file de priorité : les appels interactifs (/classify) passent devant
+  les analyses de documents en masse (/api/analyze), pour les places d'envoi
+  comme pour les jetons ;
+- un disjoncteur : après VISION_BREAKER_THRESHOLD échecs transitoires
+  consécutifs, les appels sont refusés sans attendre pendant
+  VISION_BREAKER_COOLDOWN secondes, puis un appel d'essai décide de la reprise.
+
+La priorité d'un appel est celle du contexte de la requête en cours
+(vision_priority), "bulk" par défaut. Chaque image attend au plus le temps
+restant sur le budget de sa requête (call_policy.py) ; un lot, partagé entre
+requêtes, a son propre délai (VISION_CALL_TIMEOUT) ; il n'est doublé s'il
+tarde que sur demande (VISION_HEDGE), la copie étant facturée et décomptée
+du quota comme le lot d'origine.
+
+Ce module est copié à l'identique dans chaque service qui appelle Vision,
+chaque service étant construit dans son propre contexte Docker.
+"""
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+from google.api_core import exceptions as google_exceptions
+from google.cloud import vision
+
+from call_policy import CallDeadlineExceeded, CallPolicy, remaining
+from vision_batch import VISION_BATCH_CONCURRENCY, VisionBatcher, VisionUnavailableError, is_retryable
+
+logger = logging.getLogger(__name__)
+
+# Quota Vision partagé: images par minute, rafale maximale et répertoire du seau (volume partagé)
+VISION_QUOTA_PER_MINUTE = float(os.getenv("VISION_QUOTA_PER_MINUTE", "1800"))
+VISION_QUOTA_BURST = float(os.getenv("VISION_QUOTA_BURST", "60"))
+VISION_QUOTA_DIR = os.getenv("VISION_QUOTA_DIR", os.getenv("TEMP_DIR", "/tmp/technicia-docs"))
+
+# Pause imposée à tous après une erreur de quota de Vision (secondes)
+VISION_QUOTA_PENALTY = float(os.getenv("VISION_QUOTA_PENALTY", "5.0"))
+
+# Délai maximum d'un appel batch_annotate_images (secondes)
+VISION_CALL_TIMEOUT = float(os.getenv("VISION_CALL_TIMEOUT", "60"))
+
+# Doubler les lots lents (désactivé par défaut: Vision ralentit surtout quand le quota est tendu)
+VISION_HEDGE = os.getenv("VISION_HEDGE", "false").lower() == "true"
+
+# Disjoncteur: échecs transitoires consécutifs avant ouverture, et durée d'ouverture (secondes)
+VISION_BREAKER_THRESHOLD = int(os.getenv("VISION_BREAKER_THRESHOLD", "5"))
+VISION_BREAKER_COOLDOWN = float(os.getenv("VISION_BREAKER_COOLDOWN", "30.0"))
+
+# Code google.rpc d'une erreur de quota
+RESOURCE_EXHAUSTED = 8
+
+# Priorités, de la plus forte à la plus faible
+PRIORITIES = ("interactive", "bulk")
+
+# Priorité des appels Vision de la requête en cours
+_priority: contextvars.ContextVar = contextvars.ContextVar("vision_priority", default="bulk")
+
+@contextlib.contextmanager
+def vision_priority(priority: str) -> Iterator[None]:
+    """
+    Fixe la priorité des appels Vision faits dans le bloc (et dans les tâches qu'il crée).
+
+    Args:
+        priority: "interactive" ou "bulk"
+    """
+    if priority not in PRIORITIES:
+        raise ValueError(f"Priorité inconnue: {priority} (priorités: {', '.join(PRIORITIES)})")
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+class QuotaBucket:
+    """Seau à jetons conservé dans SQLite, partagé entre processus et services."""
+
+    def __init__(self, rate_per_minute: float = VISION_QUOTA_PER_MINUTE, burst: float = VISION_QUOTA_BURST,
+                 path: Optional[str] = None):
+        """
+        Initialise le seau.
+
+        Args:
+            rate_per_minute: Jetons (images) ajoutés par minute
+            burst: Contenance du seau
+            path: Chemin explicite du fichier SQLite
+        """
+        self.rate = rate_per_minute / 60.0
+        self.burst = max(1.0, burst)
+        self.path = path or os.path.join(VISION_QUOTA_DIR, "vision-quota.sqlite")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        # Une connexion par thread et par processus
+        self._local = threading.local()
+        self._stats = {"acquired": 0, "throttled": 0, "throttledTime": 0.0, "penalties": 0}
+
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS bucket (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        """Retourne la connexion du thread courant, en la rouvrant après un fork."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _update(self, units: float, penalty: float = 0.0) -> float:
+        """
+        Prélève des jetons, ou vide le seau (penalty > 0), en une transaction.
+
+        Returns:
+            0 si les jetons sont prélevés, sinon l'attente estimée avant qu'ils soient disponibles
+        """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = conn.execute("SELECT tokens, updated_at FROM bucket WHERE name = 'vision'").fetchone()
+            tokens = self.burst if row is None else min(self.burst, row[0] + (now - row[1]) * self.rate)
+            wait = 0.0
+            if penalty:
+                # Solde négatif: plus aucun jeton avant la fin de la pause
+                tokens = min(tokens, -penalty * self.rate)
+            elif tokens >= units:
+                tokens -= units
+            else:
+                wait = (units - tokens) / self.rate
+            conn.execute(
+                "INSERT INTO bucket (name, tokens, updated_at) VALUES ('vision', ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at",
+                (tokens, now)
+            )
+            conn.execute("COMMIT")
+            return wait
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    async def acquire(self, units: int):
+        """
+        Attend que le seau contienne assez de jetons, puis les prélève.
+
+        Args:
+            units: Nombre d'images de l'appel (borné à la contenance du seau)
+        """
+        units = min(float(units), self.burst)
+        start = time.time()
+        throttled = False
+        while True:
+            wait = await asyncio.to_thread(self._update, units)
+            if not wait:
+                break
+            throttled = True
+            await asyncio.sleep(min(wait, 1.0))
+        self._stats["acquired"] += int(units)
+        if throttled:
+            self._stats["throttled"] += 1
+            self._stats["throttledTime"] += time.time() - start
+
+    async def penalize(self, seconds: float = VISION_QUOTA_PENALTY):
+        """Vide le seau pour tous les processus après une erreur de quota."""
+        self._stats["penalties"] += 1
+        await asyncio.to_thread(self._update, 0, seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        """Retourne les compteurs du seau pour /health."""
+        return {**self._stats, "perMinute": self.rate * 60, "burst": self.burst, "path": self.path}
+
+class CircuitBreaker:
+    """Disjoncteur: refuse les appels après une série d'échecs transitoires."""
+
+    def __init__(self, threshold: int = VISION_BREAKER_THRESHOLD, cooldown: float = VISION_BREAKER_COOLDOWN):
+        """
+        Initialise le disjoncteur.
+
+        Args:
+            threshold: Échecs consécutifs avant ouverture
+            cooldown: Durée d'ouverture avant un appel d'essai (secondes)
+        """
+        self.threshold = max(1, threshold)
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+        self._stats = {"opened": 0}
+
+    @property
+    def state(self) -> str:
+        """État du disjoncteur: "closed", "open" ou "half-open"."""
+        if self.opened_at is None:
+            return "closed"
+        return "open" if time.time() - self.opened_at < self.cooldown else "half-open"
+
+    def allow(self) -> bool:
+        """Indique si un appel peut partir (un seul appel d'essai à la fois en "half-open")."""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def abandon(self):
+        """Clôt un appel sans issue (annulé, ou quota inaccessible): un appel d'essai abandonné compte comme un échec."""
+        if self._probing:
+            self.record(False)
+
+    def record(self, success: bool):
+        """Enregistre l'issue d'un appel."""
+        self._probing = False
+        if success:
+            self.failures = 0
+            self.opened_at = None
+            return
+        self.failures += 1
+        if self.opened_at is not None or self.failures >= self.threshold:
+            if self.opened_at is None:
+                logger.warning(f"Disjoncteur Vision ouvert après {self.failures} échec(s) consécutif(s)")
+            self._stats["opened"] += 1
+            self.opened_at = time.time()
+
+    def stats(self) -> Dict[str, Any]:
+        """Retourne l'état du disjoncteur pour /health."""
+        return {**self._stats, "state": self.state, "failures": self.failures,
+                "threshold": self.threshold, "cooldown": self.cooldown}
+
+class VisionGateway:
+    """Accès unique à Vision: regroupement, priorités, quota partagé et disjoncteur."""
+
+    def __init__(self, client: vision.ImageAnnotatorClient, concurrency: int = VISION_BATCH_CONCURRENCY,
+                 bucket: Optional[QuotaBucket] = None):
+        """
+        Initialise la passerelle.
+
+        Args:
+            client: Client Vision
+            concurrency: Nombre maximum de lots envoyés simultanément
+            bucket: Seau à jetons (par défaut celui de VISION_QUOTA_DIR)
+        """
+        self.client = client
+        self.concurrency = max(1, concurrency)
+        self.bucket = bucket or QuotaBucket()
+        self.breaker = CircuitBreaker()
+        self.policy = CallPolicy("vision", VISION_CALL_TIMEOUT, hedge=VISION_HEDGE)
+        self.batcher = VisionBatcher(self.dispatch)
+
+        # Places d'envoi: lots en cours et file d'attente (priorité, ordre d'arrivée, futur)
+        self._active = 0
+        self._waiting: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+
+        # Mesures par priorité (latences des derniers lots, attente comprise)
+        self._metrics: Dict[str, Dict[str, Any]] = {
+            priority: {"calls": 0, "images": 0, "errors": 0, "rejected": 0, "queueTime": 0.0}
+            for priority in PRIORITIES
+        }
+        self._latencies: Dict[str, Deque[float]] = {priority: deque(maxlen=1000) for priority in PRIORITIES}
+
+    async def annotate(self, content: bytes, features: List[vision.Feature]) -> vision.AnnotateImageResponse:
+        """
+        Annote une image avec la priorité de la requête en cours.
+
+        Args:
+            content: Contenu binaire de l'image
+            features: Analyses demandées
+
+        Returns:
+            La réponse Vision de cette image
+
+        Raises:
+            VisionBatchError: Si l'annotation échoue définitivement
+            VisionUnavailableError: Si le disjoncteur est ouvert
+            CallDeadlineExceeded: Si le budget de la requête est épuisé avant la réponse
+        """
+        annotation = self.batcher.annotate(content, features, _priority.get())
+        left = remaining()
+        if left is None:
+            return await annotation
+        if left <= 0:
+            annotation.close()
+            raise CallDeadlineExceeded("vision: budget de la requête épuisé avant l'appel")
+        try:
+            # Une image abandonnée est retirée de son lot si celui-ci n'est pas encore parti
+            return await asyncio.wait_for(annotation, left)
+        except asyncio.TimeoutError:
+            raise CallDeadlineExceeded(f"vision: pas de réponse dans le budget de la requête ({left:.1f}s)")
+
+    async def _acquire_slot(self, rank: int):
+        """Attend une place d'envoi, les plus fortes priorités d'abord."""
+        if self._active < self.concurrency and not self._waiting:
+            self._active += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (rank, next(self._sequence), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Place déjà transmise à cet appel: la rendre au suivant
+            if future.done() and not future.cancelled():
+                self._release_slot()
+            raise
+
+    def _release_slot(self):
+        """Libère une place d'envoi au profit du premier appel en attente."""
+        while self._waiting:
+            _, _, future = heapq.heappop(self._waiting)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._active -= 1
+
+    async def dispatch(self, requests: List[vision.AnnotateImageRequest],
+                       priority: str) -> vision.BatchAnnotateImagesResponse:
+        """
+        Envoie un lot à Vision (appelé par le regroupement).
+
+        Args:
+            requests: Requêtes du lot
+            priority: Priorité du lot
+
+        Returns:
+            La réponse batch_annotate_images
+
+        Raises:
+            VisionUnavailableError: Si le disjoncteur est ouvert
+        """
+        metrics = self._metrics[priority]
+        start = time.time()
+        # Disjoncteur ouvert: refus immédiat, sans attendre de place d'envoi
+        if self.breaker.state == "open":
+            self._reject(metrics)
+        await self._acquire_slot(PRIORITIES.index(priority))
+        try:
+            if not self.breaker.allow():
+                self._reject(metrics)
+            # Toute sortie sans issue enregistrée (quota inaccessible, lot annulé) libère le disjoncteur,
+            # sans quoi un appel d'essai perdu le laisserait ouvert jusqu'au redémarrage
+            recorded = False
+            try:
+                await self.bucket.acquire(len(requests))
+                metrics["queueTime"] += time.time() - start
+
+                sent = 0
+
+                async def call(timeout: float) -> vision.BatchAnnotateImagesResponse:
+                    nonlocal sent
+                    sent += 1
+                    if sent > 1:
+                        # Copie doublée: l'appel d'origine n'est pas interrompu, les deux sont facturés
+                        await self.bucket.acquire(len(requests))
+                    return await asyncio.to_thread(
+                        self.client.batch_annotate_images, requests=requests, timeout=timeout
+                    )
+
+                try:
+                    # Le lot sert plusieurs requêtes: son délai ne dépend pas du budget de l'une d'elles
+                    response = await self.policy.run(call, budget=False)
+                except Exception as e:
+                    metrics["errors"] += 1
+                    self.breaker.record(not is_retryable(e))
+                    recorded = True
+                    if isinstance(e, google_exceptions.ResourceExhausted):
+                        await self.bucket.penalize()
+                    raise
+                self.breaker.record(True)
+                recorded = True
+            finally:
+                if not recorded:
+                    self.breaker.abandon()
+            # Erreur de quota sur une image du lot: la pause s'applique aussi
+            if any(result.error and result.error.code == RESOURCE_EXHAUSTED for result in response.responses):
+                await self.bucket.penalize()
+        finally:
+            self._release_slot()
+
+        metrics["calls"] += 1
+        metrics["images"] += len(requests)
+        self._latencies[priority].append(time.time() - start)
+        return response
+
+    def _reject(self, metrics: Dict[str, Any]):
+        """Refuse un lot tant que le disjoncteur est ouvert."""
+        metrics["rejected"] += 1
+        raise VisionUnavailableError(
+            f"Vision indisponible (disjoncteur ouvert après {self.breaker.failures} échec(s))"
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        """Retourne les mesures de la passerelle pour /health."""
+        priorities = {}
+        for priority in PRIORITIES:
+            latencies = sorted(self._latencies[priority])
+            calls = self._metrics[priority]["calls"]
+
+            def percentile(p: float) -> Optional[float]:
+                return latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else None
+
+            priorities[priority] = {
+                **self._metrics[priority],
+                "meanQueueTime": self._metrics[priority]["queueTime"] / calls if calls else None,
+                "latency": {"p50": percentile(0.5), "p95": percentile(0.95), "p99": percentile(0.99)}
+            }
+        return {
+            "concurrency": self.concurrency,
+            "active": self._active,
+            "waiting": len(self._waiting),
+            "priorities": priorities,
+            "quota": self.bucket.stats(),
+            "breaker": self.breaker.stats(),
+            "calls": self.policy.stats()
+        }
@@ -0,0 +1,14 @@
+"""
+Configuration commune des tests unitaires.
+
+Les journaux, caches et fichiers de travail des services sont placés dans un
+répertoire temporaire, avant l'import des modules qui lisent ces chemins.
+"""
+import os
+import tempfile
+
+_root = tempfile.mkdtemp(prefix="technicia-tests-")
+os.environ.setdefault("TEMP_DIR", os.path.join(_root, "work"))
+os.environ.setdefault("JOB_STORE_DIR", os.path.join(_root, "jobs"))
+os.environ.setdefault("SHARED_CACHE_DIR", os.path.join(_root, "cache"))
+os.environ.setdefault("VISION_QUOTA_DIR", os.path.join(_root, "vision-quota"))
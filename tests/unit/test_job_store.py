@@ -0,0 +1,88 @@
+"""
+Vérifie le journal des jobs : un job n'a qu'un propriétaire vivant à la fois,
+et seul son propriétaire peut le terminer ou le marquer en erreur.
+
+Exécution (avec les dépendances de services/document-processor installées) :
+    python -m pytest tests/unit
+"""
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "services" / "document-processor"))
+
+import job_store  # noqa: E402
+from job_store import JobStore  # noqa: E402
+
+@pytest.fixture
+def workers(tmp_path):
+    """Deux processus d'un même service, partageant le même journal."""
+    path = str(tmp_path / "jobs.sqlite")
+    return JobStore("jobs", path), JobStore("jobs", path)
+
+def test_only_one_live_owner(workers):
+    first, second = workers
+    first.create("job", "ingest", {"documentId": "doc"})
+    assert first.claim("job")
+    assert not second.claim("job")
+    # Reprendre son propre job ne compte pas comme une nouvelle tentative
+    assert first.claim("job")
+    job = first.get("job")
+    assert job["owner"] == first.owner and job["attempts"] == 1 and job["status"] == "processing"
+
+def test_created_claimed(workers):
+    first, second = workers
+    job = first.create("job", "ingest", {}, False, True)
+    assert job["owner"] == first.owner
+    assert not second.claim("job")
+    # Un job existant n'est pas remplacé
+    assert second.create("job", "ingest", {}, False, True)["owner"] == first.owner
+
+def test_stale_job_is_taken_over(workers):
+    first, second = workers
+    first.create("job", "ingest", {})
+    assert first.claim("job")
+    first._connect().execute("UPDATE jobs SET heartbeat_at = ?", (time.time() - job_store.JOB_STALE_SECONDS - 1,))
+    assert second.claim("job")
+    assert second.get("job")["attempts"] == 2
+
+    # L'ancien propriétaire ne peut plus ni terminer ni faire échouer le job
+    first.put_checkpoint("job", "ocr", {"pages": 3})
+    first.finish("job", {"from": "first"})
+    first.fail("job", "interrompu")
+    job = second.get("job")
+    assert job["status"] == "processing" and job["owner"] == second.owner and job["error"] is None
+    assert second.get_checkpoint("job", "ocr") == {"pages": 3}
+
+    second.finish("job", {"from": "second"})
+    job = second.get("job")
+    assert job["status"] == "completed" and job["result"] == {"from": "second"} and job["owner"] is None
+    assert second.get_checkpoint("job", "ocr") is None
+
+def test_completed_job_cannot_be_claimed(workers):
+    first, second = workers
+    first.create("job", "ingest", {}, False, True)
+    first.finish("job", {"ok": True})
+    assert not first.claim("job")
+    assert not second.claim("job")
+
+def test_failed_job_keeps_checkpoints_and_can_be_retried(workers):
+    first, second = workers
+    first.create("job", "ingest", {}, False, True)
+    first.put_checkpoint("job", "ocr", [1, 2])
+    first.fail("job", "quota dépassé")
+    job = first.get("job")
+    assert job["status"] == "error" and job["error"] == "quota dépassé" and job["owner"] is None
+    assert second.claim("job")
+    assert second.get_checkpoint("job", "ocr") == [1, 2]
+
+def test_release_hands_the_job_back(workers):
+    first, second = workers
+    first.create("job", "ingest", {}, False, True)
+    second.release("job")
+    assert first.get("job")["owner"] == first.owner
+    first.release("job")
+    assert first.get("job")["status"] == "pending"
+    assert second.claim("job")
@@ -0,0 +1,73 @@
+"""
+Vérifie le découpage en lots de document-processor et la stabilité des
+empreintes de pages quand un PDF est réenregistré sans modification.
+
+Exécution (avec les dépendances de services/document-processor installées) :
+    python -m pytest tests/unit
+"""
+import sys
+from pathlib import Path
+
+import fitz
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "services" / "document-processor"))
+
+import pdf_tools  # noqa: E402
+
+def test_plan_shards():
+    assert pdf_tools.plan_shards([1, 2, 3, 4, 5], 2) == [[1, 2], [3, 4], [5]]
+    assert pdf_tools.plan_shards([3, 7], 10) == [[3, 7]]
+    assert pdf_tools.plan_shards([], 4) == []
+
+def test_page_ranges():
+    assert pdf_tools._page_ranges([1, 2, 3, 5, 7, 8]) == [(1, 3), (5, 5), (7, 8)]
+    assert pdf_tools._page_ranges([4]) == [(4, 4)]
+    assert pdf_tools._page_ranges([]) == []
+
+def _write_manual(path: Path, **save_options):
+    """Trois pages de texte, la deuxième avec une image, précédées d'objets inutilisés."""
+    pixmap = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 32, 32), False)
+    pixmap.set_rect(pixmap.irect, (200, 30, 30))
+    with fitz.open() as pdf:
+        # Retirés par un nettoyage (garbage): les objets suivants sont renumérotés
+        for _ in range(3):
+            pdf.update_object(pdf.get_new_xref(), "<< /Unused true >>")
+        for number in range(1, 4):
+            page = pdf.new_page()
+            page.insert_text((72, 72), f"Page {number}: couple de serrage 25 N.m")
+            if number == 2:
+                page.insert_image(fitz.Rect(100, 100, 200, 200), pixmap=pixmap)
+        pdf.save(str(path), **save_options)
+
+def _fingerprints(path: Path):
+    return [page["fingerprint"] for page in pdf_tools.page_fingerprints(str(path), [1, 2, 3])]
+
+def test_fingerprints_survive_resave(tmp_path):
+    original = tmp_path / "original.pdf"
+    _write_manual(original)
+    reference = _fingerprints(original)
+    assert len(set(reference)) == 3
+
+    # Recompression et renumérotation des objets
+    resaved = tmp_path / "resaved.pdf"
+    with fitz.open(str(original)) as pdf:
+        pdf.save(str(resaved), garbage=4, deflate=True)
+    assert _fingerprints(resaved) == reference
+
+    uncompressed = tmp_path / "uncompressed.pdf"
+    with fitz.open(str(resaved)) as pdf:
+        pdf.save(str(uncompressed), garbage=3, expand=255)
+    assert _fingerprints(uncompressed) == reference
+
+def test_fingerprints_change_with_content(tmp_path):
+    original = tmp_path / "original.pdf"
+    _write_manual(original)
+    reference = _fingerprints(original)
+
+    edited = tmp_path / "edited.pdf"
+    with fitz.open(str(original)) as pdf:
+        pdf[2].insert_text((72, 120), "Révision B")
+        pdf.save(str(edited), garbage=4, deflate=True)
+    fingerprints = _fingerprints(edited)
+    assert fingerprints[:2] == reference[:2]
+    assert fingerprints[2] != reference[2]
@@ -0,0 +1,42 @@
+"""
+Vérifie que la pré-classification de schema-analyzer ne prend pas un schéma
+grand format aux traits fins pour une image vide.
+
+Exécution (avec les dépendances de services/schema-analyzer installées) :
+    python -m pytest tests/unit
+"""
+import io
+import sys
+from pathlib import Path
+
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "services" / "schema-analyzer"))
+
+import preclassifier  # noqa: E402
+
+def _encode(image: Image.Image, format: str) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format)
+    return buffer.getvalue()
+
+def _sparse_schematic() -> Image.Image:
+    """Scan A1 (~7000 px) de quelques traits de 2 px: moins de 0,2 % d'encre une fois réduit."""
+    image = Image.new("RGB", (7000, 5000), (255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    for y in (800, 2500, 4200):
+        draw.line([(300, y), (6700, y)], fill=(0, 0, 0), width=2)
+    for x in (1500, 5500):
+        draw.line([(x, 800), (x, 4200)], fill=(0, 0, 0), width=2)
+    return image
+
+def test_sparse_schematic_is_not_blank():
+    for format in ("PNG", "JPEG"):
+        result = preclassifier.preclassify(_encode(_sparse_schematic(), format))
+        assert result["reason"] != "blank", format
+        assert result["decision"] == "vision", format
+
+def test_blank_scan_is_still_blank():
+    result = preclassifier.preclassify(_encode(Image.new("RGB", (7000, 5000), (250, 250, 250)), "PNG"))
+    assert result["decision"] == "decorative"
+    assert result["reason"] == "blank"
@@ -0,0 +1,96 @@
+"""
+Vérifie l'ingestion incrémentale de document-processor : seules les pages
+modifiées sont retraitées, et une page dont une image a échoué l'est de
+nouveau à la révision suivante.
+
+Exécution (avec les dépendances de services/document-processor installées) :
+    python -m pytest tests/unit
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "services" / "document-processor"))
+
+import main  # noqa: E402
+from job_store import JobStore  # noqa: E402
+from revisions import RevisionStore, compare, settle  # noqa: E402
+
+def test_compare_first_revision():
+    assert compare(None, ["a", "b"]) == {"changedPages": [1, 2], "removedPages": [], "unchangedPages": []}
+
+def test_compare_changed_added_and_removed_pages():
+    assert compare(["a", "b", "c"], ["a", "x", "c", "d"]) == {
+        "changedPages": [2, 4], "removedPages": [], "unchangedPages": [1, 3]
+    }
+    assert compare(["a", "b", "c"], ["a", "b"]) == {
+        "changedPages": [], "removedPages": [3], "unchangedPages": [1, 2]
+    }
+
+def test_failed_pages_are_seen_as_changed():
+    stored = settle(["a", "b", "c"], [2])
+    assert stored == ["a", None, "c"]
+    assert compare(stored, ["a", "b", "c"])["changedPages"] == [2]
+
+def test_revision_store_round_trip(tmp_path):
+    store = RevisionStore(str(tmp_path / "revisions.sqlite"))
+    assert store.get("doc") is None
+    store.put("doc", "hash-1", ["a", None])
+    revision = store.get("doc")
+    assert revision["fileHash"] == "hash-1"
+    assert revision["fingerprints"] == ["a", None]
+
+class _FakePipeline:
+    """Pipeline d'ingestion factice: enregistre les pages demandées et fait échouer une image au besoin."""
+
+    calls = []
+    failed_pages = []
+
+    def __init__(self, document_id, file_path, output_path, pages, retire_pages, **kwargs):
+        self.pages = pages
+        self.retire_pages = retire_pages
+
+    async def run(self):
+        _FakePipeline.calls.append({"pages": self.pages, "retirePages": self.retire_pages})
+        failed = [page for page in _FakePipeline.failed_pages if page in self.pages]
+        return {"failedImages": [{"path": f"page-{page}.png", "pages": [page]} for page in failed]}
+
+def test_ingest_retries_pages_with_failed_images(tmp_path, monkeypatch):
+    pdf = tmp_path / "manuel.pdf"
+    pdf.write_bytes(b"%PDF-1.4\n")
+    fingerprints = ["a", "b", "c"]
+
+    async def fingerprint_pages(file_path):
+        return list(fingerprints)
+
+    monkeypatch.setattr(main.extraction, "fingerprint_pages", fingerprint_pages)
+    monkeypatch.setattr(main.pipeline, "IngestionPipeline", _FakePipeline)
+    monkeypatch.setattr(main, "job_store", JobStore("ingest", str(tmp_path / "jobs.sqlite")))
+    monkeypatch.setattr(main, "revision_store", RevisionStore(str(tmp_path / "revisions.sqlite")))
+    monkeypatch.setattr(_FakePipeline, "calls", [])
+
+    def ingest(job_id):
+        main.job_store.create(job_id, "ingest", {}, False, True)
+        request = main.IngestRequest(documentId="doc", filePath=str(pdf), fileHash="hash",
+                                     outputPath=str(tmp_path / "out"))
+        return asyncio.run(main.run_ingest_job(request, job_id))
+
+    # Première révision: l'image de la page 2 échoue
+    monkeypatch.setattr(_FakePipeline, "failed_pages", [2])
+    result = ingest("job-1")
+    assert _FakePipeline.calls[-1] == {"pages": [1, 2, 3], "retirePages": []}
+    assert result["revision"]["failedPages"] == [2]
+    assert main.job_store.get("job-1")["status"] == "completed"
+
+    # Même contenu: seule la page incomplète est retraitée, et ses vecteurs retirés
+    monkeypatch.setattr(_FakePipeline, "failed_pages", [])
+    result = ingest("job-2")
+    assert _FakePipeline.calls[-1] == {"pages": [2], "retirePages": [2]}
+    assert result["revision"]["unchangedPages"] == [1, 3]
+
+    # Tout est désormais à jour; une page modifiée est seule retraitée
+    ingest("job-3")
+    assert _FakePipeline.calls[-1] == {"pages": [], "retirePages": []}
+    fingerprints[2] = "c2"
+    ingest("job-4")
+    assert _FakePipeline.calls[-1] == {"pages": [3], "retirePages": [3]}
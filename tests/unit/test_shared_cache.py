@@ -0,0 +1,81 @@
+"""
+Vérifie l'expiration et l'éviction LRU du cache partagé entre workers.
+
+Exécution (avec les dépendances de services/document-processor installées) :
+    python -m pytest tests/unit
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "services" / "document-processor"))
+
+import shared_cache  # noqa: E402
+from shared_cache import SharedCache  # noqa: E402
+
+class _Clock:
+    """Horloge manuelle substituée au module time du cache."""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(shared_cache, "time", clock)
+    return clock
+
+def test_entries_expire(tmp_path, clock):
+    cache = SharedCache("ttl", ttl=10, path=str(tmp_path / "cache.sqlite"))
+    cache.set("court", "a", ttl=1)
+    cache.set("défaut", {"b": [1, 2]})
+    cache.set("permanent", "c", ttl=None)
+
+    clock.now += 5
+    assert cache.get("court") is None
+    assert cache.get("défaut") == {"b": [1, 2]}
+
+    clock.now += 10
+    assert cache.get("défaut", "absent") == "absent"
+
+def test_entries_without_ttl_do_not_expire(tmp_path, clock):
+    cache = SharedCache("forever", path=str(tmp_path / "cache.sqlite"))
+    cache.set("clé", "valeur")
+    clock.now += 365 * 24 * 3600
+    assert cache.get("clé") == "valeur"
+
+def test_least_recently_used_is_evicted(tmp_path, clock):
+    cache = SharedCache("lru", maxsize=2, path=str(tmp_path / "cache.sqlite"))
+    cache.set("a", 1)
+    clock.now += 1
+    cache.set("b", 2)
+    clock.now += 1
+    # Lire "a" le rend plus récent que "b"
+    assert cache.get("a") == 1
+    clock.now += 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["entries"] == 2
+
+def test_byte_limit_evicts_oldest(tmp_path, clock):
+    cache = SharedCache("bytes", max_bytes=600, path=str(tmp_path / "cache.sqlite"))
+    for index in range(5):
+        # Valeurs peu compressibles, d'environ 200 octets une fois compressées
+        cache.set(f"k{index}", [f"{index}-{n * 7919 % 10007}" for n in range(40)])
+        clock.now += 1
+    assert cache.get("k0") is None
+    assert cache.get("k4") is not None
+    assert cache.stats()["entries"] < 5
+
+def test_entries_are_shared_between_workers(tmp_path, clock):
+    path = str(tmp_path / "cache.sqlite")
+    first, second = SharedCache("shared", path=path), SharedCache("shared", path=path)
+    first.set("clé", "valeur")
+    assert second.get("clé") == "valeur"
+    second.delete("clé")
+    assert first.get("clé") is None
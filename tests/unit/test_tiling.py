@@ -0,0 +1,62 @@
+"""
+Vérifie le découpage en tuiles de l'OCR de schema-analyzer et la fusion des
+mots lus dans les zones de chevauchement.
+
+Exécution (avec les dépendances de services/schema-analyzer installées) :
+    python -m pytest tests/unit
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "services" / "schema-analyzer"))
+
+import tiling  # noqa: E402
+
+def test_small_image_is_a_single_tile():
+    assert tiling.plan_tiles(1500, 1000, 2048, 256) == [[0, 0, 1500, 1000]]
+
+def test_tiles_cover_the_image_with_overlap():
+    width, height = 7000, 5000
+    tiles = tiling.plan_tiles(width, height, 2048, 256)
+    columns = sorted({(x0, x1) for x0, _, x1, _ in tiles})
+    rows = sorted({(y0, y1) for _, y0, _, y1 in tiles})
+    assert len(tiles) == len(columns) * len(rows)
+    for spans, length in ((columns, width), (rows, height)):
+        assert spans[0][0] == 0 and spans[-1][1] == length
+        assert all(end - start == 2048 for start, end in spans)
+        assert all(previous[1] - following[0] >= 256 for previous, following in zip(spans, spans[1:]))
+
+def test_tiles_grow_beyond_max_tiles():
+    tiles = tiling.plan_tiles(20000, 20000, 2048, 256, max_tiles=16)
+    assert len(tiles) <= 16
+    assert tiles[0][2] - tiles[0][0] > 2048
+    assert tiles[-1][2:] == [20000, 20000]
+
+def _word(text, x0, x1, tile_x0):
+    """Mot de 20 px de haut, aux abscisses x0..x1 de l'image, relatif à une tuile commençant en tile_x0."""
+    return {"text": text, "box": [x0 - tile_x0, 100, x1 - tile_x0, 120]}
+
+def test_merge_words_keeps_overlap_words_once():
+    # Deux tuiles [0, 2048] et [952, 3000] ; le milieu du chevauchement est à 1500
+    left, right = tiling.plan_tiles(3000, 1000, 2048, 256)
+    tiles = [
+        {"box": left, "words": [_word("K1", 100, 160, 0), _word("X12", 1400, 1460, 0)]},
+        {"box": right, "words": [_word("X12", 1400, 1460, 952), _word("M3", 2500, 2560, 952)]}
+    ]
+    merged = tiling.merge_words(tiles, 3000, 1000)
+    assert [word["text"] for word in merged["words"]] == ["K1", "X12", "M3"]
+    assert merged["duplicates"] == 1
+    assert merged["words"][2]["box"] == [2500, 100, 2560, 120]
+
+def test_merge_words_without_failed_tile_words():
+    left, right = tiling.plan_tiles(3000, 1000, 2048, 256)
+    overlap_word = _word("X12", 1000, 1060, 952)
+
+    # La tuile de gauche possède ce mot: la copie de droite est écartée
+    merged = tiling.merge_words([{"box": left, "words": []}, {"box": right, "words": [overlap_word]}], 3000, 1000)
+    assert merged["words"] == [] and merged["duplicates"] == 1
+
+    # La tuile de gauche a échoué: sa voisine garde tout le chevauchement
+    merged = tiling.merge_words([{"box": left, "words": None}, {"box": right, "words": [overlap_word]}], 3000, 1000)
+    assert [word["text"] for word in merged["words"]] == ["X12"]
+    assert merged["duplicates"] == 0
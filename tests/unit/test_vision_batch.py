@@ -0,0 +1,117 @@
+"""
+Vérifie le regroupement des appels Vision de schema-analyzer : découpage des
+lots, réponses rendues à chaque image et nouvelles tentatives des seules
+entrées en échec transitoire.
+
+Exécution (avec les dépendances de services/schema-analyzer installées) :
+    python -m pytest tests/unit
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+from google.cloud import vision
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "services" / "schema-analyzer"))
+
+import vision_batch  # noqa: E402
+from vision_batch import VisionBatchError, VisionBatcher  # noqa: E402
+
+FEATURES = vision_batch.profile_features("fast")
+
+class _FakeVision:
+    """Envoi factice: chaque réponse porte le contenu de son image ; failures donne les échecs à simuler."""
+
+    def __init__(self, failures=None):
+        self.batches = []
+        self.failures = failures or {}
+
+    async def dispatch(self, requests, priority):
+        contents = [request.image.content.decode() for request in requests]
+        self.batches.append((priority, contents))
+        failure = self.failures.get("*")
+        if failure:
+            self.failures["*"] = None
+            raise failure
+        responses = []
+        for content in contents:
+            codes = self.failures.get(content)
+            if codes:
+                responses.append(vision.AnnotateImageResponse(error={"code": codes.pop(0), "message": "échec"}))
+            else:
+                responses.append(vision.AnnotateImageResponse(
+                    label_annotations=[vision.EntityAnnotation(description=content)]
+                ))
+        return vision.BatchAnnotateImagesResponse(responses=responses)
+
+@pytest.fixture(autouse=True)
+def _no_backoff(monkeypatch):
+    monkeypatch.setattr(vision_batch, "VISION_BATCH_BACKOFF_BASE", 0.0)
+
+def _annotate_all(batcher, contents, priorities=None):
+    async def run():
+        calls = [
+            batcher.annotate(content.encode(), FEATURES, (priorities or {}).get(content, "bulk"))
+            for content in contents
+        ]
+        return await asyncio.gather(*calls, return_exceptions=True)
+    return asyncio.run(run())
+
+def _label(response):
+    return response.label_annotations[0].description
+
+def test_batches_are_split_by_count():
+    fake = _FakeVision()
+    batcher = VisionBatcher(fake.dispatch, max_images=2, window=0.01)
+    results = _annotate_all(batcher, ["a", "b", "c", "d", "e"])
+    assert [_label(result) for result in results] == ["a", "b", "c", "d", "e"]
+    assert sorted(len(contents) for _, contents in fake.batches) == [1, 2, 2]
+
+def test_batches_are_split_by_bytes():
+    fake = _FakeVision()
+    batcher = VisionBatcher(fake.dispatch, max_images=16, max_bytes=10, window=0.01)
+    results = _annotate_all(batcher, ["aaaa", "bbbb", "cccc"])
+    assert [_label(result) for result in results] == ["aaaa", "bbbb", "cccc"]
+    assert [contents for _, contents in fake.batches] == [["aaaa", "bbbb"], ["cccc"]]
+
+def test_priorities_are_not_mixed():
+    fake = _FakeVision()
+    batcher = VisionBatcher(fake.dispatch, window=0.01)
+    _annotate_all(batcher, ["a", "b", "c"], {"b": "interactive"})
+    assert fake.batches == [("interactive", ["b"]), ("bulk", ["a", "c"])]
+
+def test_only_transient_failures_are_retried():
+    # UNAVAILABLE (14) deux fois pour "b", INVALID_ARGUMENT (3) pour "c"
+    fake = _FakeVision({"b": [14, 14], "c": [3]})
+    batcher = VisionBatcher(fake.dispatch, window=0.01)
+    a, b, c = _annotate_all(batcher, ["a", "b", "c"])
+    assert _label(a) == "a" and _label(b) == "b"
+    assert isinstance(c, VisionBatchError) and c.code == 3
+    # Seule "b" repasse, dans les lots suivants
+    assert [contents for _, contents in fake.batches] == [["a", "b", "c"], ["b"], ["b"]]
+    assert batcher.stats()["retries"] == 2
+    assert batcher.stats()["failures"] == 1
+
+def test_retries_are_bounded(monkeypatch):
+    monkeypatch.setattr(vision_batch, "VISION_BATCH_MAX_RETRIES", 2)
+    fake = _FakeVision({"a": [8, 8, 8, 8]})
+    batcher = VisionBatcher(fake.dispatch, window=0.01)
+    (result,) = _annotate_all(batcher, ["a"])
+    assert isinstance(result, VisionBatchError) and result.code == 8
+    assert len(fake.batches) == 3
+
+def test_failed_call_retries_the_whole_batch():
+    fake = _FakeVision({"*": google_exceptions.ServiceUnavailable("indisponible")})
+    batcher = VisionBatcher(fake.dispatch, window=0.01)
+    results = _annotate_all(batcher, ["a", "b"])
+    assert [_label(result) for result in results] == ["a", "b"]
+    assert [contents for _, contents in fake.batches] == [["a", "b"], ["a", "b"]]
+
+def test_failed_call_is_not_retried_on_client_error():
+    fake = _FakeVision({"*": google_exceptions.InvalidArgument("requête invalide")})
+    batcher = VisionBatcher(fake.dispatch, window=0.01)
+    results = _annotate_all(batcher, ["a", "b"])
+    assert all(isinstance(result, VisionBatchError) for result in results)
+    assert len(fake.batches) == 1